@@ -134,7 +134,121 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Cache
+# پاسخ‌های LLM در cache فایلی ذخیره می‌شوند تا پس از restart هم معتبر بمانند
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'qa_answers': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('QA_ANSWER_CACHE_DIR', str(BASE_DIR / 'cache' / 'qa_answers')),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
 # LangChain settings
 LANGCHAIN_MODEL = os.getenv('LANGCHAIN_MODEL', 'gpt-3.5-turbo')
 EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
-
+# backend اجرای مدل embedding: torch (PyTorch)، onnx (ONNX Runtime) یا onnx-int8 (ONNX با وزن‌های int8)
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+# محل فایل‌های ONNX (ساخته شده با دستور export_onnx) و تعداد thread های ONNX Runtime (0 یعنی پیش‌فرض onnxruntime)
+EMBEDDING_ONNX_DIR = os.getenv('EMBEDDING_ONNX_DIR', str(BASE_DIR / 'models' / 'onnx'))
+EMBEDDING_ONNX_THREADS = int(os.getenv('EMBEDDING_ONNX_THREADS', '0'))
+
+
+# Semantic search settings
+# اندازه قطعه‌ها (کاراکتر) و هم‌پوشانی قطعه‌های متوالی در index معنایی
+SEARCH_CHUNK_SIZE = int(os.getenv('SEARCH_CHUNK_SIZE', '800'))
+SEARCH_CHUNK_OVERLAP = int(os.getenv('SEARCH_CHUNK_OVERLAP', '150'))
+# حداکثر تعداد قطعه منطبق که برای هر سند برگردانده و در prompt استفاده می‌شود
+SEARCH_PASSAGES_PER_DOCUMENT = int(os.getenv('SEARCH_PASSAGES_PER_DOCUMENT', '2'))
+# نوع index در FAISS (رشته index_factory)، مثلاً Flat، HNSW32، IVF{nlist},Flat یا IVF{nlist},PQ32؛
+# SQ8 و SQfp16 (یا HNSW32,SQ8) حافظه index را 4 و 2 برابر کاهش می‌دهند
+SEARCH_INDEX_FACTORY = os.getenv('SEARCH_INDEX_FACTORY', 'Flat')
+# معیار شباهت: cosine (embedding های نرمال شده با inner product) یا l2 (فاصله اقلیدسی)
+SEARCH_INDEX_METRIC = os.getenv('SEARCH_INDEX_METRIC', 'cosine')
+# قالب ذخیره embedding قطعه‌ها در دیتابیس: float32، float16 یا int8 (با ضریب برای هر بردار)
+SEARCH_EMBEDDING_DTYPE = os.getenv('SEARCH_EMBEDDING_DTYPE', 'float32')
+# حداکثر تعداد بردار برای آموزش index های IVF/PQ
+SEARCH_INDEX_TRAINING_SAMPLE = int(os.getenv('SEARCH_INDEX_TRAINING_SAMPLE', '100000'))
+# تعداد اسناد هر دسته در ساخت مجدد index (خواندن از دیتابیس و encode)
+SEARCH_REBUILD_BATCH_SIZE = int(os.getenv('SEARCH_REBUILD_BATCH_SIZE', '1000'))
+# پارامترهای پیش‌فرض جستجو: تعداد خوشه‌های بررسی شده در IVF و عمق جستجو در HNSW
+SEARCH_NPROBE = int(os.getenv('SEARCH_NPROBE', '8'))
+SEARCH_EF_SEARCH = int(os.getenv('SEARCH_EF_SEARCH', '64'))
+# index هایی که حذف را پشتیبانی نمی‌کنند (HNSW) بردارهای حذف شده را فقط علامت می‌زنند؛ وقتی سهم
+# این بردارها از این نسبت بیشتر شود index از embedding های ذخیره شده دوباره ساخته می‌شود
+SEARCH_INDEX_MAX_DELETED_RATIO = float(os.getenv('SEARCH_INDEX_MAX_DELETED_RATIO', '0.2'))
+# تعداد mask های فیلتر (برچسب، تاریخ، ایجاد کننده) که برای هر نسخه index در حافظه نگه داشته می‌شوند
+SEARCH_FILTER_CACHE_SIZE = int(os.getenv('SEARCH_FILTER_CACHE_SIZE', '256'))
+# پوشه snapshot های نسخه‌دار index، تعداد snapshot های نگهداری شده و فاصله بررسی snapshot جدید (ثانیه)
+SEARCH_INDEX_DIR = os.getenv('SEARCH_INDEX_DIR', str(BASE_DIR / 'search_index'))
+SEARCH_INDEX_KEEP_SNAPSHOTS = int(os.getenv('SEARCH_INDEX_KEEP_SNAPSHOTS', '3'))
+SEARCH_INDEX_RELOAD_INTERVAL = float(os.getenv('SEARCH_INDEX_RELOAD_INTERVAL', '1.0'))
+# بارگذاری index به صورت memory-mapped و فقط خواندنی تا worker ها page cache مشترک داشته باشند
+SEARCH_INDEX_MMAP = os.getenv('SEARCH_INDEX_MMAP', 'True') == 'True'
+# تعداد دفعات تلاش برای اعمال وظیفه صف index؛ پس از آن وظیفه ناموفق علامت می‌خورد و کنار گذاشته می‌شود
+INDEX_QUEUE_MAX_ATTEMPTS = int(os.getenv('INDEX_QUEUE_MAX_ATTEMPTS', '3'))
+# بارگذاری مدل embedding، index و LLM هنگام راه‌اندازی برنامه به جای اولین درخواست
+SEARCH_WARMUP_ON_STARTUP = os.getenv('SEARCH_WARMUP_ON_STARTUP', 'False') == 'True'
+# ظرفیت cache های LRU برای embedding query ها و نتایج جستجو (0 برای غیرفعال کردن)
+SEARCH_QUERY_CACHE_SIZE = int(os.getenv('SEARCH_QUERY_CACHE_SIZE', '1024'))
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv('SEARCH_RESULT_CACHE_SIZE', '1024'))
+# دسته‌بندی query های هم‌زمان: حداکثر اندازه دسته و حداکثر انتظار برای تکمیل دسته (میلی‌ثانیه)
+# با SEARCH_BATCH_MAX_SIZE=1 هر query جداگانه encode و جستجو می‌شود
+SEARCH_BATCH_MAX_SIZE = int(os.getenv('SEARCH_BATCH_MAX_SIZE', '32'))
+SEARCH_BATCH_MAX_WAIT_MS = float(os.getenv('SEARCH_BATCH_MAX_WAIT_MS', '2'))
+# حداکثر تعداد query در هر درخواست endpoint جستجوی دسته‌ای
+SEARCH_BATCH_MAX_QUERIES = int(os.getenv('SEARCH_BATCH_MAX_QUERIES', '1000'))
+# نوع جستجوی پیش‌فرض: semantic (FAISS)، lexical (BM25 با جدول FTS5) یا hybrid (ادغام هر دو)
+SEARCH_DEFAULT_TYPE = os.getenv('SEARCH_DEFAULT_TYPE', 'semantic')
+# تعداد نتایج هر روش که در جستجوی hybrid ادغام می‌شوند و ثابت k در Reciprocal Rank Fusion
+SEARCH_HYBRID_CANDIDATES = int(os.getenv('SEARCH_HYBRID_CANDIDATES', '50'))
+SEARCH_RRF_K = int(os.getenv('SEARCH_RRF_K', '60'))
+# rerank نتایج جستجوی معنایی با cross-encoder محلی (پیش‌فرض درخواست‌ها؛ هر درخواست می‌تواند با rerank تغییر دهد)
+SEARCH_RERANK = os.getenv('SEARCH_RERANK', 'False') == 'True'
+SEARCH_RERANK_MODEL = os.getenv('SEARCH_RERANK_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+# تعداد اسناد نامزد از جستجوی FAISS، اندازه دسته امتیازدهی و حداکثر طول ورودی (توکن) cross-encoder
+SEARCH_RERANK_CANDIDATES = int(os.getenv('SEARCH_RERANK_CANDIDATES', '50'))
+SEARCH_RERANK_BATCH_SIZE = int(os.getenv('SEARCH_RERANK_BATCH_SIZE', '16'))
+SEARCH_RERANK_MAX_LENGTH = int(os.getenv('SEARCH_RERANK_MAX_LENGTH', '256'))
+# بودجه زمانی rerank (میلی‌ثانیه)؛ پس از آن ترتیب جستجوی معنایی برگردانده می‌شود (0 برای نامحدود)
+SEARCH_RERANK_BUDGET_MS = float(os.getenv('SEARCH_RERANK_BUDGET_MS', '300'))
+# حداکثر offset در صفحه‌بندی نتایج جستجو
+SEARCH_MAX_OFFSET = int(os.getenv('SEARCH_MAX_OFFSET', '1000'))
+# حداکثر تعداد اسناد در هر درخواست /api/documents/bulk/
+DOCUMENT_BULK_MAX_DOCUMENTS = int(os.getenv('DOCUMENT_BULK_MAX_DOCUMENTS', '1000'))
+# طول تقریبی snippet (کاراکتر) در نمایش خلاصه نتایج (view=summary)
+SEARCH_SNIPPET_LENGTH = int(os.getenv('SEARCH_SNIPPET_LENGTH', '240'))
+
+# QA settings
+# LLM مورد استفاده: auto (Ollama و سپس HuggingFace)، stub (LLM ساختگی محلی برای تست) یا none
+QA_LLM_BACKEND = os.getenv('QA_LLM_BACKEND', 'auto')
+QA_STUB_LLM_DELAY = float(os.getenv('QA_STUB_LLM_DELAY', '0'))
+# حداکثر تعداد اسناد context و حداقل امتیاز شباهت اسناد بازیابی شده برای prompt؛ اسناد کم‌ارتباط
+# حذف می‌شوند تا prompt کوتاه‌تر شود. امتیاز در index های cosine شباهت کسینوسی (بین -1 و 1) است؛
+# در index های l2 امتیاز 1/(1+فاصله) است و مقدار مناسب به مقیاس embedding ها بستگی دارد (0 برای غیرفعال کردن)
+QA_MAX_DOCUMENTS = int(os.getenv('QA_MAX_DOCUMENTS', '5'))
+QA_MIN_SCORE = float(os.getenv('QA_MIN_SCORE', '0.2'))
+# بودجه توکن context اسناد در prompt (با tokenizer مدل فعال شمرده می‌شود)؛ اگر پنجره context مدل
+# مشخص باشد، بودجه به باقیمانده پنجره پس از متن prompt و پاسخ محدود می‌شود
+QA_CONTEXT_MAX_TOKENS = int(os.getenv('QA_CONTEXT_MAX_TOKENS', '1500'))
+# حداکثر طول پاسخ LLM (توکن) که در پنجره context برای آن جا نگه داشته می‌شود
+QA_ANSWER_MAX_TOKENS = int(os.getenv('QA_ANSWER_MAX_TOKENS', '256'))
+# اندازه پنجره context مدل (توکن)؛ 0 برای تشخیص خودکار از tokenizer یا تنظیمات مدل
+QA_CONTEXT_WINDOW = int(os.getenv('QA_CONTEXT_WINDOW', '0'))
+# نام یا مسیر tokenizer مدل فعال در transformers برای شمارش دقیق توکن‌ها (مثلاً tokenizer مدل
+# llama2 برای Ollama)؛ خالی برای tokenizer خود مدل یا در نبود آن تخمین تعداد توکن
+QA_TOKENIZER = os.getenv('QA_TOKENIZER', '')
+# پارامترهای تخمین تعداد توکن بدون tokenizer: تعداد نویسه غیر لاتین (مثلاً فارسی) در هر توکن
+# و حاشیه اطمینان (نسبت) که به تخمین اضافه می‌شود
+QA_TOKEN_ESTIMATE_CHARS_PER_TOKEN = float(os.getenv('QA_TOKEN_ESTIMATE_CHARS_PER_TOKEN', '1.0'))
+QA_TOKEN_ESTIMATE_MARGIN = float(os.getenv('QA_TOKEN_ESTIMATE_MARGIN', '0.25'))
+# اندازه thread pool برای encode و جستجوی FAISS در view های async
+ASYNC_WORKER_THREADS = int(os.getenv('ASYNC_WORKER_THREADS', '8'))
+# backend cache پاسخ‌ها و مدت اعتبار آن‌ها (ثانیه)
+QA_ANSWER_CACHE_ALIAS = os.getenv('QA_ANSWER_CACHE_ALIAS', 'qa_answers')
+QA_ANSWER_CACHE_TTL = int(os.getenv('QA_ANSWER_CACHE_TTL', str(24 * 60 * 60)))
@@ -4,7 +4,6 @@ from django.shortcuts import render
 from django.utils.decorators import method_decorator
 from django.contrib.admin.views.decorators import staff_member_required
 from .models import Document, Tag
-from .views import get_qa_service
 
 
 @admin.register(Tag)
@@ -67,15 +66,19 @@ class DocumentAdmin(admin.ModelAdmin):
             
             if question:
                 try:
+                    # import در زمان استفاده تا بارگذاری admin مدل‌ها را بارگذاری نکند
+                    from .registry import get_qa_service
                     qa_service = get_qa_service()
                     doc_ids = [int(id) for id in document_ids] if document_ids else None
-                    answer, relevant_docs = qa_service.answer_question(question, doc_ids)
+                    use_cache = not request.POST.get('bypass_cache')
+                    result = qa_service.ask(question, doc_ids, use_cache=use_cache)
                     
                     context.update({
                         'question': question,
-                        'answer': answer,
-                        'relevant_docs': relevant_docs,
-                        'llm_used': qa_service.llm is not None,
+                        'answer': result.answer,
+                        'relevant_docs': result.documents,
+                        'llm_used': result.llm_used,
+                        'cached': result.cached,
                         'success': True
                     })
                 except Exception as e:
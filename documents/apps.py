@@ -1,4 +1,17 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+def _running_management_command():
+    """آیا پروسه فعلی یک دستور manage.py (به جز runserver) است"""
+    return (
+        os.path.basename(sys.argv[0]) == 'manage.py'
+        and len(sys.argv) > 1
+        and sys.argv[1] != 'runserver'
+    )
 
 
 class DocumentsConfig(AppConfig):
@@ -6,5 +19,11 @@ class DocumentsConfig(AppConfig):
     name = 'documents'
     
     def ready(self):
-        """بارگذاری signal handlers"""
+        """بارگذاری signal handlers و در صورت فعال بودن، بارگذاری پیشاپیش سرویس‌ها"""
         import documents.signals  # noqa
+        
+        # در سرورهای preforked (مثل gunicorn --preload) مدل و index یک بار در پروسه
+        # اصلی بارگذاری و از طریق copy-on-write با worker ها به اشتراک گذاشته می‌شوند
+        if settings.SEARCH_WARMUP_ON_STARTUP and not _running_management_command():
+            from .registry import warm_up
+            warm_up()
@@ -0,0 +1,167 @@
+"""
+view های async برای جستجو و پرسش و پاسخ (برای اجرا روی ASGI)
+
+encode و جستجوی FAISS و دسترسی به دیتابیس در یک thread pool محدود
+(ASYNC_WORKER_THREADS) اجرا می‌شوند و فراخوانی LLM با API غیرهمزمان آن انجام
+می‌شود؛ بنابراین یک پروسه می‌تواند صدها پرسش در حال انتظار برای LLM داشته باشد.
+
+thread های این pool خارج از چرخه درخواست Django هستند، بنابراین اتصال‌های
+دیتابیس آن‌ها پیش و پس از هر کار بسته می‌شوند (مانند request_started/finished).
+authentication، permission و throttling همان تنظیمات view های DRF پیش از
+اجرای view بررسی می‌شوند.
+"""
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.views import APIView
+
+from .filtering import SearchFilters
+from .registry import get_qa_service
+from .serializers import DocumentSearchSerializer, QuestionSerializer, serialize_results
+from .views import search_response
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _run_with_connections(func, *args, **kwargs):
+    """اجرای func با بستن اتصال‌های منقضی یا خراب دیتابیس thread پیش و پس از آن"""
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class DatabaseThreadPoolExecutor(ThreadPoolExecutor):
+    """ThreadPoolExecutor که هر کار را با _run_with_connections اجرا می‌کند"""
+    
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(_run_with_connections, fn, *args, **kwargs)
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """thread pool مشترک برای کارهای blocking در view های async"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = DatabaseThreadPoolExecutor(
+                    max_workers=settings.ASYNC_WORKER_THREADS,
+                    thread_name_prefix='documents-async',
+                )
+    return _executor
+
+
+async def run_blocking(func, *args):
+    """اجرای تابع blocking در thread pool محدود"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), func, *args)
+
+
+def _parse_json(request):
+    """خواندن بدنه JSON درخواست (None در صورت نامعتبر بودن)"""
+    try:
+        return json.loads(request.body or b'{}')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def check_api_access(request):
+    """
+    اجرای authentication، permission و throttling پیش‌فرض DRF برای درخواست
+    
+    Returns:
+        پاسخ خطای DRF (مثلاً 401، 403 یا 429) یا None اگر درخواست مجاز باشد
+    """
+    view = APIView()
+    view.args, view.kwargs = (), {}
+    view.headers = view.default_response_headers
+    drf_request = view.initialize_request(request)
+    view.request = drf_request
+    try:
+        # CSRF درخواست‌های با session مانند view های DRF در SessionAuthentication بررسی می‌شود
+        view.initial(drf_request)
+    except Exception as exc:
+        response = view.finalize_response(drf_request, view.handle_exception(exc))
+        return response.render()
+    return None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """view async با همان بررسی‌های دسترسی view های همزمان DRF"""
+    
+    async def dispatch(self, request, *args, **kwargs):
+        denied = await sync_to_async(check_api_access)(request)
+        if denied is not None:
+            return denied
+        return await super().dispatch(request, *args, **kwargs)
+
+
+class AsyncDocumentSearchView(AsyncAPIView):
+    """نسخه async جستجوی اسناد"""
+    
+    async def post(self, request):
+        data = _parse_json(request)
+        if data is None:
+            return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+        
+        serializer = DocumentSearchSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        
+        return JsonResponse(
+            await run_blocking(search_response, serializer.validated_data),
+            json_dumps_params={'ensure_ascii': False},
+        )
+
+
+class AsyncAskQuestionView(AsyncAPIView):
+    """نسخه async پرسش و پاسخ که در زمان تولید پاسخ توسط LLM هیچ thread ای اشغال نمی‌کند"""
+    
+    async def post(self, request):
+        data = _parse_json(request)
+        if data is None:
+            return JsonResponse({'error': 'Invalid JSON body'}, status=400)
+        
+        serializer = QuestionSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+        
+        question = serializer.validated_data['question']
+        try:
+            qa_service = await run_blocking(get_qa_service)
+            result = await qa_service.aask(
+                question,
+                serializer.validated_data.get('document_ids', []),
+                use_cache=serializer.validated_data['use_cache'],
+                executor=get_executor(),
+                filters=SearchFilters.from_data(serializer.validated_data),
+            )
+            documents = await run_blocking(
+                serialize_results, result.documents, question,
+                serializer.validated_data['view'], serializer.validated_data.get('fields'),
+            )
+        except Exception as e:
+            print(f"Error in AsyncAskQuestionView: {e}")
+            return JsonResponse({'error': str(e)}, status=500)
+        
+        return JsonResponse({
+            'question': question,
+            'answer': result.answer,
+            'relevant_documents': documents,
+            'documents_count': len(result.documents),
+            'llm_used': result.llm_used,
+            'cached': result.cached,
+            'usage': result.usage,
+        }, json_dumps_params={'ensure_ascii': False})
@@ -0,0 +1,108 @@
+"""
+دسته‌بندی درخواست‌های هم‌زمان (micro-batching)
+
+درخواست‌هایی که در یک بازه زمانی کوتاه از thread های مختلف می‌رسند جمع‌آوری
+و با یک فراخوانی پردازش می‌شوند؛ نتیجه هر درخواست از طریق Future به فراخوانی
+کننده آن برگردانده می‌شود.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+from django.db import close_old_connections
+
+
+class MicroBatcher:
+    """
+    جمع‌آوری درخواست‌ها تا رسیدن به max_batch_size یا گذشتن max_wait_ms
+    از اولین درخواست دسته، و پردازش آن‌ها در یک thread پس‌زمینه
+
+    اگر هنگام رسیدن درخواست، درخواست دیگری در صف نباشد دسته بدون انتظار
+    پردازش می‌شود؛ در بار زیاد درخواست‌ها در حین پردازش دسته قبلی در صف جمع
+    می‌شوند و فقط در این حالت تا max_wait_ms برای تکمیل دسته صبر می‌شود.
+
+    process_batch لیست درخواست‌ها را می‌گیرد و لیست نتایج را به همان ترتیب
+    برمی‌گرداند. اگر process_batch خطا دهد، خطا به تمام درخواست‌های دسته برگردانده می‌شود.
+    process_batch در thread پس‌زمینه اجرا می‌شود، بنابراین اتصال‌های دیتابیس
+    منقضی یا خراب آن thread پیش و پس از هر دسته بسته می‌شوند.
+    """
+
+    def __init__(self, process_batch: Callable[[list], list], max_batch_size: int = 32,
+                 max_wait_ms: float = 2.0, name: str = 'micro-batcher'):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self.name = name
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def submit(self, item) -> Future:
+        """افزودن درخواست به صف دسته بعدی"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def run(self, item, timeout: float = None):
+        """افزودن درخواست و انتظار برای نتیجه آن"""
+        return self.submit(item).result(timeout)
+
+    def info(self) -> dict:
+        """آمار دسته‌ها: تعداد دسته، تعداد درخواست و میانگین اندازه دسته"""
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'avg_batch_size': self.items / self.batches if self.batches else 0.0,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+        }
+
+    def _ensure_worker(self):
+        # پس از fork شدن پروسه، thread پس‌زمینه در پروسه فرزند وجود ندارد
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[tuple]:
+        """انتظار برای اولین درخواست و جمع‌آوری درخواست‌های رسیده در بازه max_wait"""
+        batch = [self._queue.get()]
+        if self._queue.empty():
+            # درخواست تنها منتظر درخواست‌های دیگر نمی‌ماند
+            return batch
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    # درخواست‌هایی که تا این لحظه رسیده‌اند بدون انتظار برداشته می‌شوند
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            self.batches += 1
+            self.items += len(batch)
+            close_old_connections()
+            try:
+                results = self.process_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            finally:
+                close_old_connections()
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
@@ -0,0 +1,94 @@
+"""
+cache های جستجو و پرسش و پاسخ
+
+cache های LRU درون پروسه برای جستجو و cache پایدار پاسخ‌های LLM از طریق
+backend cache جنگو (QA_ANSWER_CACHE_ALIAS).
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+def normalize_query(text: str) -> str:
+    """یکسان‌سازی متن query برای استفاده به عنوان کلید cache (حذف فاصله‌های اضافه)"""
+    return ' '.join(text.split())
+
+
+class LRUCache:
+    """cache با اندازه محدود که قدیمی‌ترین مورد استفاده شده را حذف می‌کند"""
+    
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def info(self) -> dict:
+        """آمار cache: اندازه، ظرفیت، hit و miss"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+            }
+
+
+def answer_cache_key(question: str, documents, llm_identity: str) -> str:
+    """
+    کلید cache پاسخ: hash پرسش، ID و زمان به‌روزرسانی اسناد و شناسه LLM
+    """
+    payload = json.dumps({
+        'question': normalize_query(question),
+        'documents': [[doc.id, doc.updated_at.isoformat()] for doc in documents],
+        'llm': llm_identity,
+    }, ensure_ascii=False, sort_keys=True)
+    return 'qa-answer:' + hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def get_cached_answer(key: str):
+    """خواندن پاسخ از cache (None در صورت نبود یا خطای backend)"""
+    try:
+        return caches[settings.QA_ANSWER_CACHE_ALIAS].get(key)
+    except Exception as e:
+        print(f"Error reading answer cache: {e}")
+        return None
+
+
+def set_cached_answer(key: str, answer: str):
+    """ذخیره پاسخ در cache با مدت اعتبار QA_ANSWER_CACHE_TTL"""
+    try:
+        caches[settings.QA_ANSWER_CACHE_ALIAS].set(key, answer, timeout=settings.QA_ANSWER_CACHE_TTL)
+    except Exception as e:
+        print(f"Error writing answer cache: {e}")
@@ -0,0 +1,82 @@
+"""
+تقسیم متن اسناد به قطعه‌های (passage) کوتاه برای index و بازیابی
+
+مرز قطعه‌ها تا حد امکان روی پایان جمله‌ها (فارسی و انگلیسی) قرار می‌گیرد و
+جمله‌هایی که از اندازه قطعه بلندترند روی فاصله بین کلمات شکسته می‌شوند.
+"""
+import re
+from typing import List, NamedTuple, Tuple
+
+# پایان جمله: علائم پایانی فارسی/انگلیسی و به دنبال آن فاصله، یا شکستن خط
+_SENTENCE_BOUNDARY_RE = re.compile(r'(?<=[.!?؟۔…])\s+|\s*\n\s*')
+
+
+class TextChunk(NamedTuple):
+    """یک قطعه از متن به همراه محل آن در متن اصلی"""
+    start: int
+    end: int
+    text: str
+
+
+def sentence_spans(text: str) -> List[Tuple[int, int]]:
+    """محل جمله‌های متن به صورت (start, end)"""
+    spans = []
+    position = 0
+    for match in _SENTENCE_BOUNDARY_RE.finditer(text):
+        if match.start() > position:
+            spans.append((position, match.start()))
+        position = match.end()
+    if position < len(text) and text[position:].strip():
+        spans.append((position, len(text)))
+    return spans
+
+
+def _split_long_span(text: str, start: int, end: int, chunk_size: int) -> List[Tuple[int, int]]:
+    """شکستن جمله‌های بلندتر از chunk_size روی فاصله بین کلمات"""
+    pieces = []
+    while end - start > chunk_size:
+        cut = text.rfind(' ', start + 1, start + chunk_size)
+        if cut == -1:
+            cut = start + chunk_size
+        pieces.append((start, cut))
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if start < end:
+        pieces.append((start, end))
+    return pieces
+
+
+def chunk_text(text: str, chunk_size: int = 800, overlap: int = 150) -> List[TextChunk]:
+    """
+    تقسیم متن به قطعه‌های حداکثر chunk_size کاراکتری
+    
+    قطعه‌های متوالی حدود overlap کاراکتر (در قالب جمله‌های کامل) هم‌پوشانی
+    دارند تا پاسخی که روی مرز دو قطعه قرار گرفته از دست نرود.
+    """
+    spans = []
+    for start, end in sentence_spans(text):
+        spans.extend(_split_long_span(text, start, end, chunk_size))
+    
+    chunks = []
+    i = 0
+    while i < len(spans):
+        start = spans[i][0]
+        j = i
+        while j + 1 < len(spans) and spans[j + 1][1] - start <= chunk_size:
+            j += 1
+        end = spans[j][1]
+        chunks.append(TextChunk(start, end, text[start:end]))
+        
+        if j + 1 >= len(spans):
+            break
+        
+        # شروع قطعه بعدی از جمله‌هایی که در محدوده overlap قرار دارند؛ فقط تا جایی
+        # که جمله بعدی هنوز در قطعه جا شود، وگرنه قطعه بعدی داخل همین قطعه می‌افتد
+        next_i = j + 1
+        while (next_i - 1 > i and end - spans[next_i - 1][0] <= overlap
+               and spans[j + 1][1] - spans[next_i - 1][0] <= chunk_size):
+            next_i -= 1
+        i = next_i
+    
+    return chunks
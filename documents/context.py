@@ -0,0 +1,257 @@
+"""
+ساخت context پرسش و پاسخ با بودجه توکن
+
+توکن‌ها با tokenizer مدل زبانی فعال (یا tokenizer تعیین شده با QA_TOKENIZER)
+شمرده می‌شوند و اگر tokenizer در دسترس نباشد تخمین محافظه‌کارانه‌ای با حاشیه
+اطمینان استفاده می‌شود. قطعه‌های منطبق اسناد به
+ترتیب اهمیت (بهترین قطعه هر سند به ترتیب امتیاز اسناد، سپس قطعه‌های بعدی) تا
+پر شدن بودجه در context قرار می‌گیرند. قطعه‌های تکراری حذف و قطعه‌های
+هم‌پوشان یک سند (حاصل overlap در قطعه‌بندی) با هم ادغام می‌شوند، بنابراین
+طول prompt و زمان پردازش آن توسط LLM قابل پیش‌بینی می‌ماند.
+"""
+import functools
+import math
+import re
+from typing import Callable, List, NamedTuple, Optional
+
+# پنجره context پیش‌فرض سرور Ollama وقتی num_ctx تنظیم نشده باشد
+OLLAMA_DEFAULT_CONTEXT = 2048
+# حداقل طول (کاراکتر) هم‌پوشانی دو قطعه برای ادغام آن‌ها
+MIN_OVERLAP_CHARS = 20
+DOCUMENT_SEPARATOR = "\n\n"
+PASSAGE_SEPARATOR = "\n...\n"
+
+# ماژول BaseLanguageModel در LangChain که get_num_tokens پیش‌فرض (GPT-2) را تعریف می‌کند
+_LANGCHAIN_BASE_MODULE = 'langchain_core.language_models.base'
+
+_LATIN_WORD = re.compile(r'[A-Za-z0-9_]+')
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_NON_LATIN_CHARACTER = re.compile(r'[^\WA-Za-z0-9_]')
+
+
+def estimate_tokens(text: str, non_latin_chars_per_token: float = 1.0, margin: float = 0.25) -> int:
+    """
+    تخمین محافظه‌کارانه تعداد توکن بدون tokenizer (تخمین است، نه شمارش)
+    
+    هر واژه لاتین حدود 4/3 توکن و هر علامت یک توکن حساب می‌شود. tokenizer مدل‌هایی
+    مانند llama متن فارسی را تقریباً نویسه به نویسه می‌شکنند، بنابراین برای متن غیر
+    لاتین هر non_latin_chars_per_token نویسه یک توکن است. نتیجه به اندازه margin
+    (نسبت) بزرگ‌تر گرفته می‌شود تا context از پنجره مدل بیرون نزند.
+    """
+    tokens = len(_LATIN_WORD.findall(text)) * 4 / 3 + len(_PUNCTUATION.findall(text))
+    tokens += len(_NON_LATIN_CHARACTER.findall(text)) / non_latin_chars_per_token
+    return math.ceil(tokens * (1 + margin))
+
+
+def _uses_default_tokenizer(llm) -> bool:
+    """آیا get_num_tokens مدل همان پیش‌فرض LangChain (tokenizer GPT-2) است"""
+    methods = (getattr(type(llm), 'get_token_ids', None), getattr(type(llm), 'get_num_tokens', None))
+    return (
+        all(getattr(method, '__module__', None) == _LANGCHAIN_BASE_MODULE for method in methods)
+        and getattr(llm, 'custom_get_token_ids', None) is None
+    )
+
+
+def token_counter(llm, tokenizer_name: str = None, non_latin_chars_per_token: float = 1.0,
+                  margin: float = 0.25) -> Callable[[str], int]:
+    """
+    تابع شمارش توکن با tokenizer مدل زبانی فعال
+    
+    به ترتیب از tokenizer با نام tokenizer_name در transformers (QA_TOKENIZER، مثلاً
+    tokenizer همان مدل Ollama)، tokenizer خود HuggingFacePipeline و get_num_tokens
+    مدل‌هایی که tokenizer خودشان را دارند استفاده می‌شود. get_num_tokens پیش‌فرض
+    LangChain (مثلاً برای Ollama) با tokenizer GPT-2 می‌شمارد که برای متن فارسی با
+    tokenizer مدل بسیار متفاوت است؛ در این حالت تعداد توکن با estimate_tokens تخمین
+    زده می‌شود. تابع برگردانده شده ویژگی estimated دارد.
+    """
+    counter = None
+    if tokenizer_name:
+        try:
+            from transformers import AutoTokenizer
+            
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+            counter = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+        except Exception as e:
+            print(f"Warning: Could not load tokenizer {tokenizer_name} ({e}).")
+    
+    tokenizer = getattr(getattr(llm, 'pipeline', None), 'tokenizer', None)
+    if counter is None and tokenizer is not None:
+        counter = lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    
+    if counter is None and hasattr(llm, 'get_num_tokens') and not _uses_default_tokenizer(llm):
+        try:
+            llm.get_num_tokens('test')
+            counter = llm.get_num_tokens
+        except Exception as e:
+            print(f"Warning: Could not load tokenizer of {type(llm).__name__} ({e}).")
+    
+    if counter is not None:
+        counter = functools.partial(counter)
+        counter.estimated = False
+        return counter
+    
+    if llm is not None:
+        print(
+            f"Warning: No tokenizer for {type(llm).__name__}; estimating token counts with a "
+            f"{margin:.0%} margin. Set QA_TOKENIZER for exact counts."
+        )
+    counter = functools.partial(
+        estimate_tokens, non_latin_chars_per_token=non_latin_chars_per_token, margin=margin,
+    )
+    counter.estimated = True
+    return counter
+
+
+def context_window(llm) -> Optional[int]:
+    """اندازه پنجره context مدل زبانی (توکن)، یا None اگر مشخص نباشد"""
+    pipeline = getattr(llm, 'pipeline', None)
+    tokenizer = getattr(pipeline, 'tokenizer', None)
+    if tokenizer is not None:
+        length = getattr(tokenizer, 'model_max_length', None)
+        # tokenizer های بدون محدودیت مقدار بسیار بزرگی برمی‌گردانند
+        if length and length < 1_000_000:
+            return int(length)
+        config = getattr(getattr(pipeline, 'model', None), 'config', None)
+        return getattr(config, 'max_position_embeddings', None)
+    if hasattr(llm, 'num_ctx'):
+        return llm.num_ctx or OLLAMA_DEFAULT_CONTEXT
+    return None
+
+
+class PromptContext(NamedTuple):
+    """context ساخته شده برای prompt و آمار آن"""
+    text: str
+    tokens: int
+    budget: int
+    passages: int  # قطعه‌های استفاده شده
+    dropped: int  # قطعه‌هایی که در بودجه جا نشدند
+    duplicates: int  # قطعه‌های تکراری یا ادغام شده با قطعه هم‌پوشان
+
+
+def _header(document) -> str:
+    return f"=== سند: {document.title} ===\n"
+
+
+def _overlap(first: str, second: str) -> int:
+    """طول طولانی‌ترین انتهای first که ابتدای second است (0 اگر کوتاه‌تر از MIN_OVERLAP_CHARS باشد)"""
+    probe = second[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return 0
+    start = first.find(probe)
+    while start != -1:
+        if second.startswith(first[start:]):
+            return len(first) - start
+        start = first.find(probe, start + 1)
+    return 0
+
+
+def _merge(segments: List[str], passage: str):
+    """
+    ادغام قطعه با متن‌های قبلی همان سند
+    
+    Returns:
+        Tuple شامل شماره متن جایگزین شونده (None برای افزودن متن جدید) و متن
+        حاصل؛ اگر قطعه کاملاً در متن‌های قبلی باشد متن حاصل None است.
+    """
+    for i, segment in enumerate(segments):
+        if passage in segment:
+            return i, None
+        if segment in passage:
+            return i, passage
+        overlap = _overlap(segment, passage)
+        if overlap:
+            return i, segment + passage[overlap:]
+        overlap = _overlap(passage, segment)
+        if overlap:
+            return i, passage + segment[overlap:]
+    return None, passage
+
+
+def _truncate(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> str:
+    """کوتاه کردن متن (در مرز واژه‌ها) تا حداکثر max_tokens توکن"""
+    words = text.split(' ')
+    low, high = 0, len(words)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if count_tokens(' '.join(words[:middle]) + '…') <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return ' '.join(words[:low]) + '…' if low else ''
+
+
+def build_context(documents: list, budget: int, count_tokens: Callable[[str], int],
+                  fallback_chars: int = 2000) -> PromptContext:
+    """
+    چیدن قطعه‌های منطبق اسناد در context با حداکثر budget توکن
+    
+    اسناد باید به ترتیب امتیاز باشند. سند بدون matched_passages با ابتدای
+    محتوایش (حداکثر fallback_chars کاراکتر) در نظر گرفته می‌شود. قطعه‌ای که جا
+    نشود رد می‌شود و قطعه‌های کوچک‌تر بعدی امتحان می‌شوند؛ اگر حتی اولین قطعه
+    جا نشود، کوتاه شده آن استفاده می‌شود.
+    """
+    candidates = []
+    for doc_index, doc in enumerate(documents):
+        passages = getattr(doc, 'matched_passages', None) or [doc.content[:fallback_chars]]
+        candidates.extend((rank, doc_index, passage.strip()) for rank, passage in enumerate(passages))
+    candidates.sort(key=lambda candidate: candidate[:2])
+    
+    segments = {}
+    segment_tokens = {}
+    seen = set()
+    used = dropped = duplicates = 0
+    for _, doc_index, passage in candidates:
+        key = ' '.join(passage.split())
+        if not key:
+            continue
+        if key in seen:
+            duplicates += 1
+            continue
+        
+        doc_segments = segments.get(doc_index, [])
+        position, text = _merge(doc_segments, passage)
+        if text is None:
+            duplicates += 1
+            continue
+        tokens = count_tokens(text)
+        if position is not None:
+            overhead = -segment_tokens[doc_index][position]
+        elif doc_segments:
+            overhead = count_tokens(PASSAGE_SEPARATOR)
+        else:
+            overhead = count_tokens(DOCUMENT_SEPARATOR + _header(documents[doc_index]))
+        
+        if used + tokens + overhead > budget:
+            if used or position is not None:
+                dropped += 1
+                continue
+            text = _truncate(text, budget - overhead, count_tokens)
+            if not text:
+                dropped += 1
+                continue
+            tokens = count_tokens(text)
+        cost = tokens + overhead
+        
+        seen.add(key)
+        used += cost
+        if position is None:
+            segments.setdefault(doc_index, []).append(text)
+            segment_tokens.setdefault(doc_index, []).append(tokens)
+        else:
+            duplicates += 1
+            doc_segments[position] = text
+            segment_tokens[doc_index][position] = tokens
+    
+    parts = [
+        _header(documents[doc_index]) + PASSAGE_SEPARATOR.join(segments[doc_index])
+        for doc_index in sorted(segments)
+    ]
+    text = DOCUMENT_SEPARATOR.join(parts)
+    return PromptContext(
+        text=text,
+        tokens=count_tokens(text) if text else 0,
+        budget=budget,
+        passages=sum(len(doc_segments) for doc_segments in segments.values()),
+        dropped=dropped,
+        duplicates=duplicates,
+    )
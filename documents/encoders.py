@@ -0,0 +1,187 @@
+"""
+backend های encode متن برای embedding (انتخاب با تنظیم EMBEDDING_BACKEND)
+
+    torch       مدل SentenceTransformer با PyTorch (پیش‌فرض)
+    onnx        همان مدل export شده به ONNX و اجرا با ONNX Runtime روی CPU
+    onnx-int8   مدل ONNX با quantization پویای وزن‌ها به int8
+
+مدل ONNX یک بار (با PyTorch) با دستور export_onnx در EMBEDDING_ONNX_DIR export
+می‌شود و پس از آن برای encode فقط onnxruntime (وابستگی اختیاری، جداگانه نصب
+می‌شود) و tokenizer مدل لازم است؛ سرور هیچ‌وقت خودش مدل را export نمی‌کند. pooling و نرمال‌سازی
+همانند ماژول‌های SentenceTransformer انجام می‌شود تا بردارها با backend
+PyTorch قابل مقایسه باشند (نتیجه با دستور benchmark_encoders بررسی می‌شود).
+"""
+import json
+import os
+import re
+from typing import List
+
+import numpy as np
+from django.core.exceptions import ImproperlyConfigured
+
+BACKEND_TORCH = 'torch'
+BACKEND_ONNX = 'onnx'
+BACKEND_ONNX_INT8 = 'onnx-int8'
+BACKENDS = (BACKEND_TORCH, BACKEND_ONNX, BACKEND_ONNX_INT8)
+
+ONNX_MODEL_FILE = 'model.onnx'
+ONNX_INT8_MODEL_FILE = 'model.int8.onnx'
+ENCODER_CONFIG_FILE = 'encoder_config.json'
+
+
+def model_dir(base_dir, model_name: str) -> str:
+    """پوشه فایل‌های ONNX یک مدل"""
+    return os.path.join(str(base_dir), re.sub(r'[^\w.-]+', '__', model_name))
+
+
+def onnx_model_path(onnx_dir, model_name: str, quantized: bool = False) -> str:
+    """مسیر فایل ONNX (یا نسخه int8) یک مدل"""
+    return os.path.join(model_dir(onnx_dir, model_name), ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+
+
+def export_onnx(model_name: str, output_dir: str, quantize: bool = True, opset: int = 14):
+    """
+    export مدل SentenceTransformer به ONNX به همراه tokenizer و تنظیمات pooling
+    
+    فقط برای export به PyTorch و sentence-transformers نیاز است. با quantize=True
+    نسخه int8 (quantization پویای وزن‌ها با onnxruntime) هم ساخته می‌شود.
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+    
+    model = SentenceTransformer(model_name, device='cpu')
+    transformer = model[0]
+    pooling = next((module for module in model if isinstance(module, Pooling)), None)
+    os.makedirs(output_dir, exist_ok=True)
+    
+    transformer.tokenizer.save_pretrained(output_dir)
+    config = {
+        'model': model_name,
+        'dimension': model.get_sentence_embedding_dimension(),
+        'max_seq_length': model.max_seq_length,
+        'pooling': 'cls' if pooling is not None and pooling.pooling_mode_cls_token else 'mean',
+        'normalize': any(isinstance(module, Normalize) for module in model),
+    }
+    with open(os.path.join(output_dir, ENCODER_CONFIG_FILE), 'w', encoding='utf-8') as f:
+        json.dump(config, f, indent=2)
+    
+    sample = transformer.tokenizer(['export'], return_tensors='pt')
+    input_names = list(sample.keys())
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+    auto_model = transformer.auto_model.eval()
+    with torch.no_grad():
+        torch.onnx.export(
+            auto_model,
+            (dict(sample),),
+            os.path.join(output_dir, ONNX_MODEL_FILE),
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+    
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        
+        quantize_dynamic(
+            os.path.join(output_dir, ONNX_MODEL_FILE),
+            os.path.join(output_dir, ONNX_INT8_MODEL_FILE),
+            weight_type=QuantType.QInt8,
+        )
+
+
+class OnnxEncoder:
+    """
+    encode متن با مدل ONNX و ONNX Runtime
+    
+    رابط آن زیرمجموعه‌ای از SentenceTransformer است که سرویس جستجو استفاده
+    می‌کند (encode و get_sentence_embedding_dimension).
+    """
+    
+    def __init__(self, path: str, quantized: bool = False, threads: int = 0):
+        import onnxruntime
+        from transformers import AutoTokenizer
+        
+        with open(os.path.join(path, ENCODER_CONFIG_FILE), encoding='utf-8') as f:
+            self.config = json.load(f)
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+        
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        model_file = ONNX_INT8_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(path, model_file), options, providers=['CPUExecutionProvider']
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+    
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.config['dimension']
+    
+    def _encode_batch(self, texts: List[str]):
+        inputs = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            max_length=self.config['max_seq_length'],
+            return_tensors='np',
+        )
+        feed = {name: np.asarray(value, dtype='int64') for name, value in inputs.items() if name in self.input_names}
+        hidden = self.session.run(None, feed)[0]
+        return pool_embeddings(hidden, feed['attention_mask'], self.config['pooling'], self.config['normalize'])
+    
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False, **kwargs):
+        """encode لیست متن‌ها در دسته‌های batch_size (متن‌ها به ترتیب طول مرتب می‌شوند تا padding کم شود)"""
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size=batch_size)[0]
+        if not len(texts):
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype='float32')
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        embeddings = np.empty((len(texts), self.get_sentence_embedding_dimension()), dtype='float32')
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            embeddings[rows] = self._encode_batch([texts[row] for row in rows])
+        if kwargs.get('normalize_embeddings'):
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+
+def pool_embeddings(hidden, attention_mask, pooling: str = 'mean', normalize: bool = False):
+    """pooling خروجی توکن‌ها به یک بردار برای هر متن (مانند ماژول Pooling در SentenceTransformer)"""
+    if pooling == 'cls':
+        embeddings = hidden[:, 0]
+    else:
+        mask = attention_mask[:, :, None].astype('float32')
+        embeddings = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+    embeddings = embeddings.astype('float32')
+    if normalize:
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+    return embeddings
+
+
+def load_encoder(model_name: str, backend: str = BACKEND_TORCH, onnx_dir=None, threads: int = 0):
+    """
+    بارگذاری encoder مدل embedding با backend داده شده
+    
+    اگر فایل‌های ONNX مدل وجود نداشته باشند ImproperlyConfigured داده می‌شود؛
+    export با دستور export_onnx (و PyTorch) جدا از سرور انجام می‌شود.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend} (expected one of {', '.join(BACKENDS)})")
+    
+    if backend == BACKEND_TORCH:
+        from sentence_transformers import SentenceTransformer
+        
+        return SentenceTransformer(model_name)
+    
+    quantized = backend == BACKEND_ONNX_INT8
+    model_path = onnx_model_path(onnx_dir, model_name, quantized)
+    if not os.path.exists(model_path):
+        raise ImproperlyConfigured(
+            f"ONNX model for {model_name} not found at {model_path}; "
+            f"run 'python manage.py export_onnx' before using the {backend} backend."
+        )
+    return OnnxEncoder(model_dir(onnx_dir, model_name), quantized=quantized, threads=threads)
@@ -0,0 +1,241 @@
+"""
+فیلتر نتایج جستجو بر اساس برچسب، بازه تاریخ ایجاد و ایجاد کننده سند
+
+فیلترها پیش از جستجو اعمال می‌شوند: در جستجوی معنایی از IDSelector در FAISS و
+در جستجوی واژگانی از شرط rowid در جدول FTS5 استفاده می‌شود، بنابراین نتایج
+فیلتر شده هم صفحه کامل دارند.
+
+mask ردیف‌های index برای هر فیلتر بدون query جداگانه به دیتابیس از ستون‌های
+پیش‌محاسبه شده (FilterMasks) ساخته می‌شود که پس از تغییر index یا اسناد فقط
+برای اسناد تغییر یافته به‌روزرسانی می‌شوند. تغییر برچسب‌ها یا اطلاعات اسناد با
+فایل FILTERS_MARKER_FILE در SEARCH_INDEX_DIR به تمام پروسه‌ها اطلاع داده می‌شود.
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional, Tuple
+
+from django.utils import timezone
+
+from .caching import LRUCache
+from .models import Document
+
+FILTERS_MARKER_FILE = 'FILTERS_CHANGED'
+
+
+class SearchFilters(NamedTuple):
+    """فیلترهای جستجو (قابل hash برای استفاده در کلید دسته‌بندی query ها)"""
+    tag_ids: Tuple[int, ...] = ()
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    created_by: Optional[int] = None
+
+    @classmethod
+    def from_data(cls, data) -> Optional['SearchFilters']:
+        """ساخت فیلتر از داده‌های اعتبارسنجی شده serializer (None اگر فیلتری مشخص نشده باشد)"""
+        filters = cls(
+            tag_ids=tuple(sorted(set(data.get('tags') or []))),
+            created_after=data.get('created_after'),
+            created_before=data.get('created_before'),
+            created_by=data.get('created_by'),
+        )
+        return None if filters == cls() else filters
+
+    def apply(self, queryset):
+        """اعمال فیلترها روی QuerySet اسناد"""
+        if self.tag_ids:
+            # اسنادی که حداقل یکی از برچسب‌ها را دارند
+            queryset = queryset.filter(tags__id__in=self.tag_ids).distinct()
+        if self.created_after is not None:
+            queryset = queryset.filter(created_at__gte=self.created_after)
+        if self.created_before is not None:
+            queryset = queryset.filter(created_at__lte=self.created_before)
+        if self.created_by is not None:
+            queryset = queryset.filter(created_by_id=self.created_by)
+        return queryset
+
+    def queryset(self):
+        """QuerySet اسناد منطبق با فیلترها"""
+        return self.apply(Document.objects.all())
+
+
+def mark_filters_changed(index_dir):
+    """اعلام تغییر برچسب‌ها یا اطلاعات اسناد به FilterMasks تمام پروسه‌ها"""
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, FILTERS_MARKER_FILE), 'w', encoding='utf-8') as f:
+        f.write(str(time.time_ns()))
+
+
+def filters_marker(index_dir):
+    """نشانگر ارزان آخرین تغییر فیلترها (مانند snapshots.current_marker)"""
+    try:
+        stat = os.stat(os.path.join(index_dir, FILTERS_MARKER_FILE))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class FilterMasks:
+    """
+    IDSelector ردیف‌های یک index برای فیلترهای جستجو
+
+    تاریخ ایجاد و ایجاد کننده اسناد یک بار خوانده و در جدولی مرتب بر اساس شناسه
+    سند نگه داشته می‌شوند؛ پس از آن فقط اسنادی که از آخرین خواندن ذخیره شده‌اند
+    (updated_at) دوباره خوانده می‌شوند. شناسه اسناد هر برچسب در اولین استفاده با
+    یک query خوانده می‌شود. ستون‌های هم‌ترتیب با ردیف‌های index و mask هر ترکیب
+    فیلتر با چند عملیات numpy از این جدول‌ها ساخته و mask ها همراه با IDSelector
+    در LRU نگه داشته می‌شوند. با تغییر index یا نشانگر فیلترها (حداکثر هر
+    check_interval ثانیه بررسی می‌شود) ستون‌ها و mask ها دوباره ساخته و generation
+    افزایش پیدا می‌کند تا نتایج cache شده جستجوهای فیلتر شده هم کنار گذاشته شوند؛
+    با تغییر نشانگر اسناد برچسب‌ها هم دوباره خوانده می‌شوند.
+    """
+
+    # حاشیه زمانی خواندن مجدد اسناد تغییر یافته، برای تراکنش‌هایی که پس از خواندن قبلی commit شده‌اند
+    REFRESH_MARGIN = timedelta(minutes=1)
+
+    def __init__(self, index_dir, id_shift: int, cache_size: int = 256, check_interval: float = 1.0):
+        self.index_dir = index_dir
+        self.id_shift = id_shift
+        self.check_interval = check_interval
+        self.generation = 0
+        self.masks = LRUCache(cache_size)
+        self._lock = threading.RLock()
+        self._index = None
+        self._marker = None
+        self._last_check = 0.0
+        self._documents = None
+        self._documents_read_at = None
+        self._documents_stale = True
+        self._tag_documents = {}
+        self._columns = None
+        self._tag_masks = {}
+
+    def _reset(self, index, marker):
+        if marker != self._marker:
+            self._tag_documents = {}
+        self._index = index
+        self._marker = marker
+        self._documents_stale = True
+        self._columns = None
+        self._tag_masks = {}
+        self.masks.clear()
+        self.generation += 1
+
+    def check(self, index):
+        """کنار گذاشتن mask ها اگر index یا فیلترها تغییر کرده باشند؛ generation فعلی را برمی‌گرداند"""
+        now = time.monotonic()
+        with self._lock:
+            if index is not self._index:
+                self._reset(index, filters_marker(self.index_dir))
+                self._last_check = now
+            elif now - self._last_check >= self.check_interval:
+                self._last_check = now
+                marker = filters_marker(self.index_dir)
+                if marker != self._marker:
+                    self._reset(index, marker)
+            return self.generation
+
+    def _refresh_documents(self):
+        """خواندن تاریخ ایجاد (timestamp) و ایجاد کننده اسناد ذخیره شده از آخرین خواندن"""
+        import numpy as np
+
+        read_at = timezone.now()
+        rows = Document.objects.order_by('id').values_list('id', 'created_at', 'created_by_id')
+        if self._documents is not None:
+            rows = rows.filter(updated_at__gte=self._documents_read_at - self.REFRESH_MARGIN)
+        ids, created, creators = [], [], []
+        for doc_id, created_at, created_by in rows.iterator(chunk_size=5000):
+            ids.append(doc_id)
+            created.append(created_at.timestamp())
+            creators.append(-1 if created_by is None else created_by)
+        ids = np.array(ids, dtype='int64')
+        created = np.array(created, dtype='float64')
+        creators = np.array(creators, dtype='int64')
+
+        if self._documents is not None and len(ids):
+            # جایگزینی ردیف‌های قبلی اسناد خوانده شده
+            old_ids, old_created, old_creators = self._documents
+            keep = ~np.isin(old_ids, ids)
+            ids = np.concatenate([old_ids[keep], ids])
+            created = np.concatenate([old_created[keep], created])
+            creators = np.concatenate([old_creators[keep], creators])
+            order = np.argsort(ids, kind='stable')
+            ids, created, creators = ids[order], created[order], creators[order]
+        if self._documents is None or len(ids):
+            self._documents = (ids, created, creators)
+        self._documents_read_at = read_at
+        self._documents_stale = False
+
+    def _load_columns(self):
+        """شناسه سند، زمان ایجاد و ایجاد کننده هر ردیف index از جدول اسناد"""
+        import numpy as np
+
+        if self._documents_stale:
+            self._refresh_documents()
+        ids, created, creators = self._documents
+        row_documents = self._index.ids >> self.id_shift
+        if not len(ids):
+            self._columns = (
+                row_documents,
+                np.zeros(len(row_documents), dtype=bool),
+                np.full(len(row_documents), np.nan),
+                np.full(len(row_documents), -1, dtype='int64'),
+            )
+            return
+
+        # ردیف‌های حذف شده یا اسنادی که هنوز خوانده نشده‌اند با هیچ فیلتری منطبق نمی‌شوند
+        positions = np.minimum(np.searchsorted(ids, row_documents), len(ids) - 1)
+        found = ids[positions] == row_documents
+        self._columns = (
+            row_documents,
+            found,
+            np.where(found, created[positions], np.nan),
+            np.where(found, creators[positions], -1),
+        )
+
+    def _tag_mask(self, tag_id: int):
+        import numpy as np
+
+        mask = self._tag_masks.get(tag_id)
+        if mask is None:
+            documents = self._tag_documents.get(tag_id)
+            if documents is None:
+                tagged = Document.tags.through.objects.filter(tag_id=tag_id).values_list('document_id', flat=True)
+                documents = np.fromiter(tagged, dtype='int64')
+                self._tag_documents[tag_id] = documents
+            mask = np.isin(self._columns[0], documents)
+            self._tag_masks[tag_id] = mask
+        return mask
+
+    def selector(self, index, filters: SearchFilters):
+        """
+        IDSelector ردیف‌های index منطبق با فیلترها (از VectorIndex.selector)
+
+        Returns:
+            Tuple شامل selector و تعداد ردیف‌های منطبق
+        """
+        import numpy as np
+
+        with self._lock:
+            self.check(index)
+            cached = self.masks.get(filters)
+            if cached is not None:
+                return cached
+
+            if self._columns is None:
+                self._load_columns()
+            _, mask, created, creators = self._columns
+            mask = mask.copy()
+            if filters.tag_ids:
+                # اسنادی که حداقل یکی از برچسب‌ها را دارند
+                mask &= np.logical_or.reduce([self._tag_mask(tag_id) for tag_id in filters.tag_ids])
+            if filters.created_after is not None:
+                mask &= created >= filters.created_after.timestamp()
+            if filters.created_before is not None:
+                mask &= created <= filters.created_before.timestamp()
+            if filters.created_by is not None:
+                mask &= creators == filters.created_by
+            result = (index.selector(mask), int(mask.sum()))
+            self.masks.set(filters, result)
+            return result
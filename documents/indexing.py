@@ -0,0 +1,122 @@
+"""
+صف پایدار index و پردازش دسته‌ای آن
+
+signal ها فقط شناسه اسناد تغییر یافته را در جدول IndexingTask ثبت می‌کنند و
+encode کردن اسناد در worker جداگانه (دستور process_index_queue) انجام می‌شود.
+وظیفه‌ای که INDEX_QUEUE_MAX_ATTEMPTS بار ناموفق باشد (مثلاً سندی که encode آن
+خطا می‌دهد) کنار گذاشته می‌شود تا بقیه صف را متوقف نکند.
+"""
+import logging
+from typing import Dict, Iterable, List, NamedTuple
+from django.conf import settings
+from django.db import transaction
+from .models import Document, IndexingTask
+
+logger = logging.getLogger(__name__)
+
+
+class QueueResult(NamedTuple):
+    """نتیجه پردازش یک دسته از صف"""
+    tasks: int
+    documents: int
+    failed_task_ids: List[int]
+
+
+def enqueue_document(document_id: int, action: str = IndexingTask.ACTION_INDEX):
+    """ثبت یک سند در صف index"""
+    IndexingTask.objects.create(document_id=document_id, action=action)
+
+
+def enqueue_documents(document_ids: Iterable[int], action: str = IndexingTask.ACTION_INDEX, batch_size: int = 1000):
+    """ثبت چند سند در صف index با insert دسته‌ای"""
+    IndexingTask.objects.bulk_create(
+        (IndexingTask(document_id=document_id, action=action) for document_id in document_ids),
+        batch_size=batch_size,
+    )
+
+
+def _pending_tasks():
+    return IndexingTask.objects.filter(attempts__lt=settings.INDEX_QUEUE_MAX_ATTEMPTS)
+
+
+def pending_count() -> int:
+    """تعداد وظایف در انتظار پردازش"""
+    return _pending_tasks().count()
+
+
+def failed_count() -> int:
+    """تعداد وظایفی که پس از INDEX_QUEUE_MAX_ATTEMPTS تلاش کنار گذاشته شده‌اند"""
+    return IndexingTask.objects.filter(attempts__gte=settings.INDEX_QUEUE_MAX_ATTEMPTS).count()
+
+
+def retry_failed() -> int:
+    """برگرداندن وظایف ناموفق به صف؛ تعداد وظایف برگردانده شده"""
+    return IndexingTask.objects.filter(attempts__gt=0).update(attempts=0, last_error='')
+
+
+def _apply_actions(search_service, latest_actions: Dict[int, str]):
+    """اعمال آخرین عملیات هر سند در index"""
+    index_ids = [doc_id for doc_id, action in latest_actions.items() if action == IndexingTask.ACTION_INDEX]
+    documents = list(Document.objects.filter(id__in=index_ids))
+    
+    # اسنادی که پیش از پردازش حذف شده‌اند از index هم حذف می‌شوند
+    found_ids = {doc.id for doc in documents}
+    deleted_ids = [doc_id for doc_id in latest_actions if doc_id not in found_ids]
+    
+    search_service.apply_changes(documents, deleted_ids)
+
+
+def process_queue(search_service, batch_size: int = 256) -> QueueResult:
+    """
+    پردازش یک دسته از صف index
+    
+    چند وظیفه برای یک سند در یک دسته ادغام می‌شوند و فقط آخرین عملیات
+    اعمال می‌شود. وظایف فقط پس از اعمال موفق تغییرات حذف می‌شوند. اگر اعمال
+    دسته ناموفق باشد اسناد آن یکی یکی اعمال می‌شوند و فقط وظایف اسناد
+    ناموفق با افزایش attempts در صف می‌مانند.
+    
+    Returns:
+        QueueResult شامل تعداد وظایف پردازش شده، تعداد اسناد متمایز و شناسه وظایف ناموفق
+    """
+    tasks = list(_pending_tasks().order_by('id')[:batch_size])
+    if not tasks:
+        return QueueResult(0, 0, [])
+    
+    # ادغام وظایف: آخرین عملیات هر سند معتبر است
+    latest_actions = {}
+    for task in tasks:
+        latest_actions[task.document_id] = task.action
+    
+    errors = {}
+    try:
+        _apply_actions(search_service, latest_actions)
+    except Exception as e:
+        if len(latest_actions) == 1:
+            errors = {doc_id: e for doc_id in latest_actions}
+        else:
+            logger.warning(
+                f"Error applying index queue batch of {len(latest_actions)} documents: {e}. "
+                "Retrying documents one by one."
+            )
+            for doc_id, action in latest_actions.items():
+                try:
+                    _apply_actions(search_service, {doc_id: action})
+                except Exception as doc_error:
+                    errors[doc_id] = doc_error
+    
+    failed_tasks = [task for task in tasks if task.document_id in errors]
+    for task in failed_tasks:
+        task.attempts += 1
+        task.last_error = f"{type(errors[task.document_id]).__name__}: {errors[task.document_id]}"
+        logger.warning(
+            f"Index task {task.id} ({task}) failed (attempt {task.attempts}/"
+            f"{settings.INDEX_QUEUE_MAX_ATTEMPTS}): {task.last_error}"
+        )
+    
+    with transaction.atomic():
+        IndexingTask.objects.filter(
+            id__in=[task.id for task in tasks if task.document_id not in errors]
+        ).delete()
+        IndexingTask.objects.bulk_update(failed_tasks, ['attempts', 'last_error'])
+    
+    return QueueResult(len(tasks), len(latest_actions), [task.id for task in failed_tasks])
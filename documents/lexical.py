@@ -0,0 +1,225 @@
+"""
+index واژگانی (BM25) اسناد با جدول FTS5 در SQLite
+
+عنوان و محتوای اسناد پس از یکسان‌سازی حروف فارسی و عربی در جدول مجازی
+documents_document_fts (با rowid برابر ID سند) نگهداری می‌شوند و رتبه‌بندی با
+تابع bm25 خود FTS5 انجام می‌شود. روی دیتابیس‌های دیگر یا SQLite بدون FTS5،
+جستجوی واژگانی به جستجوی ساده icontains برمی‌گردد.
+"""
+import re
+from typing import Iterable, List, Tuple
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+# جدول در migration 0005_document_fts ساخته می‌شود
+FTS_TABLE = 'documents_document_fts'
+
+# وزن عنوان و محتوا در امتیاز bm25
+TITLE_WEIGHT = 2.0
+CONTENT_WEIGHT = 1.0
+
+_CHARACTER_MAP = str.maketrans({
+    # حروف عربی به معادل فارسی
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا', 'آ': 'ا', 'ؤ': 'و',
+    # نیم‌فاصله و کشیده
+    '\u200c': ' ', '\u200d': '', '\u0640': '',
+    # ارقام فارسی و عربی
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+})
+# اعراب و تنوین
+_DIACRITICS = re.compile('[\u064b-\u065f\u0670]')
+_TOKEN = re.compile(r'\w+')
+
+
+def normalize_text(text: str) -> str:
+    """یکسان‌سازی متن فارسی: حروف عربی، ارقام، اعراب، کشیده و نیم‌فاصله"""
+    return _DIACRITICS.sub('', text.translate(_CHARACTER_MAP)).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """تقسیم متن یکسان‌سازی شده به واژه‌ها"""
+    return _TOKEN.findall(normalize_text(text))
+
+
+def match_expression(query: str) -> str:
+    """ساخت عبارت MATCH در FTS5 از query: هر واژه به صورت عبارت نقل قول شده و با OR"""
+    tokens = list(dict.fromkeys(tokenize(query)))
+    return ' OR '.join(f'"{token}"' for token in tokens)
+
+
+_available = None
+
+
+def is_available() -> bool:
+    """آیا جدول FTS5 در دیتابیس فعلی وجود دارد"""
+    global _available
+    if _available is None:
+        if connection.vendor != 'sqlite':
+            _available = False
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                _available = cursor.fetchone() is not None
+    return _available
+
+
+def _rows(documents: Iterable) -> List[tuple]:
+    return [(doc.id, normalize_text(doc.title), normalize_text(doc.content)) for doc in documents]
+
+
+def index_documents(documents: Iterable, cursor=None):
+    """افزودن یا جایگزینی متن اسناد در جدول FTS5"""
+    if cursor is None:
+        if not is_available():
+            return
+        with connection.cursor() as cursor:
+            return index_documents(documents, cursor)
+
+    rows = _rows(documents)
+    if rows:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0],) for row in rows])
+        cursor.executemany(f"INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)", rows)
+
+
+def remove_documents(document_ids: Iterable[int]):
+    """حذف اسناد از جدول FTS5"""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(doc_id,) for doc_id in document_ids])
+
+
+def rebuild(batch_size: int = 1000) -> int:
+    """
+    ساخت مجدد کامل جدول FTS5 از روی اسناد
+
+    Returns:
+        تعداد اسناد index شده
+    """
+    from .models import Document
+
+    if not is_available():
+        return 0
+    count = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        batch = []
+        for doc in Document.objects.only('id', 'title', 'content').iterator(chunk_size=batch_size):
+            batch.append(doc)
+            if len(batch) >= batch_size:
+                index_documents(batch, cursor)
+                count += len(batch)
+                batch = []
+        index_documents(batch, cursor)
+        count += len(batch)
+    return count
+
+
+def search(query: str, limit: int, offset: int = 0, queryset=None) -> List[Tuple[int, float]]:
+    """
+    جستجوی BM25 در عنوان و محتوای اسناد
+
+    Args:
+        queryset: محدود کردن جستجو به اسناد این QuerySet (اختیاری)
+
+    Returns:
+        لیست (document ID، امتیاز BM25) به ترتیب امتیاز نزولی
+    """
+    expression = match_expression(query)
+    if not expression:
+        return []
+    restriction, restriction_params = '', []
+    if queryset is not None:
+        subquery, restriction_params = queryset.order_by().values('id').query.sql_with_params()
+        restriction = f"AND rowid IN ({subquery}) "
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT rowid, bm25({FTS_TABLE}, %s, %s) AS rank FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s {restriction}ORDER BY rank LIMIT %s OFFSET %s",
+            [TITLE_WEIGHT, CONTENT_WEIGHT, expression, *restriction_params, limit, offset],
+        )
+        # bm25 در FTS5 منفی است و مقدار کمتر یعنی تطابق بیشتر
+        return [(int(doc_id), -float(rank)) for doc_id, rank in cursor.fetchall()]
+
+
+def highlight(text: str, query: str, length: int) -> str:
+    """
+    بخشی از متن به طول حدود length حول اولین واژه منطبق با query
+
+    واژه‌های منطبق (پس از یکسان‌سازی) با <mark> مشخص می‌شوند و بقیه متن
+    escape می‌شود، بنابراین خروجی قطعه HTML امن است.
+    """
+    from django.utils.html import escape
+
+    terms = set(tokenize(query))
+    matches = [match for match in _TOKEN.finditer(text) if normalize_text(match.group()) in terms]
+    start = 0
+    if matches and len(text) > length:
+        # اولین تطابق حدود یک سوم ابتدای بخش قرار می‌گیرد
+        start = max(0, min(matches[0].start() - length // 3, len(text) - length))
+    end = min(len(text), start + length)
+
+    parts = ['…' if start > 0 else '']
+    position = start
+    for match in matches:
+        if match.start() < start or match.end() > end:
+            continue
+        parts.append(escape(text[position:match.start()]))
+        parts.append(f'<mark>{escape(match.group())}</mark>')
+        position = match.end()
+    parts.append(escape(text[position:end]))
+    parts.append('…' if end < len(text) else '')
+    return ''.join(parts)
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """
+    ادغام چند رتبه‌بندی با Reciprocal Rank Fusion: امتیاز هر مورد مجموع 1/(k + رتبه)
+
+    Returns:
+        لیست (ID، امتیاز) به ترتیب امتیاز نزولی
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def search_documents(query: str, limit: int, offset: int = 0, min_score: float = None, queryset=None) -> list:
+    """
+    جستجوی واژگانی اسناد: BM25 در صورت وجود جدول FTS5، در غیر این صورت icontains
+
+    هر سند ویژگی score (امتیاز BM25، یا None در جستجوی icontains) می‌گیرد.
+    min_score فقط روی امتیاز BM25 اعمال می‌شود.
+
+    Args:
+        queryset: محدود کردن جستجو به اسناد این QuerySet (اختیاری)
+
+    Returns:
+        لیست اسناد به ترتیب امتیاز
+    """
+    from .models import Document
+
+    if not is_available():
+        base = Document.objects.all() if queryset is None else queryset
+        documents = list(base.filter(
+            Q(title__icontains=query) | Q(content__icontains=query)
+        ).with_related()[offset:offset + limit])
+        for doc in documents:
+            doc.score = None
+        return documents
+
+    hits = search(query, limit, offset, queryset=queryset)
+    if min_score is not None:
+        hits = [(doc_id, score) for doc_id, score in hits if score >= min_score]
+    doc_dict = Document.objects.with_related().in_bulk([doc_id for doc_id, _ in hits])
+    documents = []
+    for doc_id, score in hits:
+        if doc_id in doc_dict:
+            doc_dict[doc_id].score = score
+            documents.append(doc_dict[doc_id])
+    return documents
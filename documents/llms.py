@@ -0,0 +1,55 @@
+"""
+LLM محلی ساده برای تست و توسعه
+
+StubLLM بدون نیاز به مدل واقعی پاسخ قطعی تولید می‌کند و رابط‌های اصلی
+LangChain (فراخوانی مستقیم، invoke، stream و نسخه‌های async آن‌ها) را دارد.
+با QA_LLM_BACKEND='stub' فعال می‌شود و QA_STUB_LLM_DELAY تأخیر تولید را شبیه‌سازی می‌کند.
+"""
+import asyncio
+import time
+from typing import AsyncIterator, Iterator
+
+
+class StubLLM:
+    """LLM ساختگی که پاسخ ثابت و قابل پیش‌بینی برمی‌گرداند"""
+    
+    model = 'stub'
+    
+    def __init__(self, delay: float = 0.0, answer: str = None):
+        self.delay = delay
+        self.answer = answer
+    
+    def _answer(self, prompt: str) -> str:
+        if self.answer is not None:
+            return self.answer
+        return f"پاسخ آزمایشی برای prompt با {len(prompt)} کاراکتر."
+    
+    def _tokens(self, prompt: str):
+        words = self._answer(prompt).split(' ')
+        return [word if i == len(words) - 1 else word + ' ' for i, word in enumerate(words)]
+    
+    def get_num_tokens(self, text: str) -> int:
+        return len(text.split())
+    
+    def __call__(self, prompt: str) -> str:
+        return self.invoke(prompt)
+    
+    def invoke(self, prompt: str) -> str:
+        time.sleep(self.delay)
+        return self._answer(prompt)
+    
+    async def ainvoke(self, prompt: str) -> str:
+        await asyncio.sleep(self.delay)
+        return self._answer(prompt)
+    
+    def stream(self, prompt: str) -> Iterator[str]:
+        tokens = self._tokens(prompt)
+        for token in tokens:
+            time.sleep(self.delay / len(tokens))
+            yield token
+    
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        tokens = self._tokens(prompt)
+        for token in tokens:
+            await asyncio.sleep(self.delay / len(tokens))
+            yield token
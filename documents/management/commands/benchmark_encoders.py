@@ -0,0 +1,133 @@
+"""
+Management command برای مقایسه backend های encode (PyTorch، ONNX و ONNX int8)
+"""
+import time
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from documents.encoders import BACKENDS, load_encoder
+from documents.models import Document, DocumentChunk
+
+
+class Command(BaseCommand):
+    help = 'مقایسه تأخیر، throughput و هم‌خوانی embedding های backend های مختلف encode با مدل مرجع'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backends',
+            default=','.join(BACKENDS),
+            help=f'backend های مورد مقایسه، جدا شده با کاما (پیش‌فرض: {",".join(BACKENDS)})'
+        )
+        parser.add_argument(
+            '--reference',
+            default='torch',
+            choices=BACKENDS,
+            help='backend مرجع برای بررسی هم‌خوانی (پیش‌فرض: torch)'
+        )
+        parser.add_argument(
+            '--samples',
+            type=int,
+            default=500,
+            help='تعداد قطعه‌های اسناد برای سنجش throughput و هم‌خوانی (پیش‌فرض: 500)'
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=100,
+            help='تعداد query تکی برای سنجش تأخیر (پیش‌فرض: 100)'
+        )
+        parser.add_argument('--batch-size', type=int, default=32, help='اندازه دسته encode (پیش‌فرض: 32)')
+        parser.add_argument(
+            '--min-cosine',
+            type=float,
+            default=0.99,
+            help='حداقل میانگین شباهت کسینوسی با مدل مرجع برای قبول backend (پیش‌فرض: 0.99)'
+        )
+    
+    def _sample_texts(self, samples: int, queries: int):
+        """متن قطعه‌های ذخیره شده (مانند ورودی encode اسناد) و عنوان اسناد به عنوان query"""
+        texts = [
+            f"{title}\n{text}"
+            for title, text in DocumentChunk.objects.values_list('document__title', 'text')[:samples]
+        ]
+        if not texts:
+            texts = [
+                f"{title}\n{content[:settings.SEARCH_CHUNK_SIZE]}"
+                for title, content in Document.objects.values_list('title', 'content')[:samples]
+            ]
+        titles = list(Document.objects.values_list('title', flat=True)[:queries])
+        return texts, titles
+    
+    def _benchmark(self, encoder, texts, queries, batch_size):
+        # اولین فراخوانی‌ها (ساخت session و graph) در اندازه‌گیری حساب نمی‌شوند
+        encoder.encode(texts[:batch_size], batch_size=batch_size)
+        
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            encoder.encode([query])
+            latencies.append((time.perf_counter() - started) * 1000)
+        
+        started = time.perf_counter()
+        embeddings = np.asarray(encoder.encode(texts, batch_size=batch_size), dtype='float32')
+        elapsed = time.perf_counter() - started
+        return embeddings, latencies, len(texts) / max(elapsed, 1e-9)
+    
+    def handle(self, *args, **options):
+        backends = [name.strip() for name in options['backends'].split(',') if name.strip()]
+        unknown = [name for name in backends if name not in BACKENDS]
+        if unknown:
+            raise CommandError(f"backend نامعتبر: {', '.join(unknown)}")
+        reference = options['reference']
+        backends = [reference] + [name for name in backends if name != reference]
+        
+        texts, queries = self._sample_texts(options['samples'], options['queries'])
+        if not texts:
+            raise CommandError('هیچ سندی برای سنجش وجود ندارد.')
+        queries = queries or texts[:options['queries']]
+        self.stdout.write(
+            f"مدل {settings.EMBEDDING_MODEL}: {len(texts)} متن، {len(queries)} query، "
+            f"دسته {options['batch_size']}"
+        )
+        
+        reference_embeddings = None
+        failed = False
+        for backend in backends:
+            try:
+                started = time.perf_counter()
+                encoder = load_encoder(
+                    settings.EMBEDDING_MODEL,
+                    backend,
+                    onnx_dir=settings.EMBEDDING_ONNX_DIR,
+                    threads=settings.EMBEDDING_ONNX_THREADS,
+                )
+                load_seconds = time.perf_counter() - started
+                embeddings, latencies, throughput = self._benchmark(encoder, texts, queries, options['batch_size'])
+            except Exception as e:
+                if backend == reference:
+                    raise CommandError(f'خطا در اجرای backend مرجع {reference}: {e}')
+                self.stdout.write(self.style.ERROR(f'✗ {backend}: {e}'))
+                failed = True
+                continue
+            
+            line = (
+                f"{backend}: بارگذاری {load_seconds:.1f} s، تأخیر query "
+                f"p50 {np.percentile(latencies, 50):.2f} ms / p95 {np.percentile(latencies, 95):.2f} ms، "
+                f"throughput {throughput:.1f} متن در ثانیه"
+            )
+            if reference_embeddings is None:
+                reference_embeddings = embeddings
+                self.stdout.write(f"{line} (مرجع)")
+                continue
+            
+            norms = np.linalg.norm(embeddings, axis=1) * np.linalg.norm(reference_embeddings, axis=1)
+            cosine = (embeddings * reference_embeddings).sum(axis=1) / np.maximum(norms, 1e-12)
+            line += f"، شباهت کسینوسی با {reference}: میانگین {cosine.mean():.4f} / حداقل {cosine.min():.4f}"
+            if cosine.mean() >= options['min_cosine']:
+                self.stdout.write(self.style.SUCCESS(f"✓ {line}"))
+            else:
+                self.stdout.write(self.style.ERROR(f"✗ {line}"))
+                failed = True
+        
+        if failed:
+            raise CommandError('برخی backend ها اجرا نشدند یا هم‌خوانی کافی با مدل مرجع نداشتند.')
@@ -0,0 +1,73 @@
+"""
+Management command برای تبدیل index جستجوی معنایی به معیار شباهت و قالب فشرده جدید
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from documents.services import DocumentSearchService
+from documents.snapshots import read_manifest
+from documents.vector_index import EMBEDDING_DTYPES, METRICS
+
+
+class Command(BaseCommand):
+    help = (
+        'تبدیل index معنایی (مثلاً از L2 به cosine یا به SQ8/SQfp16) و قالب embedding های ذخیره شده '
+        'با استفاده از بردارهای موجود و بدون encode مجدد اسناد'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--metric',
+            choices=METRICS,
+            help='معیار شباهت index جدید؛ پیش‌فرض SEARCH_INDEX_METRIC'
+        )
+        parser.add_argument(
+            '--index-factory',
+            help='نوع index جدید (مثلاً Flat، SQ8، SQfp16، "HNSW32,SQ8")؛ پیش‌فرض SEARCH_INDEX_FACTORY'
+        )
+        parser.add_argument(
+            '--dtype',
+            choices=EMBEDDING_DTYPES,
+            help='قالب embedding های ذخیره شده در دیتابیس؛ پیش‌فرض SEARCH_EMBEDDING_DTYPE'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='تعداد اسناد یا قطعه‌های هر دسته؛ پیش‌فرض SEARCH_REBUILD_BATCH_SIZE'
+        )
+    
+    def _index_bytes(self, search_service):
+        if not search_service.index_version:
+            return None
+        try:
+            return read_manifest(search_service.index_dir, search_service.index_version).get('index_bytes')
+        except (OSError, ValueError):
+            return None
+    
+    def handle(self, *args, **options):
+        metric = options['metric'] or settings.SEARCH_INDEX_METRIC
+        dtype = options['dtype'] or settings.SEARCH_EMBEDDING_DTYPE
+        
+        search_service = DocumentSearchService()
+        if search_service.index is None:
+            raise CommandError('مدل embedding یا FAISS در دسترس نیست.')
+        before = search_service.index.describe()
+        before_bytes = self._index_bytes(search_service)
+        before_version = search_service.index_version
+        
+        converted = search_service.convert_stored_embeddings(dtype, batch_size=options['batch_size'])
+        self.stdout.write(f'{converted} قطعه به قالب {dtype} تبدیل شد.')
+        
+        # بردارهای ذخیره شده دوباره استفاده می‌شوند و فقط اسناد تغییر یافته encode می‌شوند
+        search_service.rebuild_index(
+            factory=options['index_factory'],
+            batch_size=options['batch_size'],
+            metric=metric,
+        )
+        if search_service.index_version == before_version:
+            raise CommandError('ساخت index جدید ناموفق بود.')
+        
+        after_bytes = self._index_bytes(search_service)
+        line = f'✓ {before} → {search_service.index.describe()}، {search_service.index.ntotal} قطعه'
+        if before_bytes and after_bytes:
+            line += f' (حجم index از {before_bytes / 2 ** 20:.1f} MB به {after_bytes / 2 ** 20:.1f} MB)'
+        self.stdout.write(self.style.SUCCESS(line))
@@ -0,0 +1,56 @@
+"""
+Management command برای export مدل embedding به ONNX (پیش از استفاده از backend های onnx و onnx-int8)
+"""
+import os
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from documents.encoders import export_onnx, model_dir, onnx_model_path
+
+
+class Command(BaseCommand):
+    help = (
+        'export مدل EMBEDDING_MODEL به ONNX (و نسخه int8 آن) در EMBEDDING_ONNX_DIR؛ '
+        'فقط این دستور به PyTorch و sentence-transformers نیاز دارد'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model',
+            help='نام مدل SentenceTransformer؛ پیش‌فرض EMBEDDING_MODEL'
+        )
+        parser.add_argument(
+            '--no-quantize',
+            action='store_true',
+            help='ساخت نکردن نسخه int8 (لازم برای backend onnx-int8)'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='export مجدد حتی اگر فایل‌های ONNX وجود داشته باشند'
+        )
+    
+    def handle(self, *args, **options):
+        model_name = options['model'] or settings.EMBEDDING_MODEL
+        quantize = not options['no_quantize']
+        onnx_dir = settings.EMBEDDING_ONNX_DIR
+        
+        required = [onnx_model_path(onnx_dir, model_name)]
+        if quantize:
+            required.append(onnx_model_path(onnx_dir, model_name, quantized=True))
+        if not options['force'] and all(os.path.exists(path) for path in required):
+            self.stdout.write(f'فایل‌های ONNX مدل {model_name} از قبل وجود دارند (برای export مجدد --force).')
+            return
+        
+        path = model_dir(onnx_dir, model_name)
+        self.stdout.write(f'در حال export مدل {model_name} به {path}...')
+        started = time.perf_counter()
+        try:
+            export_onnx(model_name, path, quantize=quantize)
+        except ImportError as e:
+            raise CommandError(f'{e.name or e} نصب نشده است؛ export به PyTorch، sentence-transformers و onnxruntime نیاز دارد.')
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ مدل در {time.perf_counter() - started:.1f} ثانیه export شد؛ '
+            f'backend با EMBEDDING_BACKEND={"onnx-int8" if quantize else "onnx"} قابل استفاده است.'
+        ))
@@ -0,0 +1,101 @@
+"""
+Management command برای ورود دسته‌ای اسناد از فایل‌های JSONL، CSV یا پوشه‌ای از فایل‌های متنی
+"""
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from documents.importing import import_records, read_records
+from documents.indexing import enqueue_documents
+from documents.services import DocumentSearchService
+
+
+class Command(BaseCommand):
+    help = 'ورود دسته‌ای اسناد از فایل JSONL/CSV یا پوشه فایل‌های .txt/.md و index دسته‌ای آن‌ها'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'sources',
+            nargs='+',
+            help='مسیر فایل .jsonl یا .csv (ستون‌های title، content و tags) یا پوشه فایل‌های متنی'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='تعداد اسناد در هر bulk_create (پیش‌فرض: 1000)'
+        )
+        parser.add_argument(
+            '--index-batch-size',
+            type=int,
+            default=1000,
+            help='تعداد اسناد در هر فراخوانی encode هنگام index (پیش‌فرض: 1000)'
+        )
+        parser.add_argument(
+            '--defer-indexing',
+            action='store_true',
+            help='به جای index در همین دستور، اسناد در صف index (process_index_queue) قرار گیرند'
+        )
+        parser.add_argument('--user', help='نام کاربری ایجاد کننده اسناد (اختیاری)')
+
+    def handle(self, *args, **options):
+        created_by = None
+        if options['user']:
+            try:
+                created_by = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"کاربر {options['user']} وجود ندارد.")
+        
+        def report(created, skipped):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'  {created} سند ذخیره شد ({created / max(elapsed, 1e-6):.1f} سند در ثانیه)، {skipped} رکورد نادیده گرفته شد')
+        
+        document_ids = []
+        for source in options['sources']:
+            self.stdout.write(f'ورود اسناد از {source}...')
+            started = time.perf_counter()
+            try:
+                result = import_records(
+                    read_records(source),
+                    batch_size=options['batch_size'],
+                    created_by=created_by,
+                    progress=report,
+                )
+            except (OSError, ValueError) as e:
+                raise CommandError(f'خطا در خواندن {source}: {e}')
+            document_ids.extend(result.document_ids)
+            self.stdout.write(self.style.SUCCESS(
+                f'✓ {result.created} سند از {source} در {result.elapsed:.2f} ثانیه '
+                f'({result.rate:.1f} سند در ثانیه) ذخیره شد.'
+            ))
+        
+        if not document_ids:
+            return
+        
+        if options['defer_indexing']:
+            enqueue_documents(document_ids)
+            self.stdout.write(self.style.SUCCESS(f'✓ {len(document_ids)} سند در صف index قرار گرفت.'))
+            return
+        
+        search_service = DocumentSearchService()
+        if search_service.index is None:
+            enqueue_documents(document_ids)
+            self.stdout.write(self.style.WARNING(
+                'index جستجوی معنایی در دسترس نیست؛ اسناد در صف index قرار گرفتند.'
+            ))
+            return
+        
+        self.stdout.write(f'index {len(document_ids)} سند...')
+        started = time.perf_counter()
+        
+        def index_report(done):
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'  {done}/{len(document_ids)} سند encode شد ({done / max(elapsed, 1e-6):.1f} سند در ثانیه)')
+        
+        chunks = search_service.add_documents(
+            document_ids, batch_size=options['index_batch_size'], progress=index_report
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {len(document_ids)} سند ({chunks} قطعه) در {elapsed:.2f} ثانیه index شد '
+            f'({len(document_ids) / max(elapsed, 1e-6):.1f} سند در ثانیه).'
+        ))
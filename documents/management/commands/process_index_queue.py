@@ -0,0 +1,90 @@
+"""
+Management command برای پردازش صف index به صورت دسته‌ای
+"""
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from documents.indexing import failed_count, pending_count, process_queue, retry_failed
+from documents.services import DocumentSearchService
+
+
+class Command(BaseCommand):
+    help = 'پردازش صف index و اعمال دسته‌ای تغییرات اسناد در index جستجو'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=256,
+            help='حداکثر تعداد وظایف در هر دسته (پیش‌فرض: 256)'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='پردازش صف فعلی و خروج به جای اجرای دائمی'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2.0,
+            help='فاصله بررسی صف خالی و انتظار پس از خطا بر حسب ثانیه (پیش‌فرض: 2)'
+        )
+        parser.add_argument(
+            '--retry-failed',
+            action='store_true',
+            help='برگرداندن وظایف ناموفق (پس از INDEX_QUEUE_MAX_ATTEMPTS تلاش) به صف'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        search_service = DocumentSearchService()
+        
+        if search_service.index is None:
+            self.stdout.write(self.style.ERROR('✗ index جستجوی معنایی در دسترس نیست.'))
+            return
+        
+        if options['retry_failed']:
+            self.stdout.write(f'{retry_failed()} وظیفه ناموفق به صف برگردانده شد.')
+        
+        self.stdout.write(f'شروع پردازش صف index ({pending_count()} وظیفه در انتظار)...')
+        failed = failed_count()
+        if failed:
+            self.stdout.write(self.style.WARNING(
+                f'{failed} وظیفه ناموفق کنار گذاشته شده است (برای تلاش مجدد: --retry-failed).'
+            ))
+        
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    result = process_queue(search_service, batch_size=batch_size)
+                except Exception as e:
+                    # خطای موقت (مثلاً قطع اتصال دیتابیس) نباید worker را متوقف کند
+                    self.stderr.write(self.style.ERROR(f'✗ خطا در پردازش صف index: {e}'))
+                    close_old_connections()
+                    if options['once']:
+                        break
+                    time.sleep(options['interval'])
+                    continue
+                
+                if result.tasks:
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f'✓ {result.tasks} وظیفه ({result.documents} سند) در {elapsed:.2f} ثانیه '
+                        f'({result.documents / max(elapsed, 1e-6):.1f} سند در ثانیه) پردازش شد.'
+                    )
+                    if result.failed_task_ids:
+                        ids = ', '.join(str(task_id) for task_id in result.failed_task_ids)
+                        self.stderr.write(self.style.ERROR(f'✗ وظایف ناموفق: {ids}'))
+                        time.sleep(options['interval'])
+                    continue
+                
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'✓ پایان پردازش صف. {len(search_service.document_ids)} سند در index.')
+        )
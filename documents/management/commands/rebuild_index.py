@@ -2,18 +2,60 @@
 Management command برای ساخت مجدد index جستجوی معنایی
 """
 from django.core.management.base import BaseCommand
+from documents import lexical
 from documents.services import DocumentSearchService
 
 
 class Command(BaseCommand):
     help = 'ساخت مجدد index جستجوی معنایی برای تمام اسناد'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='قطعه‌بندی و encode مجدد تمام اسناد، حتی اسناد بدون تغییر'
+        )
+        parser.add_argument(
+            '--index-factory',
+            help='نوع index (مثلاً Flat، HNSW32، "IVF{nlist},Flat")؛ پیش‌فرض SEARCH_INDEX_FACTORY'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='تعداد اسناد هر دسته خواندن و encode؛ پیش‌فرض SEARCH_REBUILD_BATCH_SIZE'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='تعداد پروسه‌های encode (پیش‌فرض: 1)'
+        )
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='ادامه ساخت ناتمام قبلی از آخرین checkpoint (با همان --force و --index-factory)'
+        )
+        parser.add_argument(
+            '--eval-queries',
+            type=int,
+            default=100,
+            help='تعداد query برای سنجش recall و تأخیر پس از ساخت (0 برای غیرفعال کردن)'
+        )
+        parser.add_argument('--nprobe', type=int, help='nprobe برای سنجش index های IVF')
+        parser.add_argument('--ef-search', type=int, help='efSearch برای سنجش index های HNSW')
+
     def handle(self, *args, **options):
         self.stdout.write('شروع ساخت مجدد index...')
         
         try:
             search_service = DocumentSearchService()
-            search_service.rebuild_index()
+            search_service.rebuild_index(
+                force=options['force'],
+                factory=options['index_factory'],
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                resume=options['resume'],
+            )
             
             self.stdout.write(
                 self.style.SUCCESS(
@@ -24,4 +66,21 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.ERROR(f'✗ خطا در ساخت index: {e}')
             )
-
+            return
+        
+        if lexical.is_available():
+            count = lexical.rebuild()
+            self.stdout.write(self.style.SUCCESS(f'✓ Index واژگانی (BM25) برای {count} سند ساخته شد.'))
+        
+        if options['eval_queries'] > 0:
+            report = search_service.evaluate_index(
+                sample_size=options['eval_queries'],
+                nprobe=options['nprobe'],
+                ef_search=options['ef_search'],
+            )
+            if report:
+                self.stdout.write(
+                    f"{report['index_type']}: recall@{report['k']} = {report['recall']:.3f}, "
+                    f"{report['latency_ms']:.3f} ms/query "
+                    f"(Flat: {report['exact_latency_ms']:.3f} ms/query, {report['queries']} queries)"
+                )
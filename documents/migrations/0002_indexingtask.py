@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndexingTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_id', models.BigIntegerField(db_index=True, verbose_name='شناسه سند')),
+                ('action', models.CharField(choices=[('index', 'index'), ('delete', 'delete')], max_length=10, verbose_name='عملیات')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')),
+            ],
+            options={
+                'verbose_name': 'وظیفه index',
+                'verbose_name_plural': 'صف index',
+                'ordering': ['id'],
+            },
+        ),
+    ]
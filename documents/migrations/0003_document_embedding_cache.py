@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_indexingtask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=64, verbose_name='Hash محتوا'),
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='embedding_model',
+            field=models.CharField(blank=True, default='', editable=False, max_length=255, verbose_name='مدل Embedding'),
+        ),
+        # ستون قبلی هرگز مقدار نگرفته است؛ حذف و ایجاد مجدد از تبدیل نوع
+        # text به binary (که در همه پایگاه‌داده‌ها پشتیبانی نمی‌شود) جلوگیری می‌کند
+        migrations.RemoveField(
+            model_name='document',
+            name='embedding',
+        ),
+        migrations.AddField(
+            model_name='document',
+            name='embedding',
+            field=models.BinaryField(blank=True, null=True, verbose_name='Embedding'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def reset_content_hashes(apps, schema_editor):
+    """embedding های سطح سند حذف شده‌اند؛ تمام اسناد باید دوباره قطعه‌بندی شوند"""
+    Document = apps.get_model('documents', 'Document')
+    Document.objects.update(content_hash='', embedding_model='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_document_embedding_cache'),
+    ]
+
+    operations = [
+        migrations.RunPython(reset_content_hashes, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='document',
+            name='embedding',
+        ),
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='ترتیب')),
+                ('start', models.PositiveIntegerField(verbose_name='شروع')),
+                ('end', models.PositiveIntegerField(verbose_name='پایان')),
+                ('text', models.TextField(verbose_name='متن')),
+                ('embedding', models.BinaryField(verbose_name='Embedding')),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='documents.document', verbose_name='سند')),
+            ],
+            options={
+                'verbose_name': 'قطعه سند',
+                'verbose_name_plural': 'قطعه\u200cهای سند',
+                'ordering': ['document', 'position'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='documentchunk',
+            constraint=models.UniqueConstraint(fields=('document', 'position'), name='unique_document_chunk_position'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+import re
+
+from django.db import migrations
+
+# DDL و یکسان‌سازی متن در زمان این migration؛ عمداً از documents.lexical import نمی‌شوند
+# تا تغییرات بعدی آن ماژول روی اجرای مجدد migration های قدیمی اثر نگذارد
+FTS_TABLE = 'documents_document_fts'
+CREATE_FTS_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+    "USING fts5(title, content, tokenize='unicode61 remove_diacritics 2')"
+)
+DROP_FTS_TABLE_SQL = f"DROP TABLE IF EXISTS {FTS_TABLE}"
+INSERT_SQL = f"INSERT INTO {FTS_TABLE} (rowid, title, content) VALUES (%s, %s, %s)"
+
+_CHARACTER_MAP = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'ٱ': 'ا', 'آ': 'ا', 'ؤ': 'و',
+    '\u200c': ' ', '\u200d': '', '\u0640': '',
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+})
+_DIACRITICS = re.compile('[\u064b-\u065f\u0670]')
+
+
+def normalize_text(text):
+    return _DIACRITICS.sub('', text.translate(_CHARACTER_MAP)).lower()
+
+
+def create_fts_table(apps, schema_editor):
+    """ساخت جدول FTS5 برای جستجوی BM25 و پر کردن آن با اسناد موجود (فقط در SQLite)"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        schema_editor.execute(CREATE_FTS_TABLE_SQL)
+    except Exception as e:
+        print(f"Warning: Could not create FTS5 table, lexical search will use icontains: {e}")
+        return
+
+    Document = apps.get_model('documents', 'Document')
+    rows = Document.objects.values_list('id', 'title', 'content')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        batch = []
+        for doc_id, title, content in rows.iterator(chunk_size=1000):
+            batch.append((doc_id, normalize_text(title), normalize_text(content)))
+            if len(batch) >= 1000:
+                cursor.executemany(INSERT_SQL, batch)
+                batch = []
+        if batch:
+            cursor.executemany(INSERT_SQL, batch)
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(DROP_FTS_TABLE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_documentchunk'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_document_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='indexingtask',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='تعداد تلاش ناموفق'),
+        ),
+        migrations.AddField(
+            model_name='indexingtask',
+            name='last_error',
+            field=models.TextField(blank=True, verbose_name='آخرین خطا'),
+        ),
+    ]
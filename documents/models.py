@@ -1,3 +1,5 @@
+import hashlib
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -17,6 +19,12 @@ class Tag(models.Model):
         return self.name
 
 
+class DocumentQuerySet(models.QuerySet):
+    def with_related(self):
+        """دریافت برچسب‌ها و ایجاد کننده همراه اسناد (بدون پرس‌وجو جداگانه برای هر سند)"""
+        return self.select_related('created_by').prefetch_related('tags')
+
+
 class Document(models.Model):
     """مدل برای اسناد متنی"""
     title = models.CharField(max_length=255, verbose_name='عنوان')
@@ -32,14 +40,90 @@ class Document(models.Model):
         verbose_name='ایجاد کننده'
     )
     
-    # برای ذخیره embedding در آینده
-    embedding = models.TextField(blank=True, null=True, verbose_name='Embedding')
+    # hash محتوا و نام مدلی که embedding قطعه‌های فعلی سند با آن ساخته شده‌اند،
+    # تا در ساخت مجدد index اسناد بدون تغییر دوباره encode نشوند
+    content_hash = models.CharField(max_length=64, blank=True, default='', editable=False, verbose_name='Hash محتوا')
+    embedding_model = models.CharField(max_length=255, blank=True, default='', editable=False, verbose_name='مدل Embedding')
+
+    objects = DocumentQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'سند'
         verbose_name_plural = 'اسناد'
-        ordering = ['-created_at']
+        ordering = ['-created_at', '-id']
+        indexes = [
+            # صفحه‌بندی keyset لیست اسناد
+            models.Index(fields=['created_at', 'id'], name='document_created_at_id_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def embedding_text(self):
+        """متنی که برای ساخت embedding سند استفاده می‌شود"""
+        return f"{self.title}\n{self.content}"
+
+    def compute_content_hash(self):
+        """محاسبه hash عنوان و محتوای فعلی سند"""
+        return hashlib.sha256(self.embedding_text.encode('utf-8')).hexdigest()
+
+    def is_index_current(self, model_name):
+        """آیا قطعه‌های ذخیره شده با محتوای فعلی و مدل داده شده مطابقت دارند"""
+        return (
+            self.embedding_model == model_name
+            and self.content_hash == self.compute_content_hash()
+        )
+
+
+class DocumentChunk(models.Model):
+    """قطعه‌ای از متن سند به همراه embedding آن"""
+    document = models.ForeignKey(
+        Document,
+        on_delete=models.CASCADE,
+        related_name='chunks',
+        verbose_name='سند'
+    )
+    position = models.PositiveIntegerField(verbose_name='ترتیب')
+    start = models.PositiveIntegerField(verbose_name='شروع')
+    end = models.PositiveIntegerField(verbose_name='پایان')
+    text = models.TextField(verbose_name='متن')
+    # بایت‌های بردار embedding با قالب SEARCH_EMBEDDING_DTYPE (float32، float16 یا int8)
+    embedding = models.BinaryField(verbose_name='Embedding')
+
+    class Meta:
+        verbose_name = 'قطعه سند'
+        verbose_name_plural = 'قطعه‌های سند'
+        ordering = ['document', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'position'], name='unique_document_chunk_position'),
+        ]
+
+    def __str__(self):
+        return f"{self.document_id}:{self.position}"
+
+
+
+class IndexingTask(models.Model):
+    """صف پایدار تغییرات اسناد که باید در index جستجو اعمال شوند"""
+    ACTION_INDEX = 'index'
+    ACTION_DELETE = 'delete'
+    ACTION_CHOICES = [
+        (ACTION_INDEX, 'index'),
+        (ACTION_DELETE, 'delete'),
+    ]
+
+    # عمداً ForeignKey نیست تا پس از حذف سند هم باقی بماند
+    document_id = models.BigIntegerField(db_index=True, verbose_name='شناسه سند')
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES, verbose_name='عملیات')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='تعداد تلاش ناموفق')
+    last_error = models.TextField(blank=True, verbose_name='آخرین خطا')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')
+
+    class Meta:
+        verbose_name = 'وظیفه index'
+        verbose_name_plural = 'صف index'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.action} #{self.document_id}"
@@ -0,0 +1,114 @@
+from django.core import signing
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+DOCUMENT_CURSOR_SALT = 'documents.list.cursor'
+
+
+class DocumentCursorPagination(BasePagination):
+    """
+    صفحه‌بندی keyset لیست اسناد بر اساس (created_at، id)
+
+    cursor هر صفحه هر دو مقدار (created_at، id) آخرین یا اولین سند صفحه قبل را
+    نگه می‌دارد و صفحه بعد با شرط
+    created_at < t OR (created_at = t AND id < pk)
+    روی index (created_at، id) خوانده می‌شود؛ بنابراین اسناد با created_at برابر
+    جا نمی‌افتند یا تکرار نمی‌شوند و هزینه صفحه‌های عمیق مانند صفحه اول است.
+
+    پاسخ فقط next، previous و results دارد: فیلد count صفحه‌بندی شماره‌ای قبلی
+    حذف شده است، چون محاسبه آن برای هر صفحه یک COUNT(*) روی کل جدول است.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'cursor نامعتبر است.'
+
+    def get_page_size(self, request) -> int:
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(size, self.max_page_size) if size > 0 else self.page_size
+
+    def encode_cursor(self, document, reverse: bool) -> str:
+        position = {'created_at': document.created_at.isoformat(), 'id': document.pk, 'reverse': reverse}
+        return replace_query_param(
+            self.base_url, self.cursor_query_param, signing.dumps(position, salt=DOCUMENT_CURSOR_SALT)
+        )
+
+    def decode_cursor(self, request):
+        """خواندن (reverse، created_at، id) از cursor درخواست (None برای صفحه اول)"""
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            position = signing.loads(cursor, salt=DOCUMENT_CURSOR_SALT)
+            created_at = parse_datetime(position['created_at'])
+            pk = int(position['id'])
+            reverse = bool(position['reverse'])
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, created_at, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        position = self.decode_cursor(request)
+
+        reverse = False
+        queryset = queryset.order_by('-created_at', '-id')
+        if position is not None:
+            reverse, created_at, pk = position
+            if reverse:
+                # صفحه قبل: اسناد جدیدتر از اولین سند صفحه فعلی، به ترتیب صعودی
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                ).order_by('created_at', 'id')
+            else:
+                queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        # با برگشت به صفحه قبل، صفحه بعد همیشه وجود دارد
+        self.next_document = results[-1] if results and (reverse or has_more) else None
+        self.previous_document = results[0] if results and (has_more if reverse else position is not None) else None
+        return results
+
+    def get_next_link(self):
+        if self.next_document is None:
+            return None
+        return self.encode_cursor(self.next_document, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_document is None:
+            return None
+        return self.encode_cursor(self.previous_document, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
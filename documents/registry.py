@@ -0,0 +1,48 @@
+"""
+نگهداری instance های مشترک سرویس‌ها در هر پروسه
+
+مدل embedding، index و LLM فقط یک بار در هر پروسه بارگذاری می‌شوند، حتی اگر
+چند درخواست هم‌زمان در یک سرور چندنخی اولین درخواست‌ها باشند. ماژول services
+فقط هنگام اولین استفاده import می‌شود تا دستورات manage.py مانند migrate
+کتابخانه‌های سنگین (torch و ...) را بارگذاری نکنند.
+"""
+import threading
+
+_lock = threading.Lock()
+_search_service = None
+_qa_service = None
+
+
+def get_search_service():
+    """دریافت instance سرویس جستجو (singleton)"""
+    global _search_service
+    service = _search_service
+    if service is None:
+        with _lock:
+            if _search_service is None:
+                from .services import DocumentSearchService
+                _search_service = DocumentSearchService()
+            service = _search_service
+    else:
+        # جایگزینی index با snapshot جدیدتر بین درخواست‌ها (بدون restart)
+        service.reload_if_changed()
+    return service
+
+
+def get_qa_service():
+    """دریافت instance سرویس Q&A (singleton) که از همان سرویس جستجو استفاده می‌کند"""
+    global _qa_service
+    search_service = get_search_service()
+    service = _qa_service
+    if service is None:
+        with _lock:
+            if _qa_service is None:
+                from .services import QAService
+                _qa_service = QAService(search_service=search_service)
+            service = _qa_service
+    return service
+
+
+def warm_up():
+    """بارگذاری پیشاپیش مدل‌ها و index (مثلاً پیش از fork شدن worker ها)"""
+    get_qa_service()
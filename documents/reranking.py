@@ -0,0 +1,48 @@
+"""
+مرحله rerank نتایج جستجوی معنایی با cross-encoder
+
+cross-encoder هر جفت (query، قطعه) را با هم پردازش می‌کند و رتبه‌بندی دقیق‌تری
+از شباهت embedding ها می‌دهد، اما بسیار کندتر است؛ بنابراین فقط روی تعداد
+محدودی نامزد از جستجوی FAISS (SEARCH_RERANK_CANDIDATES) اجرا می‌شود.
+مدل با sentence-transformers (وابستگی اختیاری) روی همان پروسه اجرا می‌شود.
+"""
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+
+
+class CrossEncoderReranker:
+    """امتیازدهی ارتباط متن‌ها با query با یک مدل cross-encoder محلی"""
+    
+    def __init__(self, model_name: str, batch_size: int = 16, max_length: int = None):
+        from sentence_transformers import CrossEncoder
+        
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.model = CrossEncoder(model_name, max_length=max_length)
+    
+    def score(self, query: str, texts: Sequence[str], deadline: float = None) -> Optional[np.ndarray]:
+        """
+        امتیاز ارتباط هر متن با query (بیشتر یعنی مرتبط‌تر)
+        
+        متن‌ها در دسته‌های batch_size امتیازدهی می‌شوند. اگر با زمان دسته‌های قبلی
+        پیش‌بینی شود که دسته بعدی پس از deadline (مقدار time.perf_counter) تمام
+        می‌شود، امتیازدهی متوقف و None برگردانده می‌شود.
+        """
+        scores = np.empty(len(texts), dtype='float32')
+        started = time.perf_counter()
+        for batch_number, start in enumerate(range(0, len(texts), self.batch_size)):
+            if deadline is not None and batch_number:
+                per_batch = (time.perf_counter() - started) / batch_number
+                if time.perf_counter() + per_batch > deadline:
+                    return None
+            batch = texts[start:start + self.batch_size]
+            scores[start:start + len(batch)] = self.model.predict(
+                [(query, text) for text in batch],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+        if deadline is not None and time.perf_counter() > deadline:
+            return None
+        return scores
@@ -1,6 +1,17 @@
+from django.conf import settings
+from django.core import signing
 from rest_framework import serializers
+from . import lexical
+from .caching import normalize_query
 from .models import Document, Tag
 
+SEARCH_CURSOR_SALT = 'documents.search.cursor'
+
+
+def encode_search_cursor(query: str, search_type: str, offset: int) -> str:
+    """ساخت cursor امضا شده برای صفحه بعدی نتایج یک جستجو"""
+    return signing.dumps({'q': normalize_query(query), 't': search_type, 'o': offset}, salt=SEARCH_CURSOR_SALT)
+
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -8,7 +19,17 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class DocumentSerializer(serializers.ModelSerializer):
+class DynamicFieldsMixin:
+    """محدود کردن فیلدهای خروجی serializer با آرگومان fields"""
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class DocumentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True, read_only=True)
     tag_ids = serializers.PrimaryKeyRelatedField(
         many=True,
@@ -28,16 +49,203 @@ class DocumentSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_by', 'created_at', 'updated_at']
 
 
-class DocumentSearchSerializer(serializers.Serializer):
+class BulkDocumentItemSerializer(serializers.Serializer):
+    title = serializers.CharField(max_length=Document._meta.get_field('title').max_length)
+    content = serializers.CharField()
+    tag_ids = serializers.ListField(child=serializers.IntegerField(), required=False, help_text='ID برچسب‌ها')
+    tags = serializers.ListField(
+        child=serializers.CharField(max_length=Tag._meta.get_field('name').max_length),
+        required=False,
+        help_text='نام برچسب‌ها (برچسب‌های جدید ساخته می‌شوند)'
+    )
+
+
+class BulkDocumentSerializer(serializers.Serializer):
+    documents = BulkDocumentItemSerializer(many=True, help_text='لیست اسناد جدید')
+
+    def validate_documents(self, value):
+        if not value:
+            raise serializers.ValidationError('حداقل یک سند لازم است.')
+        if len(value) > settings.DOCUMENT_BULK_MAX_DOCUMENTS:
+            raise serializers.ValidationError(
+                f'حداکثر {settings.DOCUMENT_BULK_MAX_DOCUMENTS} سند در هر درخواست مجاز است.'
+            )
+        # بررسی تمام ID برچسب‌ها با یک پرس‌وجو
+        tag_ids = {tag_id for item in value for tag_id in item.get('tag_ids', [])}
+        missing = tag_ids - set(Tag.objects.filter(id__in=tag_ids).values_list('id', flat=True))
+        if missing:
+            raise serializers.ValidationError(f'برچسب‌های نامعتبر: {sorted(missing)}')
+        return value
+
+
+class SearchResultSerializer(DocumentSerializer):
+    """سند نتیجه جستجو به همراه امتیاز آن"""
+    score = serializers.FloatField(read_only=True, default=None)
+
+    class Meta(DocumentSerializer.Meta):
+        fields = DocumentSerializer.Meta.fields + ['score']
+
+
+class SearchSummarySerializer(DynamicFieldsMixin, serializers.Serializer):
+    """
+    خلاصه سند نتیجه جستجو: عنوان، امتیاز و snippet حول قطعه منطبق
+
+    query از context['query'] خوانده می‌شود و واژه‌های منطبق در snippet با
+    <mark> مشخص می‌شوند.
+    """
+    id = serializers.IntegerField(read_only=True)
+    title = serializers.CharField(read_only=True)
+    score = serializers.FloatField(read_only=True, default=None)
+    snippet = serializers.SerializerMethodField()
+
+    def get_snippet(self, obj):
+        passages = getattr(obj, 'matched_passages', None)
+        text = passages[0] if passages else obj.content
+        return lexical.highlight(text, self.context.get('query', ''), settings.SEARCH_SNIPPET_LENGTH)
+
+
+RESULT_SERIALIZERS = {
+    'full': SearchResultSerializer,
+    'summary': SearchSummarySerializer,
+}
+
+
+def serialize_results(documents, query: str, view: str = 'full', fields=None) -> list:
+    """serialize اسناد نتیجه با نمای درخواستی (full یا summary) و فیلدهای انتخاب شده"""
+    serializer_class = RESULT_SERIALIZERS[view]
+    return serializer_class(documents, many=True, fields=fields, context={'query': query}).data
+
+
+class ResultViewSerializer(serializers.Serializer):
+    """انتخاب نمای نتایج: کامل (full) یا خلاصه (summary) و فیلدهای خروجی"""
+    view = serializers.ChoiceField(
+        choices=list(RESULT_SERIALIZERS),
+        default='full',
+        help_text='full: سند کامل؛ summary: فقط id، title، score و snippet'
+    )
+    fields = serializers.ListField(
+        child=serializers.CharField(),
+        required=False,
+        help_text='فیلدهای خروجی هر نتیجه (اختیاری، از فیلدهای نمای انتخاب شده)'
+    )
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        fields = attrs.get('fields')
+        if fields:
+            available = RESULT_SERIALIZERS[attrs['view']]().fields
+            unknown = [name for name in fields if name not in available or available[name].write_only]
+            if unknown:
+                raise serializers.ValidationError({'fields': f'فیلدهای نامعتبر: {", ".join(unknown)}'})
+        return attrs
+
+
+class SearchFiltersSerializer(serializers.Serializer):
+    """فیلترهای اختیاری جستجو؛ پیش از جستجو اعمال می‌شوند و صفحه نتایج را کوچک نمی‌کنند"""
+    tags = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        help_text='فقط اسنادی که حداقل یکی از این برچسب‌ها (ID) را دارند'
+    )
+    created_after = serializers.DateTimeField(required=False, help_text='فقط اسناد ایجاد شده از این زمان به بعد')
+    created_before = serializers.DateTimeField(required=False, help_text='فقط اسناد ایجاد شده تا این زمان')
+    created_by = serializers.IntegerField(required=False, help_text='فقط اسناد ایجاد شده توسط این کاربر (ID)')
+
+
+class DocumentSearchSerializer(ResultViewSerializer, SearchFiltersSerializer):
+    query = serializers.CharField(required=True, help_text='متن جستجو')
+    limit = serializers.IntegerField(default=5, min_value=1, max_value=20)
+    search_type = serializers.ChoiceField(
+        choices=['semantic', 'lexical', 'hybrid'],
+        default=lambda: settings.SEARCH_DEFAULT_TYPE,
+        help_text='روش جستجو: semantic (معنایی)، lexical (BM25) یا hybrid (ترکیبی)'
+    )
+    nprobe = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=4096,
+        help_text='تعداد خوشه‌های بررسی شده در index های IVF (اختیاری)'
+    )
+    ef_search = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=4096,
+        help_text='عمق جستجو در index های HNSW (اختیاری)'
+    )
+    min_score = serializers.FloatField(
+        required=False,
+        help_text='حذف نتایج با امتیاز کمتر (مقیاس امتیاز به search_type بستگی دارد)'
+    )
+    rerank = serializers.BooleanField(
+        required=False,
+        help_text='مرتب‌سازی مجدد نتایج معنایی با cross-encoder (پیش‌فرض SEARCH_RERANK)'
+    )
+    offset = serializers.IntegerField(
+        default=0,
+        min_value=0,
+        max_value=settings.SEARCH_MAX_OFFSET,
+        help_text='تعداد نتایج رد شده از ابتدا'
+    )
+    cursor = serializers.CharField(
+        required=False,
+        help_text='cursor صفحه بعد از پاسخ قبلی (به جای offset)'
+    )
+
+    def validate(self, attrs):
+        attrs = super().validate(attrs)
+        cursor = attrs.pop('cursor', None)
+        if cursor:
+            try:
+                payload = signing.loads(cursor, salt=SEARCH_CURSOR_SALT)
+            except signing.BadSignature:
+                raise serializers.ValidationError({'cursor': 'cursor نامعتبر است.'})
+            if payload.get('q') != normalize_query(attrs['query']) or payload.get('t') != attrs['search_type']:
+                raise serializers.ValidationError({'cursor': 'cursor متعلق به این جستجو نیست.'})
+            if not 0 <= payload.get('o', -1) <= settings.SEARCH_MAX_OFFSET:
+                raise serializers.ValidationError({'cursor': 'cursor از حداکثر offset مجاز فراتر رفته است.'})
+            attrs['offset'] = payload['o']
+        return attrs
+
+
+class BatchSearchQuerySerializer(serializers.Serializer):
     query = serializers.CharField(required=True, help_text='متن جستجو')
     limit = serializers.IntegerField(default=5, min_value=1, max_value=20)
 
 
-class QuestionSerializer(serializers.Serializer):
+class BatchSearchSerializer(ResultViewSerializer):
+    queries = BatchSearchQuerySerializer(many=True, help_text='لیست query ها، هر کدام با limit خود')
+    nprobe = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=4096,
+        help_text='تعداد خوشه‌های بررسی شده در index های IVF (اختیاری)'
+    )
+    ef_search = serializers.IntegerField(
+        required=False,
+        min_value=1,
+        max_value=4096,
+        help_text='عمق جستجو در index های HNSW (اختیاری)'
+    )
+
+    def validate_queries(self, value):
+        if not value:
+            raise serializers.ValidationError('حداقل یک query لازم است.')
+        if len(value) > settings.SEARCH_BATCH_MAX_QUERIES:
+            raise serializers.ValidationError(
+                f'حداکثر {settings.SEARCH_BATCH_MAX_QUERIES} query در هر درخواست مجاز است.'
+            )
+        return value
+
+
+class QuestionSerializer(ResultViewSerializer, SearchFiltersSerializer):
     question = serializers.CharField(required=True, help_text='پرسش کاربر')
     document_ids = serializers.ListField(
         child=serializers.IntegerField(),
         required=False,
         help_text='لیست ID اسناد برای جستجو (اختیاری)'
     )
+    use_cache = serializers.BooleanField(
+        default=True,
+        help_text='استفاده از پاسخ ذخیره شده در cache در صورت وجود (برای تولید مجدد false)'
+    )
 
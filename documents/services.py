@@ -1,13 +1,51 @@
 """
 سرویس‌های اصلی برای جستجو و پرسش و پاسخ
 """
-from typing import List, Tuple, Optional
+from typing import AsyncIterator, Iterator, List, NamedTuple, Tuple, Optional
 from django.conf import settings
-from django.db.models import Q
-from .models import Document
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from .batching import MicroBatcher
+from .caching import LRUCache, answer_cache_key, get_cached_answer, normalize_query, set_cached_answer
+from .chunking import TextChunk, chunk_text
+from .context import PromptContext, build_context, context_window, token_counter
+from .encoders import load_encoder
+from .filtering import FilterMasks, SearchFilters
+from . import lexical
+from .models import Document, DocumentChunk
+from .reranking import CrossEncoderReranker
+from .snapshots import (
+    clear_checkpoint, current_marker, current_version, list_versions, load_snapshot, prune_snapshots,
+    read_checkpoint, write_checkpoint, write_snapshot,
+)
+from .vector_index import (
+    METRIC_COSINE, TrainingSample, VectorIndex, build_index, normalize_vectors, pack_embedding, packed_size,
+    requires_training, search_parameters, unpack_embedding,
+)
+import asyncio
+import copy
 import os
 import json
-import pickle
+import threading
+import time
+
+
+# ID های index از شناسه سند و ترتیب قطعه ساخته می‌شوند: (document_id << CHUNK_ID_BITS) | position
+CHUNK_ID_BITS = 16
+MAX_CHUNKS_PER_DOCUMENT = 1 << CHUNK_ID_BITS
+
+
+def make_chunk_id(document_id: int, position: int) -> int:
+    """ساخت ID بردار در index برای یک قطعه از سند"""
+    return (document_id << CHUNK_ID_BITS) | position
+
+
+# انواع جستجو: معنایی (FAISS)، واژگانی (BM25) و ترکیبی (Reciprocal Rank Fusion)
+SEARCH_SEMANTIC = 'semantic'
+SEARCH_LEXICAL = 'lexical'
+SEARCH_HYBRID = 'hybrid'
+SEARCH_TYPES = (SEARCH_SEMANTIC, SEARCH_LEXICAL, SEARCH_HYBRID)
 
 
 class DocumentSearchService:
@@ -16,29 +54,83 @@ class DocumentSearchService:
     def __init__(self):
         self.embedding_model = None
         self.index = None
-        self.document_ids = []  # نگهداری mapping بین index و document IDs
-        self.index_path = 'documents_index.faiss'
-        self.mapping_path = 'documents_mapping.pkl'
+        self.document_ids = []  # اسنادی که در index حضور دارند
+        self.chunk_ids = None  # ID تمام بردارهای index (numpy array)
+        self.index_dir = settings.SEARCH_INDEX_DIR
+        self.index_version = None  # نسخه snapshot بارگذاری شده
+        self._index_marker = None
+        self._last_reload_check = 0.0
+        self._lock = threading.RLock()
+        self._encode_pool = None  # multi-process pool مدل embedding در حین rebuild_index
+        self.reranker = None
+        self._reranker_unavailable = False
+        self.query_embedding_cache = LRUCache(settings.SEARCH_QUERY_CACHE_SIZE)
+        self.result_cache = LRUCache(settings.SEARCH_RESULT_CACHE_SIZE)
+        self.filter_masks = FilterMasks(
+            self.index_dir,
+            CHUNK_ID_BITS,
+            cache_size=settings.SEARCH_FILTER_CACHE_SIZE,
+            check_interval=settings.SEARCH_INDEX_RELOAD_INTERVAL,
+        )
+        # query های هم‌زمان thread های مختلف با یک encode و یک جستجوی index پردازش می‌شوند
+        self.query_batcher = None
+        if settings.SEARCH_BATCH_MAX_SIZE > 1:
+            self.query_batcher = MicroBatcher(
+                self._process_query_batch,
+                max_batch_size=settings.SEARCH_BATCH_MAX_SIZE,
+                max_wait_ms=settings.SEARCH_BATCH_MAX_WAIT_MS,
+                name='search-query-batcher',
+            )
         self._initialize_embeddings()
+        if settings.SEARCH_RERANK:
+            self._initialize_reranker()
         self._load_or_rebuild_index()
     
     def _initialize_embeddings(self):
-        """راه‌اندازی مدل embedding"""
+        """راه‌اندازی مدل embedding با backend تنظیم شده در EMBEDDING_BACKEND"""
         try:
-            from sentence_transformers import SentenceTransformer
-            
             # بارگذاری مدل embedding
             model_name = settings.EMBEDDING_MODEL
-            print(f"Loading embedding model: {model_name}")
-            self.embedding_model = SentenceTransformer(model_name)
+            print(f"Loading embedding model: {model_name} ({settings.EMBEDDING_BACKEND} backend)")
+            self.embedding_model = load_encoder(
+                model_name,
+                settings.EMBEDDING_BACKEND,
+                onnx_dir=settings.EMBEDDING_ONNX_DIR,
+                threads=settings.EMBEDDING_ONNX_THREADS,
+            )
             print("Embedding model loaded successfully")
-        except ImportError:
-            print("Warning: sentence-transformers not installed. Semantic search will be disabled.")
+        except ImportError as e:
+            print(f"Warning: {e.name or e} not installed. Semantic search will be disabled.")
             self.embedding_model = None
         except Exception as e:
             print(f"Warning: Could not load embedding model: {e}")
             self.embedding_model = None
     
+    def _initialize_reranker(self):
+        """راه‌اندازی مدل cross-encoder مرحله rerank"""
+        try:
+            print(f"Loading rerank model: {settings.SEARCH_RERANK_MODEL}")
+            self.reranker = CrossEncoderReranker(
+                settings.SEARCH_RERANK_MODEL,
+                batch_size=settings.SEARCH_RERANK_BATCH_SIZE,
+                max_length=settings.SEARCH_RERANK_MAX_LENGTH or None,
+            )
+            print("Rerank model loaded successfully")
+        except ImportError as e:
+            print(f"Warning: {e.name or e} not installed. Reranking will be disabled.")
+            self._reranker_unavailable = True
+        except Exception as e:
+            print(f"Warning: Could not load rerank model: {e}")
+            self._reranker_unavailable = True
+    
+    def _get_reranker(self) -> Optional[CrossEncoderReranker]:
+        """مدل cross-encoder (با SEARCH_RERANK=False در اولین درخواست rerank بارگذاری می‌شود)"""
+        if self.reranker is None and not self._reranker_unavailable:
+            with self._lock:
+                if self.reranker is None and not self._reranker_unavailable:
+                    self._initialize_reranker()
+        return self.reranker
+    
     def _load_or_rebuild_index(self):
         """بارگذاری یا ساخت مجدد index"""
         try:
@@ -48,21 +140,29 @@ class DocumentSearchService:
             if not self.embedding_model:
                 return
             
-            # بارگذاری index و mapping اگر وجود داشته باشد
-            if os.path.exists(self.index_path) and os.path.exists(self.mapping_path):
-                try:
-                    self.index = faiss.read_index(self.index_path)
-                    with open(self.mapping_path, 'rb') as f:
-                        self.document_ids = pickle.load(f)
-                    print(f"Loaded index with {len(self.document_ids)} documents")
+            # بارگذاری snapshot فعال؛ اگر خراب باشد snapshot های قبلی امتحان می‌شوند
+            version = current_version(self.index_dir)
+            if version:
+                fallbacks = [previous for previous in list_versions(self.index_dir) if previous < version]
+                for candidate in [version] + fallbacks:
+                    try:
+                        self._load_snapshot(candidate)
+                    except Exception as e:
+                        print(f"Error loading index snapshot {candidate}: {e}")
+                        continue
+                    print(
+                        f"Loaded index snapshot {candidate} with {len(self.document_ids)} documents "
+                        f"({self.index.ntotal} chunks)"
+                    )
+                    if candidate != version:
+                        # تغییرات بعد از این snapshot در index نیستند
+                        print("Warning: Loaded an older index snapshot; run 'python manage.py rebuild_index' to update it.")
                     return
-                except Exception as e:
-                    print(f"Error loading index: {e}. Rebuilding...")
+                print("No valid index snapshot found. Rebuilding...")
             
             # ساخت index جدید
-            dimension = self.embedding_model.get_sentence_embedding_dimension()
-            self.index = faiss.IndexFlatL2(dimension)
-            self.document_ids = []
+            self.index = self._create_index()
+            self._sync_ids()
             print("Created new FAISS index")
             
             # ساخت index برای تمام اسناد موجود
@@ -75,121 +175,1206 @@ class DocumentSearchService:
             print(f"Warning: Could not initialize FAISS index: {e}")
             self.index = None
     
-    def rebuild_index(self):
-        """ساخت مجدد index برای تمام اسناد"""
-        if not self.embedding_model or not self.index:
+    def _create_index(self, training_vectors=None, factory: str = None, metric: str = None):
+        """
+        ساخت index خالی که بردارها را با ID قطعه نگه می‌دارد
+        
+        نوع index و معیار شباهت از تنظیمات SEARCH_INDEX_FACTORY و SEARCH_INDEX_METRIC
+        خوانده می‌شوند و index های نیازمند آموزش (مانند IVF) با training_vectors
+        آموزش داده می‌شوند.
+        """
+        dimension = self.embedding_model.get_sentence_embedding_dimension()
+        return build_index(
+            dimension,
+            factory or settings.SEARCH_INDEX_FACTORY,
+            training_vectors,
+            metric=metric or settings.SEARCH_INDEX_METRIC,
+        )
+    
+    def _build_index(self, chunk_ids, embeddings, factory: str = None, metric: str = None):
+        """ساخت، آموزش و پر کردن یک index جدید از بردارهای داده شده"""
+        import numpy as np
+        
+        training_vectors = None
+        if len(embeddings):
+            sample_size = min(len(embeddings), settings.SEARCH_INDEX_TRAINING_SAMPLE)
+            rows = np.random.default_rng(0).choice(len(embeddings), sample_size, replace=False)
+            training_vectors = embeddings[np.sort(rows)]
+        
+        index = self._create_index(training_vectors, factory=factory, metric=metric)
+        if len(embeddings):
+            index.add(embeddings, chunk_ids)
+        return index
+    
+    def _sync_ids(self):
+        """به‌روزرسانی chunk_ids و document_ids از روی index"""
+        import numpy as np
+        
+        # نتایج جستجوی index قبلی دیگر معتبر نیستند
+        self.result_cache.clear()
+        self.chunk_ids = self.index.live_ids
+        self.document_ids = [int(doc_id) for doc_id in np.unique(self.chunk_ids >> CHUNK_ID_BITS)]
+    
+    def _chunk_embedding_texts(self, document: Document, chunks: List[TextChunk]) -> List[str]:
+        """متن ورودی مدل برای قطعه‌های یک سند (عنوان سند + متن قطعه)"""
+        return [f"{document.title}\n{chunk.text}" for chunk in chunks]
+    
+    def _chunk_document(self, document: Document) -> List[TextChunk]:
+        """قطعه‌بندی محتوای سند بر اساس تنظیمات"""
+        chunks = chunk_text(
+            document.content,
+            chunk_size=settings.SEARCH_CHUNK_SIZE,
+            overlap=settings.SEARCH_CHUNK_OVERLAP,
+        )
+        # سند بدون محتوا هم با عنوانش قابل جستجو باشد
+        return chunks[:MAX_CHUNKS_PER_DOCUMENT] or [TextChunk(0, 0, '')]
+    
+    def _encode_texts(self, texts: List[str]):
+        """ایجاد embedding برای لیستی از متن‌ها"""
+        import numpy as np
+        
+        if self._encode_pool is not None:
+            embeddings = self.embedding_model.encode_multi_process(texts, self._encode_pool)
+        else:
+            embeddings = self.embedding_model.encode(texts, show_progress_bar=len(texts) > 1)
+        return np.array(embeddings).astype('float32')
+    
+    def _load_stored_embeddings(self, document_ids: List[int]):
+        """بارگذاری embedding های ذخیره شده قطعه‌های اسناد از دیتابیس"""
+        dimension = self.embedding_model.get_sentence_embedding_dimension()
+        chunk_ids = []
+        vectors = []
+        for start in range(0, len(document_ids), 500):
+            rows = DocumentChunk.objects.filter(
+                document_id__in=document_ids[start:start + 500]
+            ).values_list('document_id', 'position', 'embedding')
+            for document_id, position, embedding in rows.iterator():
+                chunk_ids.append(make_chunk_id(document_id, position))
+                vectors.append(unpack_embedding(embedding, dimension))
+        return chunk_ids, vectors
+    
+    def _get_embeddings(self, documents: List[Document], force: bool = False):
+        """
+        دریافت embedding قطعه‌های اسناد با استفاده مجدد از بردارهای ذخیره شده
+        
+        فقط اسنادی که hash محتوا یا مدل embedding آن‌ها تغییر کرده دوباره
+        قطعه‌بندی و encode می‌شوند (همه با یک فراخوانی encode) و قطعه‌های
+        جدیدشان با قالب SEARCH_EMBEDDING_DTYPE در دیتابیس ذخیره می‌شود.
+        
+        Returns:
+            Tuple شامل آرایه ID قطعه‌ها و ماتریس embedding آن‌ها
+        """
+        import numpy as np
+        
+        model_name = settings.EMBEDDING_MODEL
+        dtype = settings.SEARCH_EMBEDDING_DTYPE
+        current_docs = []
+        stale_docs = []
+        for doc in documents:
+            if not force and doc.is_index_current(model_name):
+                current_docs.append(doc)
+            else:
+                stale_docs.append(doc)
+        
+        chunk_ids, vectors = self._load_stored_embeddings([doc.id for doc in current_docs])
+        
+        if stale_docs:
+            doc_chunks = [(doc, self._chunk_document(doc)) for doc in stale_docs]
+            texts = []
+            for doc, chunks in doc_chunks:
+                texts.extend(self._chunk_embedding_texts(doc, chunks))
+            embeddings = self._encode_texts(texts)
+            
+            new_chunks = []
+            row = 0
+            for doc, chunks in doc_chunks:
+                for position, chunk in enumerate(chunks):
+                    new_chunks.append(DocumentChunk(
+                        document_id=doc.id,
+                        position=position,
+                        start=chunk.start,
+                        end=chunk.end,
+                        text=chunk.text,
+                        embedding=pack_embedding(embeddings[row], dtype),
+                    ))
+                    chunk_ids.append(make_chunk_id(doc.id, position))
+                    vectors.append(embeddings[row])
+                    row += 1
+                doc.content_hash = doc.compute_content_hash()
+                doc.embedding_model = model_name
+            
+            # bulk_update هیچ signal ای ارسال نمی‌کند و updated_at را تغییر نمی‌دهد
+            with transaction.atomic():
+                DocumentChunk.objects.filter(document__in=stale_docs).delete()
+                DocumentChunk.objects.bulk_create(new_chunks, batch_size=500)
+                Document.objects.bulk_update(stale_docs, ['content_hash', 'embedding_model'], batch_size=500)
+        
+        print(f"Reused stored chunks for {len(current_docs)} documents, encoded {len(stale_docs)} documents")
+        
+        dimension = self.embedding_model.get_sentence_embedding_dimension()
+        matrix = np.vstack(vectors).astype('float32') if vectors else np.empty((0, dimension), dtype='float32')
+        return np.array(chunk_ids, dtype='int64'), matrix
+    
+    def rebuild_index(self, force: bool = False, factory: str = None, batch_size: int = None,
+                      workers: int = 1, resume: bool = False, metric: str = None):
+        """
+        ساخت مجدد index برای تمام اسناد
+        
+        اسناد به ترتیب ID و در دسته‌های batch_size از دیتابیس خوانده و encode
+        می‌شوند، بنابراین حافظه مصرفی به اندازه index و یک دسته است نه کل متن
+        اسناد. بردارهای index های بدون نیاز به آموزش (Flat، HNSW) همان موقع
+        افزوده می‌شوند؛ index های IVF/PQ با نمونه‌ای از بردارها آموزش داده و سپس
+        از embedding های ذخیره شده در دیتابیس پر می‌شوند.
+        
+        پس از هر دسته یک checkpoint ثبت می‌شود تا ساخت ناتمام با resume=True
+        بدون encode مجدد اسناد پردازش شده ادامه پیدا کند. بدون force فقط اسناد
+        تغییر یافته encode می‌شوند، بنابراین تغییر نوع index یا معیار شباهت از
+        بردارهای ذخیره شده انجام می‌شود.
+        
+        اسنادی که در حین ساخت ذخیره یا حذف شده‌اند (و ممکن است worker صف آن‌ها را
+        در snapshot قبلی ثبت کرده باشد) پیش از جایگزینی index و دوباره پس از ذخیره
+        آن روی index جدید اعمال می‌شوند، تا snapshot جدید تغییرات worker را از بین نبرد.
+        
+        Args:
+            force: encode مجدد تمام اسناد حتی اگر محتوایشان تغییر نکرده باشد
+                (مثلاً پس از تغییر تنظیمات قطعه‌بندی)
+            factory: نوع index (رشته factory در FAISS)؛ پیش‌فرض SEARCH_INDEX_FACTORY
+            batch_size: تعداد اسناد هر دسته؛ پیش‌فرض SEARCH_REBUILD_BATCH_SIZE
+            workers: تعداد پروسه‌های encode (بیش از 1 با multi-process pool در sentence-transformers)
+            resume: ادامه از checkpoint ساخت ناتمام قبلی با همین تنظیمات
+            metric: معیار شباهت (cosine یا l2)؛ پیش‌فرض SEARCH_INDEX_METRIC
+        """
+        if not self.embedding_model or self.index is None:
             return
         
         try:
-            import faiss
-            import numpy as np
+            factory = factory or settings.SEARCH_INDEX_FACTORY
+            batch_size = batch_size or settings.SEARCH_REBUILD_BATCH_SIZE
+            dimension = self.embedding_model.get_sentence_embedding_dimension()
             
-            documents = Document.objects.all()
-            if not documents.exists():
-                return
+            checkpoint = {
+                'model': settings.EMBEDDING_MODEL, 'factory': factory, 'force': force, 'last_id': 0,
+                'started_at': timezone.now().isoformat(),
+            }
+            previous = read_checkpoint(self.index_dir) if resume else None
+            if previous and all(previous.get(key) == checkpoint[key] for key in ('model', 'factory', 'force')):
+                checkpoint['last_id'] = previous['last_id']
+                # اسناد پردازش شده پیش از توقف هم ممکن است از آن زمان تغییر کرده باشند
+                checkpoint['started_at'] = previous.get('started_at') or checkpoint['started_at']
+            resume_after = checkpoint['last_id']
+            started_at = parse_datetime(checkpoint['started_at'])
             
-            print(f"Rebuilding index for {documents.count()} documents...")
+            total = Document.objects.count()
+            print(
+                f"Rebuilding index for {total} documents"
+                + (f" (resuming after document {resume_after})" if resume_after else "") + "..."
+            )
             
-            # پاک کردن index قبلی
-            dimension = self.embedding_model.get_sentence_embedding_dimension()
-            self.index = faiss.IndexFlatL2(dimension)
-            self.document_ids = []
+            trained_later = requires_training(dimension, factory)
+            index = None if trained_later else self._create_index(factory=factory, metric=metric)
+            sample = TrainingSample(settings.SEARCH_INDEX_TRAINING_SAMPLE, dimension) if trained_later else None
             
-            # ایجاد embeddings برای تمام اسناد
-            texts = []
-            doc_ids = []
+            if workers > 1 and hasattr(self.embedding_model, 'start_multi_process_pool'):
+                self._encode_pool = self.embedding_model.start_multi_process_pool(['cpu'] * workers)
+            elif workers > 1:
+                # ONNX Runtime خودش از چند هسته CPU استفاده می‌کند (EMBEDDING_ONNX_THREADS)
+                print(f"Warning: {settings.EMBEDDING_BACKEND} backend does not support encode workers; using one process.")
+            try:
+                # اسناد تا checkpoint قبلاً encode شده‌اند و فقط بردارهای ذخیره شده آن‌ها خوانده می‌شوند
+                done = 0
+                for documents, batch_force in self._iter_document_batches(batch_size, resume_after, force):
+                    chunk_ids, embeddings = self._get_embeddings(documents, force=batch_force)
+                    if index is not None:
+                        index.add(embeddings, chunk_ids)
+                    else:
+                        sample.add(embeddings)
+                    done += len(documents)
+                    checkpoint['last_id'] = max(checkpoint['last_id'], documents[-1].id)
+                    write_checkpoint(self.index_dir, checkpoint)
+                    print(f"Encoded {done}/{total} documents")
+            finally:
+                if self._encode_pool is not None:
+                    self.embedding_model.stop_multi_process_pool(self._encode_pool)
+                    self._encode_pool = None
             
-            for doc in documents:
-                # ترکیب عنوان و محتوا برای embedding
-                text = f"{doc.title}\n{doc.content}"
-                texts.append(text)
-                doc_ids.append(doc.id)
+            if index is None:
+                index = self._create_index(sample.vectors if sample.seen else None, factory=factory, metric=metric)
+                for chunk_ids, embeddings in self._iter_stored_embeddings(batch_size):
+                    index.add(embeddings, chunk_ids)
             
-            if texts:
-                # ایجاد embeddings
-                embeddings = self.embedding_model.encode(texts, show_progress_bar=True)
-                embeddings = np.array(embeddings).astype('float32')
-                
-                # اضافه کردن به index
-                self.index.add(embeddings)
-                self.document_ids = doc_ids
+            caught_up_at = timezone.now()
+            documents, deleted_ids = self._changes_since(index, started_at)
+            if documents or deleted_ids:
+                print(f"Applying {len(documents) + len(deleted_ids)} documents changed during the rebuild")
+                self._apply_to_index(index, documents, deleted_ids)
+            
+            with self._lock:
+                self.index = index
+                self._sync_ids()
                 
                 # ذخیره index و mapping
                 self._save_index()
-                print(f"Index rebuilt successfully with {len(self.document_ids)} documents")
+            clear_checkpoint(self.index_dir)
+            
+            # تغییراتی که worker صف بین بررسی بالا و ذخیره snapshot ثبت کرده است
+            documents, deleted_ids = self._changes_since(index, caught_up_at)
+            if documents or deleted_ids:
+                self.apply_changes(documents, deleted_ids)
+            print(
+                f"Index rebuilt successfully with {len(self.document_ids)} documents "
+                f"({self.index.ntotal} chunks, {self.index.describe()})"
+            )
         
         except Exception as e:
             print(f"Error rebuilding index: {e}")
     
+    def _changes_since(self, index: VectorIndex, since):
+        """
+        اسناد ذخیره شده از زمان since و اسناد حذف شده‌ای که هنوز در index هستند
+        
+        Returns:
+            Tuple شامل لیست اسناد تغییر یافته و لیست شناسه اسناد حذف شده
+        """
+        import numpy as np
+        
+        documents = list(Document.objects.filter(updated_at__gte=since).order_by('id'))
+        indexed_ids = np.unique(index.live_ids >> CHUNK_ID_BITS)
+        existing_ids = np.fromiter(Document.objects.values_list('id', flat=True).iterator(), dtype='int64')
+        deleted_ids = indexed_ids[~np.isin(indexed_ids, existing_ids)]
+        return documents, [int(doc_id) for doc_id in deleted_ids]
+    
+    def _apply_to_index(self, index: VectorIndex, documents: List[Document], deleted_ids: List[int]):
+        """جایگزینی قطعه‌های اسناد داده شده و حذف اسناد حذف شده در index (بدون ذخیره)"""
+        import numpy as np
+        
+        live_ids = index.live_ids
+        stale_doc_ids = [doc.id for doc in documents] + list(deleted_ids)
+        stale_chunk_ids = live_ids[np.isin(live_ids >> CHUNK_ID_BITS, stale_doc_ids)]
+        if len(stale_chunk_ids):
+            index.remove(stale_chunk_ids)
+        if documents:
+            chunk_ids, embeddings = self._get_embeddings(documents)
+            index.add(embeddings, chunk_ids)
+    
+    def _iter_document_batches(self, batch_size: int, resume_after: int, force: bool):
+        """
+        خواندن جریانی اسناد به ترتیب ID در دسته‌های batch_size
+        
+        Yields:
+            Tuple شامل لیست اسناد و force برای آن دسته (اسناد تا resume_after دوباره encode نمی‌شوند)
+        """
+        fields = ('id', 'title', 'content', 'content_hash', 'embedding_model')
+        for queryset, batch_force in (
+            (Document.objects.filter(id__lte=resume_after), False),
+            (Document.objects.filter(id__gt=resume_after), force),
+        ):
+            batch = []
+            for doc in queryset.only(*fields).order_by('id').iterator(chunk_size=batch_size):
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    yield batch, batch_force
+                    batch = []
+            if batch:
+                yield batch, batch_force
+    
+    def _iter_stored_embeddings(self, batch_size: int):
+        """خواندن جریانی embedding های ذخیره شده تمام قطعه‌ها در دسته‌های batch_size"""
+        import numpy as np
+        
+        dimension = self.embedding_model.get_sentence_embedding_dimension()
+        rows = DocumentChunk.objects.order_by('document_id', 'position').values_list(
+            'document_id', 'position', 'embedding'
+        )
+        chunk_ids, vectors = [], []
+        for document_id, position, embedding in rows.iterator(chunk_size=batch_size):
+            chunk_ids.append(make_chunk_id(document_id, position))
+            vectors.append(unpack_embedding(embedding, dimension))
+            if len(vectors) >= batch_size:
+                yield np.array(chunk_ids, dtype='int64'), np.vstack(vectors)
+                chunk_ids, vectors = [], []
+        if vectors:
+            yield np.array(chunk_ids, dtype='int64'), np.vstack(vectors)
+
+    def convert_stored_embeddings(self, dtype: str, batch_size: int = None) -> int:
+        """
+        تبدیل embedding های ذخیره شده قطعه‌ها به قالب dtype بدون encode مجدد
+        
+        قطعه‌هایی که قبلاً با همین قالب ذخیره شده‌اند تغییر نمی‌کنند. تبدیل به
+        قالب کوچک‌تر برگشت‌پذیر نیست.
+        
+        Returns:
+            تعداد قطعه‌های تبدیل شده
+        """
+        if not self.embedding_model:
+            return 0
+        
+        dimension = self.embedding_model.get_sentence_embedding_dimension()
+        size = packed_size(dimension, dtype)
+        batch_size = batch_size or settings.SEARCH_REBUILD_BATCH_SIZE
+        converted = 0
+        last_id = 0
+        while True:
+            # صفحه‌بندی بر اساس ID تا به‌روزرسانی‌ها روی خواندن جاری اثر نگذارند
+            chunks = list(
+                DocumentChunk.objects.filter(id__gt=last_id).order_by('id').only('id', 'embedding')[:batch_size]
+            )
+            if not chunks:
+                return converted
+            last_id = chunks[-1].id
+            changed = [chunk for chunk in chunks if len(chunk.embedding) != size]
+            for chunk in changed:
+                chunk.embedding = pack_embedding(unpack_embedding(chunk.embedding, dimension), dtype)
+            if changed:
+                DocumentChunk.objects.bulk_update(changed, ['embedding'])
+                converted += len(changed)
+
+    def index_document(self, document: Document):
+        """
+        به‌روزرسانی تدریجی index برای یک سند
+        
+        فقط همین سند encode می‌شود و بردارهای قبلی آن جایگزین می‌شوند.
+        """
+        self.apply_changes([document], [])
+    
+    def remove_document(self, document_id: int):
+        """حذف بردارهای یک سند از index"""
+        self.apply_changes([], [document_id])
+    
+    def apply_changes(self, documents: List[Document], deleted_ids: List[int]):
+        """
+        اعمال دسته‌ای تغییرات روی index
+        
+        تمام اسناد تغییر یافته با یک فراخوانی encode می‌شوند. تغییرات روی یک کپی
+        از index اعمال و سپس جایگزین می‌شوند تا جستجوهای هم‌زمان هیچ‌وقت
+        index نیمه‌کاره نبینند.
+        """
+        if not self.embedding_model or self.index is None:
+            return
+        if not documents and not deleted_ids:
+            return
+        
+        chunk_ids, embeddings = self._get_embeddings(documents) if documents else (None, None)
+        self._commit_changes([doc.id for doc in documents], deleted_ids, chunk_ids, embeddings)
+    
+    def add_documents(self, document_ids: List[int], batch_size: int = 1000, progress=None) -> int:
+        """
+        encode اسناد در دسته‌های batch_size و افزودن همه آن‌ها با یک به‌روزرسانی index
+        
+        برای ورود دسته‌ای اسناد: به جای کپی و ذخیره index برای هر دسته، بردارهای
+        تمام دسته‌ها جمع‌آوری و در پایان یک snapshot ذخیره می‌شود.
+        
+        Args:
+            progress: تابع اختیاری که پس از هر دسته با تعداد اسناد encode شده فراخوانی می‌شود
+        
+        Returns:
+            تعداد قطعه‌های افزوده شده
+        """
+        if not self.embedding_model or self.index is None or not document_ids:
+            return 0
+        
+        import numpy as np
+        
+        all_ids, all_vectors = [], []
+        done = 0
+        for start in range(0, len(document_ids), batch_size):
+            batch = document_ids[start:start + batch_size]
+            documents = list(Document.objects.filter(id__in=batch))
+            chunk_ids, embeddings = self._get_embeddings(documents)
+            all_ids.append(chunk_ids)
+            all_vectors.append(embeddings)
+            done += len(documents)
+            if progress:
+                progress(done)
+        
+        chunk_ids = np.concatenate(all_ids)
+        embeddings = np.vstack(all_vectors).astype('float32')
+        self._commit_changes(document_ids, [], chunk_ids, embeddings)
+        return len(chunk_ids)
+    
+    def _commit_changes(self, changed_ids: List[int], deleted_ids: List[int], chunk_ids, embeddings):
+        """
+        جایگزینی قطعه‌های اسناد تغییر یافته با بردارهای جدید و حذف اسناد حذف شده در index
+        
+        تغییرات روی یک کپی از index اعمال و سپس جایگزین و ذخیره می‌شوند. در
+        index هایی مثل HNSW که حذف را پشتیبانی نمی‌کنند، بردارهای قبلی فقط
+        علامت حذف می‌خورند؛ وقتی سهم آن‌ها از SEARCH_INDEX_MAX_DELETED_RATIO بیشتر
+        شود index با همان نوع و معیار از بردارهای ذخیره شده دوباره ساخته می‌شود
+        (بدون encode مجدد، اما با هزینه متناسب با کل اسناد).
+        """
+        import numpy as np
+        
+        with self._lock:
+            # تغییرات روی آخرین snapshot (مثلاً حاصل rebuild_index در پروسه دیگر) اعمال شوند
+            self.reload_if_changed(force=True)
+            
+            # حذف تمام قطعه‌های قبلی اسناد تغییر یافته یا حذف شده
+            stale_doc_ids = np.array(list(changed_ids) + list(deleted_ids), dtype='int64')
+            stale_chunk_ids = self.chunk_ids[np.isin(self.chunk_ids >> CHUNK_ID_BITS, stale_doc_ids)]
+            
+            index = self.index.copy()
+            if len(stale_chunk_ids):
+                index.remove(stale_chunk_ids)
+            
+            if index.deleted_ratio > settings.SEARCH_INDEX_MAX_DELETED_RATIO:
+                # بردارهای علامت خورده زیاد شده‌اند؛ index از بردارهای ذخیره شده بقیه اسناد
+                # و بردارهای جدید دوباره ساخته می‌شود
+                stale_set = set(stale_doc_ids.tolist())
+                remaining_ids = [doc_id for doc_id in self.document_ids if doc_id not in stale_set]
+                kept_ids, kept_vectors = self._load_stored_embeddings(remaining_ids)
+                all_ids = np.array(kept_ids, dtype='int64')
+                all_vectors = np.vstack(kept_vectors).astype('float32') if kept_vectors else None
+                if chunk_ids is not None:
+                    all_ids = np.concatenate([all_ids, chunk_ids])
+                    all_vectors = embeddings if all_vectors is None else np.vstack([all_vectors, embeddings])
+                if all_vectors is None:
+                    all_vectors = np.empty((0, self.index.d), dtype='float32')
+                index = self._build_index(all_ids, all_vectors, factory=index.factory, metric=index.metric)
+            elif chunk_ids is not None:
+                index.add(embeddings, chunk_ids)
+            
+            self.index = index
+            self._sync_ids()
+            self._save_index()
+
+    def _load_snapshot(self, version: str):
+        """بارگذاری یک snapshot و جایگزینی index فعلی"""
+        marker = current_marker(self.index_dir)
+        index, manifest = load_snapshot(self.index_dir, version, mmap=settings.SEARCH_INDEX_MMAP)
+        if manifest.get('model') != settings.EMBEDDING_MODEL:
+            raise ValueError(f"Snapshot was built with embedding model {manifest.get('model')}")
+        if index.metric != settings.SEARCH_INDEX_METRIC:
+            print(
+                f"Warning: Index snapshot {version} uses {index.metric} similarity but SEARCH_INDEX_METRIC is "
+                f"{settings.SEARCH_INDEX_METRIC}; run 'python manage.py convert_index' to convert it."
+            )
+        
+        with self._lock:
+            self.index = index
+            self.index_version = version
+            self._index_marker = marker
+            self._sync_ids()
+    
+    def reload_if_changed(self, force: bool = False) -> bool:
+        """
+        بارگذاری snapshot جدیدتر در صورت وجود (مثلاً پس از rebuild_index یا پردازش صف)
+        
+        بررسی فقط یک stat روی فایل CURRENT است و حداکثر هر
+        SEARCH_INDEX_RELOAD_INTERVAL ثانیه یک بار انجام می‌شود.
+        
+        Returns:
+            True اگر index جدید بارگذاری شد
+        """
+        if not self.embedding_model or self.index is None:
+            return False
+        
+        now = time.monotonic()
+        if not force and now - self._last_reload_check < settings.SEARCH_INDEX_RELOAD_INTERVAL:
+            return False
+        self._last_reload_check = now
+        
+        marker = current_marker(self.index_dir)
+        if marker is None or marker == self._index_marker:
+            return False
+        
+        with self._lock:
+            version = current_version(self.index_dir)
+            if not version or version == self.index_version:
+                self._index_marker = marker
+                return False
+            try:
+                self._load_snapshot(version)
+            except Exception as e:
+                print(f"Error loading index snapshot {version}: {e}")
+                self._index_marker = marker
+                return False
+        
+        print(f"Reloaded index snapshot {version} ({self.index.ntotal} chunks)")
+        return True
+    
     def _save_index(self):
-        """ذخیره index و mapping"""
+        """ذخیره index به صورت snapshot نسخه‌دار جدید و فعال کردن آن"""
         try:
-            import faiss
-            
-            if self.index and self.document_ids:
-                faiss.write_index(self.index, self.index_path)
-                with open(self.mapping_path, 'wb') as f:
-                    pickle.dump(self.document_ids, f)
+            if self.index is not None:
+                version = write_snapshot(self.index_dir, self.index, {
+                    'model': settings.EMBEDDING_MODEL,
+                    'metric': self.index.metric,
+                    'document_count': len(self.document_ids),
+                })
+                self.index_version = version
+                self._index_marker = current_marker(self.index_dir)
+                prune_snapshots(self.index_dir, keep=settings.SEARCH_INDEX_KEEP_SNAPSHOTS)
         except Exception as e:
             print(f"Error saving index: {e}")
     
-    def search_similar(self, query: str, limit: int = 5) -> List[Document]:
-        """جستجوی اسناد مشابه با استفاده از embedding"""
-        if not self.embedding_model or not self.index:
-            # Fallback به جستجوی ساده
-            return list(Document.objects.filter(
-                Q(title__icontains=query) | Q(content__icontains=query)
-            )[:limit])
+    def _passage_texts(self, passage_ids: dict) -> dict:
+        """دریافت متن قطعه‌ها از دیتابیس به صورت dict از (document ID، ترتیب قطعه) به متن"""
+        positions = {position for chunk_positions in passage_ids.values() for position in chunk_positions}
+        if not positions:
+            return {}
+        rows = DocumentChunk.objects.filter(
+            document_id__in=list(passage_ids),
+            position__in=list(positions),
+        ).values_list('document_id', 'position', 'text')
+        return {(doc_id, position): text for doc_id, position, text in rows}
+    
+    def _attach_passages(self, documents: List[Document], passage_ids: dict, texts: dict = None):
+        """
+        افزودن متن قطعه‌های منطبق به اسناد
+        
+        هر سند ویژگی matched_passages (لیست متن قطعه‌ها به ترتیب شباهت) می‌گیرد.
+        """
+        if texts is None:
+            texts = self._passage_texts(passage_ids)
+        
+        for doc in documents:
+            doc.matched_passages = [
+                texts[(doc.id, position)]
+                for position in passage_ids.get(doc.id, [])
+                if (doc.id, position) in texts
+            ]
+    
+    def encode_queries(self, queries: List[str]):
+        """
+        embedding چند query با استفاده از cache LRU
+        
+        query هایی که در cache نیستند با یک فراخوانی encode محاسبه می‌شوند.
+        
+        Returns:
+            ماتریس float32 با شکل (len(queries), dimension)
+        """
+        import numpy as np
+        
+        keys = [(normalize_query(query), settings.EMBEDDING_MODEL) for query in queries]
+        embeddings = [self.query_embedding_cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, embedding in zip(keys, embeddings) if embedding is None))
+        if missing:
+            encoded = np.array(self.embedding_model.encode([text for text, _ in missing])).astype('float32')
+            computed = {}
+            for key, embedding in zip(missing, encoded):
+                computed[key] = embedding[None, :]
+                self.query_embedding_cache.set(key, computed[key])
+            embeddings = [computed[key] if embedding is None else embedding for key, embedding in zip(keys, embeddings)]
+        return np.vstack(embeddings)
+    
+    def encode_query(self, query: str):
+        """
+        embedding یک query با استفاده از cache LRU
+        
+        Returns:
+            بردار float32 با شکل (1, dimension)
+        """
+        return self.encode_queries([query])
+    
+    def cache_info(self) -> dict:
+        """آمار hit/miss cache های embedding و نتایج جستجو"""
+        return {
+            'index_version': self.index_version,
+            'query_embeddings': self.query_embedding_cache.info(),
+            'results': self.result_cache.info(),
+            'query_batches': self.query_batcher.info() if self.query_batcher else None,
+        }
+    
+    def _initial_k(self, limit: int, searchable: int) -> int:
+        """تعداد قطعه‌های درخواستی از index برای یافتن limit سند (searchable: تعداد قطعه‌های قابل جستجو)"""
+        return min(limit * settings.SEARCH_PASSAGES_PER_DOCUMENT * 2, searchable)
+    
+    def _group_passages(self, index: VectorIndex, labels, distances, limit: int) -> Tuple[dict, dict]:
+        """
+        گروه‌بندی ID قطعه‌های نتیجه جستجو بر اساس سند
+        
+        Returns:
+            Tuple شامل passage_ids (dict مرتب از document ID به لیست ترتیب قطعه‌های
+            منطبق آن سند) و scores (dict از document ID به امتیاز بهترین قطعه آن سند)
+        """
+        passages_per_doc = settings.SEARCH_PASSAGES_PER_DOCUMENT
+        passage_ids = {}
+        scores = {}
+        for label, score in zip(labels, index.scores(distances)):
+            if label == -1:
+                continue
+            doc_id = int(label) >> CHUNK_ID_BITS
+            if doc_id not in passage_ids and len(passage_ids) >= limit:
+                continue
+            positions = passage_ids.setdefault(doc_id, [])
+            scores.setdefault(doc_id, float(score))
+            if len(positions) < passages_per_doc:
+                positions.append(int(label) & (MAX_CHUNKS_PER_DOCUMENT - 1))
+        return passage_ids, scores
+    
+    def _search_passages(self, index: VectorIndex, query_embedding, limit: int, params=None,
+                         searchable: int = None, exhaustive: bool = False) -> Tuple[dict, dict]:
+        """
+        جستجوی قطعه‌ها و گروه‌بندی آن‌ها بر اساس سند
+        
+        Args:
+            searchable: تعداد قطعه‌هایی که جستجو به آن‌ها محدود شده (پیش‌فرض تمام index)
+            exhaustive: جستجوی کامل بین قطعه‌های انتخاب شده با selector در params
+        
+        Returns:
+            Tuple شامل passage_ids و scores (مانند _group_passages)
+        """
+        searchable = index.ntotal if searchable is None else searchable
+        # چند قطعه از یک سند ممکن است در نتایج باشند؛ k تا رسیدن به limit سند بزرگ می‌شود
+        k = self._initial_k(limit, searchable)
+        while True:
+            if exhaustive:
+                distances, labels = index.search_exhaustive(query_embedding, k, getattr(params, 'sel', None))
+            else:
+                distances, labels = index.search(query_embedding, k, params=params)
+            passage_ids, scores = self._group_passages(index, labels[0], distances[0], limit)
+            if len(passage_ids) >= limit or k >= searchable:
+                return passage_ids, scores
+            k = min(k * 2, searchable)
+    
+    def _filter_selector(self, index: VectorIndex, filters: SearchFilters):
+        """
+        IDSelector قطعه‌های اسناد منطبق با فیلترها (از bitmap های cache شده در filter_masks)
+        
+        Returns:
+            Tuple شامل selector و تعداد قطعه‌های قابل جستجو
+        """
+        return self.filter_masks.selector(index, filters)
+    
+    def search_passages_batch(self, queries: List[Tuple[str, int]], nprobe: int = None,
+                              ef_search: int = None, timings: dict = None,
+                              filters: SearchFilters = None) -> List[Tuple[dict, dict]]:
+        """
+        جستجوی چند query با یک فراخوانی encode و یک جستجوی دسته‌ای در index
+        
+        با filters جستجو از طریق IDSelector فقط روی قطعه‌های اسناد منطبق انجام
+        می‌شود، بنابراین تا حد امکان limit سند برگردانده می‌شود.
+        
+        Args:
+            queries: لیست (متن query، تعداد سند درخواستی)
+            timings: dict اختیاری که زمان encode و جستجو (میلی‌ثانیه) در آن ثبت می‌شود
+            filters: محدود کردن جستجو به اسناد منطبق با فیلترها (اختیاری)
+        
+        Returns:
+            لیست (passage_ids، scores) مانند _search_passages به ترتیب query ها
+        """
+        if timings is None:
+            timings = {}
+        index = self.index
+        if index is None or index.ntotal == 0:
+            return [({}, {}) for _ in queries]
+        
+        selector, searchable = None, index.ntotal
+        if filters:
+            selector, searchable = self._filter_selector(index, filters)
+            if not searchable:
+                return [({}, {}) for _ in queries]
+        
+        started = time.perf_counter()
+        embeddings = self.encode_queries([query for query, _ in queries])
+        timings['encode_ms'] = (time.perf_counter() - started) * 1000
+        
+        started = time.perf_counter()
+        params = search_parameters(
+            index,
+            nprobe=nprobe or settings.SEARCH_NPROBE,
+            ef_search=ef_search or settings.SEARCH_EF_SEARCH,
+            selector=selector,
+        )
+        ks = [self._initial_k(limit, searchable) for _, limit in queries]
+        distances, labels = index.search(embeddings, max(ks), params=params)
+        
+        results = []
+        for row, ((_, limit), k) in enumerate(zip(queries, ks)):
+            hits = self._group_passages(index, labels[row][:k], distances[row][:k], limit)
+            if len(hits[0]) < limit and k < searchable:
+                # قطعه‌های یک سند زیاد بودند؛ این query جداگانه با k بزرگ‌تر جستجو می‌شود
+                hits = self._search_passages(index, embeddings[row:row + 1], limit, params, searchable)
+            if len(hits[0]) < limit and selector is not None:
+                # HNSW و IVF با فیلترهای محدود ممکن است صفحه کامل پیدا نکنند
+                hits = self._search_passages(index, embeddings[row:row + 1], limit, params, searchable,
+                                             exhaustive=True)
+            results.append(hits)
+        timings['search_ms'] = (time.perf_counter() - started) * 1000
+        return results
+    
+    def _process_query_batch(self, items: List[Tuple[str, int, int, int, SearchFilters]]) -> List[Tuple[dict, dict]]:
+        """پردازش یک دسته از query های (متن، limit، nprobe، ef_search، فیلترها) جمع‌آوری شده"""
+        groups = {}
+        for row, (query, limit, nprobe, ef_search, filters) in enumerate(items):
+            groups.setdefault((nprobe, ef_search, filters), []).append(row)
+        
+        results = [None] * len(items)
+        for (nprobe, ef_search, filters), rows in groups.items():
+            batch = self.search_passages_batch(
+                [(items[row][0], items[row][1]) for row in rows],
+                nprobe=nprobe,
+                ef_search=ef_search,
+                filters=filters,
+            )
+            for row, hits in zip(rows, batch):
+                results[row] = hits
+        return results
+    
+    def _fetch_documents(self, passage_ids: dict, scores: dict = None, texts: dict = None) -> List[Document]:
+        """
+        دریافت اسناد از دیتابیس به ترتیب نتایج جستجو به همراه قطعه‌های منطبق
+        
+        اگر scores داده شود، هر سند ویژگی score (امتیاز شباهت) هم می‌گیرد. texts
+        متن قطعه‌هایی است که قبلاً خوانده شده‌اند (مانند _passage_texts).
+        """
+        found_doc_ids = list(passage_ids)
+        
+        # دریافت اسناد از دیتابیس
+        documents = Document.objects.filter(id__in=found_doc_ids).with_related()
+        
+        # مرتب‌سازی بر اساس ترتیب یافت شده
+        doc_dict = {doc.id: doc for doc in documents}
+        ordered_docs = [doc_dict[doc_id] for doc_id in found_doc_ids if doc_id in doc_dict]
+        self._attach_passages(ordered_docs, passage_ids, texts)
+        if scores is not None:
+            for doc in ordered_docs:
+                doc.score = scores.get(doc.id)
+        return ordered_docs
+    
+    def _fetch_documents_batch(self, hits_list: List[Tuple[dict, dict]]) -> List[List[Document]]:
+        """
+        دریافت اسناد نتایج چند query با یک پرس‌وجو برای اسناد و یک پرس‌وجو برای قطعه‌ها
+        
+        سندی که در نتایج چند query آمده برای هر query یک کپی جداگانه با
+        قطعه‌های منطبق همان query دارد.
+        """
+        merged = {}
+        for passage_ids, _ in hits_list:
+            for doc_id, positions in passage_ids.items():
+                merged.setdefault(doc_id, set()).update(positions)
+        
+        doc_dict = {doc.id: doc for doc in Document.objects.filter(id__in=list(merged)).with_related()}
+        texts = self._passage_texts(merged)
+        
+        results = []
+        for passage_ids, scores in hits_list:
+            ordered_docs = [copy.copy(doc_dict[doc_id]) for doc_id in passage_ids if doc_id in doc_dict]
+            self._attach_passages(ordered_docs, passage_ids, texts)
+            for doc in ordered_docs:
+                doc.score = scores.get(doc.id)
+            results.append(ordered_docs)
+        return results
+    
+    def search_similar(self, query: str, limit: int = 5, nprobe: int = None, ef_search: int = None,
+                       offset: int = 0, min_score: float = None, filters: SearchFilters = None,
+                       rerank: bool = None, timings: dict = None) -> List[Document]:
+        """
+        جستجوی اسناد مشابه با استفاده از embedding قطعه‌ها
+        
+        جستجو روی قطعه‌ها انجام می‌شود و نتایج بر اساس بهترین قطعه هر سند
+        مرتب می‌شوند. هر سند بازگشتی ویژگی matched_passages دارد که شامل
+        بهترین قطعه‌های منطبق آن سند است و ویژگی score که امتیاز شباهت بهترین
+        قطعه آن است. نتیجه هر query تا تغییر snapshot index در cache نگه داشته می‌شود.
+        
+        با rerank نتایج اول با cross-encoder دوباره مرتب می‌شوند (_rerank) و score
+        اسناد مرتب شده امتیاز cross-encoder است.
+        
+        Args:
+            nprobe: تعداد خوشه‌های بررسی شده در index های IVF (پیش‌فرض SEARCH_NPROBE)
+            ef_search: عمق جستجو در index های HNSW (پیش‌فرض SEARCH_EF_SEARCH)
+            offset: تعداد نتایج رد شده از ابتدا (برای صفحه‌بندی)
+            min_score: حذف اسناد با امتیاز شباهت کمتر از این مقدار (پیش از rerank)
+            filters: جستجو فقط در اسناد منطبق با فیلترها (برچسب، تاریخ، ایجاد کننده)
+            rerank: استفاده از مرحله rerank (پیش‌فرض SEARCH_RERANK)
+            timings: dict اختیاری که زمان مراحل جستجو، rerank و دریافت اسناد (میلی‌ثانیه) در آن ثبت می‌شود
+        """
+        if timings is None:
+            timings = {}
+        if not self.embedding_model or self.index is None:
+            # Fallback به جستجوی واژگانی
+            return self.search_lexical(query, limit, offset=offset, filters=filters)
         
         try:
-            import numpy as np
+            reranker = self._get_reranker() if (settings.SEARCH_RERANK if rerank is None else rerank) else None
+            candidates = offset + limit
+            if reranker is not None:
+                # صفحه‌های بعدی هم از همان مجموعه نامزد ساخته می‌شوند تا ترتیب ثابت بماند
+                candidates = max(candidates, settings.SEARCH_RERANK_CANDIDATES)
             
-            # ایجاد embedding برای query
-            query_embedding = self.embedding_model.encode([query])
-            query_embedding = np.array(query_embedding).astype('float32')
+            started = time.perf_counter()
+            passage_ids, scores = self._semantic_passages(query, candidates, nprobe, ef_search, filters)
+            ranked = self._page(list(scores.items()), 0, candidates, min_score)
+            timings['search_ms'] = (time.perf_counter() - started) * 1000
             
-            # جستجو در index
-            k = min(limit, len(self.document_ids))
-            if k == 0:
-                return []
-            
-            distances, indices = self.index.search(query_embedding, k)
+            texts = None
+            if reranker is not None and ranked:
+                cache_key = (
+                    'rerank', normalize_query(query), candidates, min_score,
+                    nprobe or settings.SEARCH_NPROBE, ef_search or settings.SEARCH_EF_SEARCH, self.index_version,
+                    filters, self.filter_masks.check(self.index) if filters else None,
+                )
+                ranked, texts = self._rerank(reranker, query, ranked, passage_ids, timings, cache_key)
             
-            # تبدیل indices به document IDs
-            found_doc_ids = [self.document_ids[idx] for idx in indices[0] if idx < len(self.document_ids)]
+            started = time.perf_counter()
+            page = ranked[offset:offset + limit]
+            documents = self._fetch_documents({doc_id: passage_ids[doc_id] for doc_id, _ in page}, dict(page), texts)
+            timings['fetch_ms'] = (time.perf_counter() - started) * 1000
+            return documents
+        
+        except Exception as e:
+            print(f"Error in semantic search: {e}")
+            # Fallback به جستجوی واژگانی
+            return self.search_lexical(query, limit, offset=offset, filters=filters)
+    
+    def _rerank(self, reranker: CrossEncoderReranker, query: str, ranked: List[Tuple[int, float]],
+                passage_ids: dict, timings: dict, cache_key: tuple = None) -> Tuple[List[Tuple[int, float]], dict]:
+        """
+        مرتب‌سازی مجدد SEARCH_RERANK_CANDIDATES سند اول با cross-encoder
+        
+        هر قطعه منطبق (به همراه عنوان سند) جداگانه امتیاز می‌گیرد و امتیاز سند
+        بهترین امتیاز قطعه‌های آن است. اگر امتیازدهی در SEARCH_RERANK_BUDGET_MS
+        تمام نشود ترتیب جستجوی معنایی بدون تغییر برگردانده می‌شود. اسناد بعد از
+        مجموعه نامزد با امتیاز شباهت خود در انتها می‌مانند.
+        
+        Returns:
+            Tuple شامل رتبه‌بندی (لیست document ID و امتیاز) و متن قطعه‌های نامزدها (مانند _passage_texts)
+        """
+        started = time.perf_counter()
+        cached = self.result_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            timings['rerank_ms'] = (time.perf_counter() - started) * 1000
+            timings['reranked'] = True
+            return cached, None
+        
+        head = ranked[:settings.SEARCH_RERANK_CANDIDATES]
+        head_passages = {doc_id: passage_ids[doc_id] for doc_id, _ in head}
+        positions = {position for chunk_positions in head_passages.values() for position in chunk_positions}
+        rows = DocumentChunk.objects.filter(
+            document_id__in=list(head_passages),
+            position__in=list(positions),
+        ).values_list('document_id', 'position', 'document__title', 'text')
+        texts = {}
+        pairs = []
+        for doc_id, position, title, text in rows:
+            if position in head_passages[doc_id]:
+                texts[(doc_id, position)] = text
+                pairs.append((doc_id, f"{title}\n{text}"))
+        
+        budget = settings.SEARCH_RERANK_BUDGET_MS
+        deadline = started + budget / 1000 if budget else None
+        scores = reranker.score(query, [text for _, text in pairs], deadline=deadline)
+        timings['rerank_ms'] = (time.perf_counter() - started) * 1000
+        timings['reranked'] = scores is not None
+        if scores is None:
+            return ranked, texts
+        
+        best_scores = {}
+        for (doc_id, _), score in zip(pairs, scores):
+            best_scores[doc_id] = max(best_scores.get(doc_id, float(score)), float(score))
+        reranked = sorted(
+            ((doc_id, best_scores[doc_id]) for doc_id, _ in head if doc_id in best_scores),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        # اسناد بدون قطعه ذخیره شده امتیاز cross-encoder ندارند
+        reranked += [(doc_id, score) for doc_id, score in head if doc_id not in best_scores]
+        reranked += ranked[len(head):]
+        if cache_key:
+            self.result_cache.set(cache_key, reranked)
+        return reranked, texts
+
+    def _semantic_passages(self, query: str, limit: int, nprobe: int = None, ef_search: int = None,
+                           filters: SearchFilters = None) -> Tuple[dict, dict]:
+        """
+        قطعه‌های منطبق و امتیاز اسناد در جستجوی معنایی
+        
+        از cache نتایج و دسته‌بندی query های هم‌زمان استفاده می‌کند. کلید نتایج فیلتر
+        شده شامل generation فیلترها هم هست، چون برچسب‌ها بدون تغییر نسخه index تغییر می‌کنند.
+        
+        Returns:
+            Tuple شامل passage_ids و scores (مانند _group_passages)
+        """
+        if self.index.ntotal == 0:
+            return {}, {}
+        nprobe = nprobe or settings.SEARCH_NPROBE
+        ef_search = ef_search or settings.SEARCH_EF_SEARCH
+        
+        cache_key = (normalize_query(query), limit, nprobe, ef_search, self.index_version)
+        if filters:
+            cache_key += (filters, self.filter_masks.check(self.index))
+        hits = self.result_cache.get(cache_key)
+        if hits is None:
+            # ایجاد embedding و جستجو، همراه با query های هم‌زمان دیگر در یک دسته
+            item = (query, limit, nprobe, ef_search, filters)
+            if self.query_batcher:
+                hits = self.query_batcher.run(item)
+            else:
+                hits = self._process_query_batch([item])[0]
+            self.result_cache.set(cache_key, hits)
+        return hits
+    
+    @staticmethod
+    def _page(ranked: List[Tuple[int, float]], offset: int, limit: int, min_score: float = None):
+        """حذف نتایج با امتیاز کمتر از min_score و انتخاب صفحه [offset, offset + limit)"""
+        if min_score is not None:
+            ranked = [(doc_id, score) for doc_id, score in ranked if score >= min_score]
+        return ranked[offset:offset + limit]
+    
+    def search_lexical(self, query: str, limit: int = 5, offset: int = 0, min_score: float = None,
+                       filters: SearchFilters = None) -> List[Document]:
+        """جستجوی واژگانی BM25 (یا icontains اگر جدول FTS5 وجود نداشته باشد)"""
+        return lexical.search_documents(
+            query, limit, offset=offset, min_score=min_score,
+            queryset=filters.queryset() if filters else None,
+        )
+    
+    def search_hybrid(self, query: str, limit: int = 5, nprobe: int = None, ef_search: int = None,
+                      offset: int = 0, min_score: float = None, filters: SearchFilters = None) -> List[Document]:
+        """
+        جستجوی ترکیبی: ادغام رتبه‌بندی معنایی و BM25 با Reciprocal Rank Fusion
+        
+        از هر روش حداکثر SEARCH_HYBRID_CANDIDATES سند (و حداقل تا انتهای صفحه
+        درخواستی) در ادغام شرکت می‌کنند. امتیاز هر سند امتیاز RRF آن است. برای
+        اسنادی که فقط در نتایج BM25 آمده‌اند بهترین قطعه‌ها از embedding های
+        ذخیره شده انتخاب می‌شوند.
+        """
+        if not self.embedding_model or self.index is None:
+            return self.search_lexical(query, limit, offset=offset, min_score=min_score, filters=filters)
+        
+        try:
+            candidates = max(offset + limit, settings.SEARCH_HYBRID_CANDIDATES)
+            semantic, _ = self._semantic_passages(query, candidates, nprobe, ef_search, filters)
+            lexical_hits = []
+            if lexical.is_available():
+                lexical_hits = lexical.search(query, candidates, queryset=filters.queryset() if filters else None)
+            fused = lexical.reciprocal_rank_fusion(
+                [list(semantic), [doc_id for doc_id, _ in lexical_hits]],
+                k=settings.SEARCH_RRF_K,
+            )
+            page = self._page(fused, offset, limit, min_score)
             
-            # دریافت اسناد از دیتابیس
-            documents = Document.objects.filter(id__in=found_doc_ids)
+            documents = self._fetch_documents(
+                {doc_id: semantic.get(doc_id, []) for doc_id, _ in page},
+                dict(page),
+            )
+            # امتیاز RRF حفظ می‌شود؛ best_passages فقط قطعه‌ها را تعیین می‌کند
+            lexical_only = [doc for doc in documents if not doc.matched_passages]
+            self.best_passages(query, lexical_only)
+            for doc in lexical_only:
+                doc.score = dict(page)[doc.id]
+            return documents
+        
+        except Exception as e:
+            print(f"Error in hybrid search: {e}")
+            return self.search_lexical(query, limit, offset=offset, filters=filters)
+    
+    def search(self, query: str, limit: int = 5, search_type: str = SEARCH_SEMANTIC,
+               nprobe: int = None, ef_search: int = None, offset: int = 0,
+               min_score: float = None, filters: SearchFilters = None,
+               rerank: bool = None, timings: dict = None) -> List[Document]:
+        """
+        جستجو با یکی از روش‌های semantic، lexical یا hybrid
+        
+        مقیاس امتیاز به روش جستجو بستگی دارد: شباهت بردارها (یا امتیاز
+        cross-encoder با rerank) در semantic، امتیاز BM25 در lexical و امتیاز RRF
+        در hybrid. rerank و timings فقط در جستجوی semantic استفاده می‌شوند.
+        """
+        if search_type == SEARCH_LEXICAL:
+            return self.search_lexical(query, limit, offset=offset, min_score=min_score, filters=filters)
+        if search_type == SEARCH_HYBRID:
+            return self.search_hybrid(query, limit, nprobe=nprobe, ef_search=ef_search,
+                                      offset=offset, min_score=min_score, filters=filters)
+        return self.search_similar(query, limit, nprobe=nprobe, ef_search=ef_search,
+                                   offset=offset, min_score=min_score, filters=filters,
+                                   rerank=rerank, timings=timings)
+    
+    def effective_search_type(self, search_type: str = SEARCH_SEMANTIC) -> str:
+        """
+        روش جستجویی که در عمل استفاده می‌شود
+        
+        بدون مدل embedding جستجوها واژگانی هستند و بدون جدول FTS5 جستجوی واژگانی ساده (icontains) است.
+        """
+        if search_type != SEARCH_LEXICAL and self.embedding_model and self.index is not None:
+            return search_type
+        return SEARCH_LEXICAL if lexical.is_available() else 'simple'
+    
+    def search_similar_batch(self, queries: List[Tuple[str, int]], nprobe: int = None, ef_search: int = None,
+                             timings: dict = None) -> List[List[Document]]:
+        """
+        جستجوی چند query در یک فراخوانی
+        
+        query هایی که نتیجه آن‌ها در cache نیست با یک فراخوانی encode و یک جستجوی
+        دسته‌ای در index پردازش می‌شوند و اسناد تمام نتایج با یک پرس‌وجو از
+        دیتابیس خوانده می‌شوند.
+        
+        Args:
+            queries: لیست (متن query، تعداد سند درخواستی)
+            timings: dict اختیاری که زمان مراحل encode، جستجو و دریافت اسناد (میلی‌ثانیه) در آن ثبت می‌شود
+        
+        Returns:
+            لیست اسناد نتیجه هر query به ترتیب query ها
+        """
+        if timings is None:
+            timings = {}
+        if not self.embedding_model or self.index is None:
+            # Fallback به جستجوی واژگانی
+            return [self.search_lexical(query, limit) for query, limit in queries]
+        
+        try:
+            if self.index.ntotal == 0:
+                return [[] for _ in queries]
+            nprobe = nprobe or settings.SEARCH_NPROBE
+            ef_search = ef_search or settings.SEARCH_EF_SEARCH
             
-            # مرتب‌سازی بر اساس ترتیب یافت شده
-            doc_dict = {doc.id: doc for doc in documents}
-            ordered_docs = [doc_dict[doc_id] for doc_id in found_doc_ids if doc_id in doc_dict]
+            keys = [
+                (normalize_query(query), limit, nprobe, ef_search, self.index_version)
+                for query, limit in queries
+            ]
+            hits_list = [self.result_cache.get(key) for key in keys]
+            missing = [row for row, hits in enumerate(hits_list) if hits is None]
+            timings['cached_queries'] = len(queries) - len(missing)
+            if missing:
+                found = self.search_passages_batch(
+                    [queries[row] for row in missing], nprobe=nprobe, ef_search=ef_search, timings=timings
+                )
+                for row, hits in zip(missing, found):
+                    hits_list[row] = hits
+                    self.result_cache.set(keys[row], hits)
             
-            return ordered_docs
+            started = time.perf_counter()
+            results = self._fetch_documents_batch(hits_list)
+            timings['fetch_ms'] = (time.perf_counter() - started) * 1000
+            return results
         
         except Exception as e:
-            print(f"Error in semantic search: {e}")
-            # Fallback به جستجوی ساده
-            return list(Document.objects.filter(
-                Q(title__icontains=query) | Q(content__icontains=query)
-            )[:limit])
+            print(f"Error in semantic batch search: {e}")
+            # Fallback به جستجوی واژگانی
+            return [self.search_lexical(query, limit) for query, limit in queries]
+    
+    def evaluate_index(self, sample_size: int = 100, k: int = 10, nprobe: int = None, ef_search: int = None) -> dict:
+        """
+        سنجش recall و تأخیر index فعلی در مقایسه با جستجوی کامل (Flat)
+        
+        بردارهای تصادفی از قطعه‌های index شده به عنوان query استفاده می‌شوند.
+        
+        Returns:
+            dict شامل recall@k و میانگین زمان هر query (میلی‌ثانیه) برای هر دو index
+        """
+        import time
+        import numpy as np
+        
+        if self.index is None or self.index.ntotal == 0:
+            return {}
+        
+        chunk_ids, vectors = self._load_stored_embeddings(self.document_ids)
+        if not vectors:
+            return {}
+        vectors = np.vstack(vectors).astype('float32')
+        exact_index = build_index(vectors.shape[1], 'Flat', metric=self.index.metric)
+        exact_index.add(vectors, chunk_ids)
+        
+        rows = np.random.default_rng(0).choice(len(vectors), min(sample_size, len(vectors)), replace=False)
+        queries = vectors[rows]
+        k = min(k, len(vectors))
+        params = search_parameters(
+            self.index,
+            nprobe=nprobe or settings.SEARCH_NPROBE,
+            ef_search=ef_search or settings.SEARCH_EF_SEARCH,
+        )
+        
+        # جستجوی تک‌تک query ها، مشابه درخواست‌های واقعی
+        started = time.perf_counter()
+        exact_labels = [exact_index.search(query[None, :], k)[1][0] for query in queries]
+        exact_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        
+        started = time.perf_counter()
+        approx_labels = [self.index.search(query[None, :], k, params=params)[1][0] for query in queries]
+        approx_ms = (time.perf_counter() - started) * 1000 / len(queries)
+        
+        recall = np.mean([
+            len(set(exact.tolist()) & set(approx.tolist())) / k
+            for exact, approx in zip(exact_labels, approx_labels)
+        ])
+        return {
+            'index_type': self.index.describe(),
+            'queries': len(queries),
+            'k': k,
+            'recall': float(recall),
+            'latency_ms': approx_ms,
+            'exact_latency_ms': exact_ms,
+        }
+    
+    def best_passages(self, query: str, documents: List[Document]):
+        """
+        انتخاب بهترین قطعه‌های اسناد مشخص شده برای یک پرسش
+        
+        از embedding های ذخیره شده قطعه‌ها استفاده می‌کند و نیازی به index ندارد.
+        نتیجه در ویژگی matched_passages هر سند و امتیاز بهترین قطعه در ویژگی
+        score آن قرار می‌گیرد.
+        """
+        if not self.embedding_model or not documents:
+            return
+        
+        import numpy as np
+        
+        chunk_ids, vectors = self._load_stored_embeddings([doc.id for doc in documents])
+        if not vectors:
+            return
+        
+        query_embedding = self.encode_query(query)[0]
+        vectors = np.vstack(vectors)
+        if self.index is not None:
+            scores = self.index.score_vectors(vectors, query_embedding)
+        elif settings.SEARCH_INDEX_METRIC == METRIC_COSINE:
+            scores = normalize_vectors(vectors) @ normalize_vectors(query_embedding)
+        else:
+            scores = 1.0 / (1.0 + ((vectors - query_embedding) ** 2).sum(axis=1))
+        
+        passage_ids = {}
+        best_scores = {}
+        for row in np.argsort(-scores, kind='stable'):
+            doc_id = chunk_ids[row] >> CHUNK_ID_BITS
+            positions = passage_ids.setdefault(doc_id, [])
+            best_scores.setdefault(doc_id, float(scores[row]))
+            if len(positions) < settings.SEARCH_PASSAGES_PER_DOCUMENT:
+                positions.append(chunk_ids[row] & (MAX_CHUNKS_PER_DOCUMENT - 1))
+        self._attach_passages(documents, passage_ids)
+        for doc in documents:
+            doc.score = best_scores.get(doc.id)
+
+
+class QAResult(NamedTuple):
+    """نتیجه پرسش و پاسخ"""
+    answer: str
+    documents: List[Document]
+    llm_used: bool
+    cached: bool
+    usage: Optional[dict] = None  # تعداد توکن‌های context و prompt (فقط وقتی prompt ساخته شده باشد)
 
 
 class QAService:
     """سرویس پرسش و پاسخ با استفاده از LangChain و LLM"""
     
-    def __init__(self):
+    def __init__(self, search_service: Optional[DocumentSearchService] = None):
         self.llm = None
-        self.search_service = DocumentSearchService()
+        # استفاده از سرویس جستجوی مشترک تا مدل embedding و index دوباره بارگذاری نشوند
+        self.search_service = search_service or DocumentSearchService()
         self._initialize_llm()
+        self.count_tokens = token_counter(
+            self.llm,
+            settings.QA_TOKENIZER,
+            non_latin_chars_per_token=settings.QA_TOKEN_ESTIMATE_CHARS_PER_TOKEN,
+            margin=settings.QA_TOKEN_ESTIMATE_MARGIN,
+        )
     
     def _initialize_llm(self):
-        """راه‌اندازی مدل زبانی"""
+        """راه‌اندازی مدل زبانی (بر اساس تنظیم QA_LLM_BACKEND)"""
+        backend = settings.QA_LLM_BACKEND
+        if backend == 'none':
+            self.llm = None
+            print("LLM disabled. QA will use simple text matching.")
+            return
+        if backend == 'stub':
+            from .llms import StubLLM
+            self.llm = StubLLM(delay=settings.QA_STUB_LLM_DELAY)
+            print("Using stub LLM")
+            return
+        
         try:
             # تلاش برای استفاده از Ollama (رایگان و محلی)
             try:
                 from langchain_community.llms import Ollama
-                self.llm = Ollama(model="llama2")
+                self.llm = Ollama(model="llama2", num_predict=settings.QA_ANSWER_MAX_TOKENS)
                 print("Using Ollama LLM")
                 return
             except Exception as e:
@@ -204,7 +1389,8 @@ class QAService:
                 pipe = pipeline(
                     "text-generation",
                     model="gpt2",  # مدل رایگان و کوچک
-                    max_length=500,
+                    # طول پاسخ جدا از طول prompt محدود می‌شود (max_length شامل خود prompt است)
+                    max_new_tokens=settings.QA_ANSWER_MAX_TOKENS,
                     temperature=0.7
                 )
                 self.llm = HuggingFacePipeline(pipeline=pipe)
@@ -224,40 +1410,66 @@ class QAService:
             print(f"Warning: Could not initialize LLM: {e}")
             self.llm = None
     
-    def answer_question(self, question: str, document_ids: List[int] = None) -> Tuple[str, List[Document]]:
+    @property
+    def llm_identity(self) -> Optional[str]:
+        """شناسه LLM فعال (نوع و نام مدل) برای کلید cache پاسخ‌ها"""
+        if not self.llm:
+            return None
+        model = getattr(self.llm, 'model', None) or getattr(self.llm, 'model_id', None) or ''
+        return f"{type(self.llm).__module__}.{type(self.llm).__name__}:{model}"
+    
+    def retrieve(self, question: str, document_ids: List[int] = None,
+                 filters: SearchFilters = None) -> List[Document]:
         """
-        پاسخ به پرسش کاربر بر اساس اسناد
+        جستجوی اسناد مرتبط با پرسش (یا بهترین قطعه‌های اسناد انتخاب شده)
         
-        Args:
-            question: پرسش کاربر
-            document_ids: لیست ID اسناد برای جستجو (اختیاری)
-        
-        Returns:
-            Tuple شامل پاسخ و لیست اسناد مرتبط
+        از نتایج جستجو فقط اسناد با امتیاز حداقل QA_MIN_SCORE استفاده می‌شوند؛
+        اسنادی که کاربر صریحاً انتخاب کرده حذف نمی‌شوند. filters هم روی جستجو و
+        هم روی اسناد انتخاب شده اعمال می‌شود.
         """
-        # جستجوی اسناد مرتبط
         if document_ids:
-            relevant_docs = Document.objects.filter(id__in=document_ids)
+            relevant_docs = Document.objects.filter(id__in=document_ids).with_related()
+            if filters:
+                relevant_docs = filters.apply(relevant_docs)
             # تبدیل QuerySet به list برای یکنواختی
             relevant_docs_list = list(relevant_docs)
-        else:
-            relevant_docs_list = self.search_service.search_similar(question, limit=5)
-        
-        if not relevant_docs_list:
-            return "متأسفانه هیچ سند مرتبطی پیدا نشد.", []
-        
-        # آماده‌سازی context از اسناد (استفاده از محتوای کامل)
-        context_parts = []
-        for doc in relevant_docs_list:
-            # استفاده از محتوای کامل یا حداقل 1000 کاراکتر
-            content = doc.content[:2000] if len(doc.content) > 2000 else doc.content
-            context_parts.append(f"=== سند: {doc.title} ===\n{content}")
+            # انتخاب بهترین قطعه‌های اسناد انتخاب شده
+            self.search_service.best_passages(question, relevant_docs_list)
+            return relevant_docs_list
+        return self.search_service.search_similar(
+            question,
+            limit=settings.QA_MAX_DOCUMENTS,
+            min_score=settings.QA_MIN_SCORE or None,
+            filters=filters,
+        )
+    
+    def context_budget(self, question: str) -> int:
+        """
+        حداکثر توکن context برای یک پرسش
         
-        context = "\n\n".join(context_parts)
+        QA_CONTEXT_MAX_TOKENS، محدود به جای خالی پنجره context مدل پس از متن
+        ثابت prompt، پرسش و QA_ANSWER_MAX_TOKENS توکن پاسخ.
+        """
+        budget = settings.QA_CONTEXT_MAX_TOKENS
+        window = settings.QA_CONTEXT_WINDOW or context_window(self.llm)
+        if window:
+            prompt_tokens = self.count_tokens(self.build_prompt(question, ''))
+            budget = min(budget, window - prompt_tokens - settings.QA_ANSWER_MAX_TOKENS)
+        return max(budget, 0)
+    
+    def build_context(self, documents: List[Document], budget: int = None) -> PromptContext:
+        """
+        آماده‌سازی context از قطعه‌های منطبق اسناد با حداکثر budget توکن
         
-        if self.llm:
-            # استفاده از LLM برای تولید پاسخ
-            prompt = f"""شما یک دستیار هوشمند هستید که بر اساس اسناد ارائه شده به پرسش‌های کاربران پاسخ می‌دهید.
+        بدون index معنایی ابتدای محتوای سند استفاده می‌شود (documents.context.build_context).
+        """
+        if budget is None:
+            budget = settings.QA_CONTEXT_MAX_TOKENS
+        return build_context(documents, budget, self.count_tokens)
+    
+    def build_prompt(self, question: str, context: str) -> str:
+        """ساخت prompt نهایی برای LLM"""
+        return f"""شما یک دستیار هوشمند هستید که بر اساس اسناد ارائه شده به پرسش‌های کاربران پاسخ می‌دهید.
 
 اسناد مرتبط:
 {context}
@@ -267,30 +1479,244 @@ class QAService:
 لطفاً بر اساس اطلاعات موجود در اسناد بالا، به پرسش کاربر پاسخ دقیق و مفصل دهید. اگر پاسخ در اسناد موجود نیست، صادقانه بگویید که اطلاعات کافی در دسترس نیست.
 
 پاسخ:"""
-            
-            try:
-                # استفاده از LangChain برای تولید پاسخ
-                if hasattr(self.llm, '__call__'):
-                    answer = self.llm(prompt)
-                else:
-                    # برای مدل‌های مختلف
-                    answer = self.llm.invoke(prompt) if hasattr(self.llm, 'invoke') else str(self.llm(prompt))
-                
-                # پاکسازی پاسخ
-                answer = answer.strip()
-                if not answer:
-                    raise ValueError("Empty response from LLM")
-                
-                return answer, relevant_docs_list
-            except Exception as e:
-                print(f"Error generating answer with LLM: {e}")
-                # Fallback به پاسخ ساده
-                answer = self._simple_answer(question, relevant_docs_list)
-                return answer, relevant_docs_list
+    
+    def _generate(self, prompt: str) -> str:
+        """تولید پاسخ با LLM"""
+        # استفاده از LangChain برای تولید پاسخ
+        if hasattr(self.llm, '__call__'):
+            answer = self.llm(prompt)
         else:
+            # برای مدل‌های مختلف
+            answer = self.llm.invoke(prompt) if hasattr(self.llm, 'invoke') else str(self.llm(prompt))
+        
+        # پاکسازی پاسخ
+        answer = answer.strip()
+        if not answer:
+            raise ValueError("Empty response from LLM")
+        return answer
+    
+    def _prepare(self, question: str, document_ids: List[int] = None, use_cache: bool = True,
+                 filters: SearchFilters = None):
+        """
+        مراحل پیش از فراخوانی LLM: بازیابی اسناد، بررسی cache و ساخت prompt
+        
+        Returns:
+            Tuple شامل نتیجه نهایی (اگر به LLM نیازی نباشد)، اسناد مرتبط، کلید cache، prompt
+            و آمار توکن‌های آن
+        """
+        # جستجوی اسناد مرتبط
+        relevant_docs_list = self.retrieve(question, document_ids, filters)
+        
+        if not relevant_docs_list:
+            result = QAResult("متأسفانه هیچ سند مرتبطی پیدا نشد.", [], self.llm is not None, False)
+            return result, [], None, None, None
+        
+        if not self.llm:
             # پاسخ ساده بدون LLM
             answer = self._simple_answer(question, relevant_docs_list)
-            return answer, relevant_docs_list
+            return QAResult(answer, relevant_docs_list, False, False), relevant_docs_list, None, None, None
+        
+        cache_key = answer_cache_key(question, relevant_docs_list, self.llm_identity)
+        if use_cache:
+            cached_answer = get_cached_answer(cache_key)
+            if cached_answer is not None:
+                result = QAResult(cached_answer, relevant_docs_list, True, True)
+                return result, relevant_docs_list, cache_key, None, None
+        
+        context = self.build_context(relevant_docs_list, self.context_budget(question))
+        prompt = self.build_prompt(question, context.text)
+        usage = {
+            'context_tokens': context.tokens,
+            'context_budget': context.budget,
+            'prompt_tokens': self.count_tokens(prompt),
+            'tokens_estimated': self.count_tokens.estimated,
+            'passages': context.passages,
+            'dropped_passages': context.dropped,
+            'duplicate_passages': context.duplicates,
+        }
+        return None, relevant_docs_list, cache_key, prompt, usage
+    
+    def ask(self, question: str, document_ids: List[int] = None, use_cache: bool = True,
+            filters: SearchFilters = None) -> QAResult:
+        """
+        پاسخ به پرسش کاربر بر اساس اسناد، با استفاده از cache پاسخ‌ها
+        
+        کلید cache از پرسش، ID و زمان به‌روزرسانی اسناد بازیابی شده و شناسه LLM
+        ساخته می‌شود؛ بنابراین ویرایش هر یک از اسناد پاسخ قبلی را بی‌اعتبار می‌کند.
+        فقط پاسخ‌های موفق LLM در cache ذخیره می‌شوند.
+        
+        Args:
+            question: پرسش کاربر
+            document_ids: لیست ID اسناد برای جستجو (اختیاری)
+            use_cache: با False پاسخ همیشه دوباره تولید می‌شود
+            filters: محدود کردن اسناد به برچسب‌ها، بازه تاریخ یا ایجاد کننده (اختیاری)
+        """
+        result, relevant_docs_list, cache_key, prompt, usage = self._prepare(
+            question, document_ids, use_cache, filters
+        )
+        if result is not None:
+            return result
+        
+        # استفاده از LLM برای تولید پاسخ
+        try:
+            answer = self._generate(prompt)
+        except Exception as e:
+            print(f"Error generating answer with LLM: {e}")
+            # Fallback به پاسخ ساده
+            answer = self._simple_answer(question, relevant_docs_list)
+            return QAResult(answer, relevant_docs_list, True, False, usage)
+        
+        set_cached_answer(cache_key, answer)
+        return QAResult(answer, relevant_docs_list, True, False, usage)
+    
+    async def _agenerate(self, prompt: str, executor=None) -> str:
+        """تولید پاسخ با API غیرهمزمان LLM (یا در thread pool اگر LLM آن را نداشته باشد)"""
+        if not hasattr(self.llm, 'ainvoke'):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, self._generate, prompt)
+        
+        answer = await self.llm.ainvoke(prompt)
+        # مدل‌های chat به جای رشته پیام برمی‌گردانند
+        answer = (answer if isinstance(answer, str) else getattr(answer, 'content', str(answer))).strip()
+        if not answer:
+            raise ValueError("Empty response from LLM")
+        return answer
+    
+    async def aask(self, question: str, document_ids: List[int] = None, use_cache: bool = True, executor=None,
+                   filters: SearchFilters = None) -> QAResult:
+        """
+        نسخه غیرهمزمان ask
+        
+        بازیابی اسناد و دسترسی به cache و دیتابیس در executor (thread pool محدود)
+        اجرا می‌شوند و منتظر ماندن برای LLM هیچ thread ای را اشغال نمی‌کند.
+        """
+        loop = asyncio.get_running_loop()
+        result, relevant_docs_list, cache_key, prompt, usage = await loop.run_in_executor(
+            executor, self._prepare, question, document_ids, use_cache, filters
+        )
+        if result is not None:
+            return result
+        
+        try:
+            answer = await self._agenerate(prompt, executor)
+        except Exception as e:
+            print(f"Error generating answer with LLM: {e}")
+            answer = self._simple_answer(question, relevant_docs_list)
+            return QAResult(answer, relevant_docs_list, True, False, usage)
+        
+        await loop.run_in_executor(executor, set_cached_answer, cache_key, answer)
+        return QAResult(answer, relevant_docs_list, True, False, usage)
+    
+    def _generate_stream(self, prompt: str) -> Iterator[str]:
+        """تولید پاسخ با LLM به صورت تکه‌تکه (از طریق رابط stream در LangChain)"""
+        if not hasattr(self.llm, 'stream'):
+            yield self._generate(prompt)
+            return
+        for chunk in self.llm.stream(prompt):
+            # مدل‌های chat به جای رشته پیام برمی‌گردانند
+            yield chunk if isinstance(chunk, str) else getattr(chunk, 'content', str(chunk))
+    
+    def stream(self, question: str, document_ids: List[int] = None, use_cache: bool = True,
+               filters: SearchFilters = None) -> Iterator[Tuple[str, object]]:
+        """
+        پاسخ به پرسش به صورت جریانی
+        
+        ابتدا رویداد ('documents', اسناد مرتبط)، سپس رویدادهای ('token', متن) به
+        محض تولید توسط LLM و در پایان ('done', اطلاعات پاسخ) تولید می‌شوند.
+        پاسخ کامل پس از پایان جریان در cache ذخیره می‌شود.
+        """
+        result, relevant_docs_list, cache_key, prompt, usage = self._prepare(
+            question, document_ids, use_cache, filters
+        )
+        yield 'documents', relevant_docs_list
+        
+        if result is not None:
+            # پاسخ بدون نیاز به LLM یا از cache
+            yield 'token', result.answer
+            yield 'done', {'llm_used': result.llm_used, 'cached': result.cached, 'usage': None}
+            return
+        
+        parts = []
+        try:
+            for token in self._generate_stream(prompt):
+                if token:
+                    parts.append(token)
+                    yield 'token', token
+        except Exception as e:
+            print(f"Error streaming answer with LLM: {e}")
+            if not parts:
+                # Fallback به پاسخ ساده
+                yield 'token', self._simple_answer(question, relevant_docs_list)
+                yield 'done', {'llm_used': True, 'cached': False, 'usage': usage}
+                return
+            yield 'error', str(e)
+        else:
+            answer = ''.join(parts).strip()
+            if answer:
+                set_cached_answer(cache_key, answer)
+        
+        yield 'done', {'llm_used': True, 'cached': False, 'usage': usage}
+    
+    async def _agenerate_stream(self, prompt: str, executor=None) -> AsyncIterator[str]:
+        """نسخه غیرهمزمان _generate_stream (از طریق رابط astream در LangChain)"""
+        if not hasattr(self.llm, 'astream'):
+            yield await self._agenerate(prompt, executor)
+            return
+        async for chunk in self.llm.astream(prompt):
+            yield chunk if isinstance(chunk, str) else getattr(chunk, 'content', str(chunk))
+    
+    async def astream(self, question: str, document_ids: List[int] = None, use_cache: bool = True,
+                      executor=None, filters: SearchFilters = None) -> AsyncIterator[Tuple[str, object]]:
+        """
+        نسخه غیرهمزمان stream با همان رویدادها
+        
+        بازیابی اسناد و دسترسی به cache در executor اجرا می‌شوند و تکه‌های پاسخ
+        بدون اشغال thread از astream مدل خوانده می‌شوند.
+        """
+        loop = asyncio.get_running_loop()
+        result, relevant_docs_list, cache_key, prompt, usage = await loop.run_in_executor(
+            executor, self._prepare, question, document_ids, use_cache, filters
+        )
+        yield 'documents', relevant_docs_list
+        
+        if result is not None:
+            yield 'token', result.answer
+            yield 'done', {'llm_used': result.llm_used, 'cached': result.cached, 'usage': None}
+            return
+        
+        parts = []
+        try:
+            async for token in self._agenerate_stream(prompt, executor):
+                if token:
+                    parts.append(token)
+                    yield 'token', token
+        except Exception as e:
+            print(f"Error streaming answer with LLM: {e}")
+            if not parts:
+                yield 'token', self._simple_answer(question, relevant_docs_list)
+                yield 'done', {'llm_used': True, 'cached': False, 'usage': usage}
+                return
+            yield 'error', str(e)
+        else:
+            answer = ''.join(parts).strip()
+            if answer:
+                await loop.run_in_executor(executor, set_cached_answer, cache_key, answer)
+        
+        yield 'done', {'llm_used': True, 'cached': False, 'usage': usage}
+    
+    def answer_question(self, question: str, document_ids: List[int] = None) -> Tuple[str, List[Document]]:
+        """
+        پاسخ به پرسش کاربر بر اساس اسناد
+        
+        Args:
+            question: پرسش کاربر
+            document_ids: لیست ID اسناد برای جستجو (اختیاری)
+        
+        Returns:
+            Tuple شامل پاسخ و لیست اسناد مرتبط
+        """
+        result = self.ask(question, document_ids)
+        return result.answer, result.documents
     
     def _simple_answer(self, question: str, documents: List[Document]) -> str:
         """پاسخ ساده بدون استفاده از LLM"""
@@ -301,8 +1727,10 @@ class QAService:
         answer_parts = [f"بر اساس جستجو، {len(documents)} سند مرتبط پیدا شد:\n"]
         
         for i, doc in enumerate(documents[:3], 1):  # فقط 3 سند اول
-            # استخراج جملات مرتبط از محتوا
-            content_preview = doc.content[:300] + "..." if len(doc.content) > 300 else doc.content
+            # استخراج جملات مرتبط از محتوا (بهترین قطعه منطبق در صورت وجود)
+            passages = getattr(doc, 'matched_passages', None)
+            text = passages[0] if passages else doc.content
+            content_preview = text[:300] + "..." if len(text) > 300 else text
             answer_parts.append(f"{i}. {doc.title}:\n{content_preview}\n")
         
         if len(documents) > 3:
@@ -1,54 +1,90 @@
 """
 Signal handlers برای به‌روزرسانی خودکار index
+
+signal ها فقط سند را در صف index ثبت می‌کنند تا encode کردن روی مسیر درخواست
+انجام نشود. صف توسط دستور process_index_queue پردازش می‌شود. جدول FTS5 جستجوی
+واژگانی نیازی به مدل ندارد و مستقیماً به‌روزرسانی می‌شود. تغییر برچسب‌ها و
+اطلاعات اسناد با mark_filters_changed به cache فیلترهای جستجو اطلاع داده می‌شود.
 """
-from django.db.models.signals import post_save, post_delete
+import logging
+
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_save, post_delete
 from django.dispatch import receiver
-from .models import Document
-from .services import DocumentSearchService
+from .models import Document, IndexingTask, Tag
+from .filtering import mark_filters_changed
+from .indexing import enqueue_document
+from . import lexical
+
+logger = logging.getLogger(__name__)
 
 
 @receiver(post_save, sender=Document)
 def update_document_index(sender, instance, **kwargs):
-    """به‌روزرسانی index پس از ذخیره سند"""
+    """ثبت سند در صف index پس از ذخیره"""
     try:
-        # استفاده از async یا background task برای جلوگیری از کند شدن ذخیره
-        # برای حال حاضر، فقط در صورت وجود index، rebuild می‌کنیم
-        from .services import DocumentSearchService
-        search_service = DocumentSearchService()
-        # فقط rebuild می‌کنیم اگر index وجود داشته باشد
-        if search_service.index is not None and search_service.embedding_model is not None:
-            # برای بهینه‌تر بودن، می‌توانیم فقط سند جدید را اضافه کنیم
-            # اما برای سادگی، rebuild کامل انجام می‌دهیم
-            # استفاده از try-except برای جلوگیری از خطا در ذخیره
-            try:
-                search_service.rebuild_index()
-            except Exception as rebuild_error:
-                # خطا را لاگ می‌کنیم اما اجازه می‌دهیم سند ذخیره شود
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"Error rebuilding index: {rebuild_error}")
+        # اگر عنوان و محتوا تغییر نکرده‌اند (مثلاً فقط برچسب‌ها ویرایش شده‌اند) نیازی به index مجدد نیست
+        if instance.is_index_current(settings.EMBEDDING_MODEL):
+            return
+        enqueue_document(instance.id, IndexingTask.ACTION_INDEX)
     except Exception as e:
         # خطا را لاگ می‌کنیم اما اجازه می‌دهیم سند ذخیره شود
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.warning(f"Error updating index after document save: {e}")
+        logger.warning(f"Error queueing document for indexing after save: {e}")
 
 
 @receiver(post_delete, sender=Document)
 def remove_document_from_index(sender, instance, **kwargs):
-    """حذف سند از index پس از حذف"""
+    """ثبت حذف سند در صف index"""
+    try:
+        enqueue_document(instance.id, IndexingTask.ACTION_DELETE)
+    except Exception as e:
+        logger.warning(f"Error queueing document for removal after delete: {e}")
+
+
+@receiver(post_save, sender=Document)
+def update_lexical_index(sender, instance, **kwargs):
+    """به‌روزرسانی جدول FTS5 (بدون نیاز به مدل، بلافاصله در همان درخواست)"""
+    try:
+        lexical.index_documents([instance])
+    except Exception as e:
+        logger.warning(f"Error updating lexical index after save: {e}")
+
+
+@receiver(post_delete, sender=Document)
+def remove_from_lexical_index(sender, instance, **kwargs):
+    """حذف سند از جدول FTS5"""
     try:
-        from .services import DocumentSearchService
-        search_service = DocumentSearchService()
-        if search_service.index is not None and search_service.embedding_model is not None:
-            try:
-                search_service.rebuild_index()
-            except Exception as rebuild_error:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"Error rebuilding index after delete: {rebuild_error}")
+        lexical.remove_documents([instance.id])
     except Exception as e:
-        import logging
-        logger = logging.getLogger(__name__)
-        logger.warning(f"Error updating index after document delete: {e}")
+        logger.warning(f"Error removing document from lexical index after delete: {e}")
 
+
+@receiver(m2m_changed, sender=Document.tags.through)
+def invalidate_tag_filters(sender, action, **kwargs):
+    """کنار گذاشتن bitmap های برچسب پس از تغییر برچسب‌های اسناد"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    try:
+        mark_filters_changed(settings.SEARCH_INDEX_DIR)
+    except Exception as e:
+        logger.warning(f"Error invalidating search filters after tag change: {e}")
+
+
+@receiver(post_save, sender=Document)
+def invalidate_document_filters(sender, instance, created, update_fields=None, **kwargs):
+    """ایجاد کننده سند ممکن است بدون تغییر index عوض شده باشد (اسناد جدید هنوز در index نیستند)"""
+    if created or (update_fields and not {'created_at', 'created_by'} & set(update_fields)):
+        return
+    try:
+        mark_filters_changed(settings.SEARCH_INDEX_DIR)
+    except Exception as e:
+        logger.warning(f"Error invalidating search filters after save: {e}")
+
+
+@receiver(post_delete, sender=Tag)
+def invalidate_deleted_tag_filters(sender, instance, **kwargs):
+    """حذف برچسب ارتباط آن با اسناد را بدون m2m_changed حذف می‌کند"""
+    try:
+        mark_filters_changed(settings.SEARCH_INDEX_DIR)
+    except Exception as e:
+        logger.warning(f"Error invalidating search filters after tag delete: {e}")
@@ -0,0 +1,211 @@
+"""
+snapshot های نسخه‌دار index جستجو
+
+هر snapshot یک پوشه در SEARCH_INDEX_DIR/snapshots است که شامل فایل index،
+آرایه ID ها و یک manifest است. snapshot ابتدا در پوشه موقت نوشته و سپس با
+rename در جای خود قرار می‌گیرد؛ فایل CURRENT (که آن هم با جایگزینی اتمی نوشته
+می‌شود) نسخه فعال را مشخص می‌کند. به این ترتیب خواننده هرگز index جدید را با
+ID های قدیمی ترکیب نمی‌کند.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from .vector_index import VectorIndex
+
+INDEX_FILE = 'index.faiss'
+IDS_FILE = 'ids.npy'
+MANIFEST_FILE = 'manifest.json'
+CURRENT_FILE = 'CURRENT'
+CHECKPOINT_FILE = 'rebuild_checkpoint.json'
+
+
+def _snapshots_dir(index_dir) -> str:
+    return os.path.join(index_dir, 'snapshots')
+
+
+def _file_checksum(path: str) -> str:
+    """محاسبه sha256 یک فایل"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, data: str):
+    """نوشتن فایل متنی از طریق فایل موقت و rename"""
+    tmp_path = f"{path}.tmp-{uuid.uuid4().hex}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def current_version(index_dir) -> Optional[str]:
+    """نسخه snapshot فعال (یا None اگر snapshot ای وجود ندارد)"""
+    try:
+        with open(os.path.join(index_dir, CURRENT_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def current_marker(index_dir):
+    """
+    نشانگر ارزان تغییر snapshot فعال (زمان و اندازه فایل CURRENT)
+    
+    برای تشخیص snapshot جدید بدون خواندن فایل‌ها در هر درخواست استفاده می‌شود.
+    """
+    try:
+        stat = os.stat(os.path.join(index_dir, CURRENT_FILE))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def write_snapshot(index_dir, index: VectorIndex, metadata: dict) -> str:
+    """
+    نوشتن snapshot جدید و فعال کردن آن
+    
+    Args:
+        metadata: اطلاعات اضافه manifest (نام مدل، تعداد اسناد و ...)
+    
+    Returns:
+        نسخه snapshot جدید
+    """
+    snapshots_dir = _snapshots_dir(index_dir)
+    os.makedirs(snapshots_dir, exist_ok=True)
+    
+    # نسخه‌ها بر اساس زمان ساخت به ترتیب الفبایی مرتب می‌شوند
+    version = f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+    tmp_dir = os.path.join(snapshots_dir, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+    try:
+        index.save(os.path.join(tmp_dir, INDEX_FILE), os.path.join(tmp_dir, IDS_FILE))
+        manifest = dict(metadata)
+        manifest.update({
+            'version': version,
+            'created_at': time.time(),
+            'index_file': INDEX_FILE,
+            'ids_file': IDS_FILE,
+            'index_type': index.describe(),
+            'factory': index.factory,
+            'deleted_count': index.deleted_count,
+            'dimension': index.d,
+            'chunk_count': index.ntotal,
+            'index_bytes': os.path.getsize(os.path.join(tmp_dir, INDEX_FILE)),
+            'checksums': {
+                INDEX_FILE: _file_checksum(os.path.join(tmp_dir, INDEX_FILE)),
+                IDS_FILE: _file_checksum(os.path.join(tmp_dir, IDS_FILE)),
+            },
+        })
+        _write_atomic(os.path.join(tmp_dir, MANIFEST_FILE), json.dumps(manifest, indent=2))
+        os.rename(tmp_dir, os.path.join(snapshots_dir, version))
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    
+    _write_atomic(os.path.join(index_dir, CURRENT_FILE), version)
+    return version
+
+
+def read_manifest(index_dir, version: str) -> dict:
+    """خواندن manifest یک snapshot"""
+    with open(os.path.join(_snapshots_dir(index_dir), version, MANIFEST_FILE), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def list_versions(index_dir) -> List[str]:
+    """نسخه snapshot های موجود از جدیدترین به قدیمی‌ترین"""
+    snapshots_dir = _snapshots_dir(index_dir)
+    if not os.path.isdir(snapshots_dir):
+        return []
+    return sorted((name for name in os.listdir(snapshots_dir) if not name.startswith('.')), reverse=True)
+
+
+def verify_snapshot(index_dir, version: str, manifest: dict = None) -> bool:
+    """بررسی checksum فایل‌های یک snapshot"""
+    manifest = manifest or read_manifest(index_dir, version)
+    snapshot_dir = os.path.join(_snapshots_dir(index_dir), version)
+    try:
+        return all(
+            _file_checksum(os.path.join(snapshot_dir, name)) == checksum
+            for name, checksum in manifest['checksums'].items()
+        )
+    except FileNotFoundError:
+        return False
+
+
+def load_snapshot(index_dir, version: str, mmap: bool = False) -> Tuple[VectorIndex, dict]:
+    """
+    بارگذاری index و manifest یک snapshot
+    
+    checksum فایل‌ها پیش از بارگذاری بررسی می‌شود. در حالت mmap (که فقط
+    صفحه‌های لازم از دیسک خوانده می‌شوند) فقط اندازه فایل index با manifest
+    مقایسه می‌شود تا خواندن کامل فایل در هر worker لازم نباشد.
+    
+    Raises:
+        ValueError: اگر فایل‌های snapshot ناقص یا خراب باشند
+    """
+    manifest = read_manifest(index_dir, version)
+    snapshot_dir = os.path.join(_snapshots_dir(index_dir), version)
+    if mmap:
+        expected = manifest.get('index_bytes')
+        if expected is not None and os.path.getsize(os.path.join(snapshot_dir, manifest['index_file'])) != expected:
+            raise ValueError(f"Index file of snapshot {version} is truncated")
+    elif not verify_snapshot(index_dir, version, manifest):
+        raise ValueError(f"Checksum mismatch in snapshot {version}")
+    index = VectorIndex.load(
+        os.path.join(snapshot_dir, manifest['index_file']),
+        os.path.join(snapshot_dir, manifest['ids_file']),
+        mmap=mmap,
+    )
+    index.factory = manifest.get('factory')
+    return index, manifest
+
+
+def prune_snapshots(index_dir, keep: int = 3):
+    """
+    حذف snapshot های قدیمی به جز keep نسخه آخر و نسخه فعال
+    
+    پروسه‌هایی که snapshot قدیمی را با mmap باز کرده‌اند تا بارگذاری نسخه
+    جدید به آن دسترسی دارند، چون فایل‌های حذف شده تا بسته شدن map باقی می‌مانند.
+    """
+    snapshots_dir = _snapshots_dir(index_dir)
+    if not os.path.isdir(snapshots_dir):
+        return
+    active = current_version(index_dir)
+    versions = list_versions(index_dir)
+    for version in versions[keep:]:
+        if version != active:
+            shutil.rmtree(os.path.join(snapshots_dir, version), ignore_errors=True)
+
+
+def read_checkpoint(index_dir) -> Optional[dict]:
+    """خواندن checkpoint ساخت مجدد ناتمام index (یا None)"""
+    try:
+        with open(os.path.join(index_dir, CHECKPOINT_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_checkpoint(index_dir, checkpoint: dict):
+    """ثبت پیشرفت ساخت مجدد index (با جایگزینی اتمی فایل)"""
+    os.makedirs(index_dir, exist_ok=True)
+    _write_atomic(os.path.join(index_dir, CHECKPOINT_FILE), json.dumps(checkpoint))
+
+
+def clear_checkpoint(index_dir):
+    """حذف checkpoint پس از پایان موفق ساخت مجدد"""
+    try:
+        os.remove(os.path.join(index_dir, CHECKPOINT_FILE))
+    except FileNotFoundError:
+        pass
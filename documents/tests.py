@@ -0,0 +1,983 @@
+import hashlib
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from documents import snapshots
+from documents.chunking import chunk_text
+from documents.models import Document
+
+
+class ChunkTextTests(SimpleTestCase):
+    def test_no_chunk_inside_previous_chunk(self):
+        """جمله بلند بعد از جمله‌های کوتاه نباید قطعه‌های تکراری داخل قطعه قبلی بسازد"""
+        text = ' '.join(f'Short sentence number {i:02d}.' for i in range(30))
+        text += ' ' + 'x' * 960
+        chunks = chunk_text(text, chunk_size=800, overlap=150)
+        
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertGreater(chunk.end, previous.end)
+            self.assertGreater(chunk.start, previous.start)
+    
+    def test_consecutive_chunks_overlap(self):
+        text = ' '.join(f'Sentence {i:03d} has a few words.' for i in range(100))
+        chunks = chunk_text(text, chunk_size=800, overlap=150)
+        
+        self.assertGreater(len(chunks), 1)
+        for previous, chunk in zip(chunks, chunks[1:]):
+            self.assertLess(chunk.start, previous.end)
+            self.assertLessEqual(chunk.end - chunk.start, 800)
+
+
+class ContextTests(SimpleTestCase):
+    def test_default_langchain_tokenizer_is_not_used(self):
+        """get_num_tokens پیش‌فرض LangChain (GPT-2) برای مدل‌های دیگر استفاده نمی‌شود"""
+        from documents.context import token_counter
+        
+        class BaseLanguageModel:
+            custom_get_token_ids = None
+            
+            def get_token_ids(self, text):
+                return list(text)
+            
+            def get_num_tokens(self, text):
+                return len(self.get_token_ids(text))
+            
+            get_token_ids.__module__ = get_num_tokens.__module__ = 'langchain_core.language_models.base'
+        
+        class Ollama(BaseLanguageModel):
+            pass
+        
+        count_tokens = token_counter(Ollama(), margin=0.5)
+        self.assertTrue(count_tokens.estimated)
+        self.assertEqual(count_tokens('سلام'), 6)
+    
+    def test_model_tokenizer_is_used(self):
+        from documents.context import token_counter
+        from documents.llms import StubLLM
+        
+        count_tokens = token_counter(StubLLM())
+        self.assertFalse(count_tokens.estimated)
+        self.assertEqual(count_tokens('سلام دنیا'), 2)
+    
+    def test_estimate_counts_persian_characters_with_margin(self):
+        from documents.context import estimate_tokens
+        
+        self.assertEqual(estimate_tokens('hello world.', margin=0), 4)
+        self.assertEqual(estimate_tokens('کتاب خوب', margin=0), 7)
+        self.assertEqual(estimate_tokens('کتاب خوب', non_latin_chars_per_token=2, margin=0.25), 5)
+    
+    def test_context_stays_within_budget(self):
+        from types import SimpleNamespace
+        
+        from documents.context import build_context, estimate_tokens
+        
+        documents = [
+            SimpleNamespace(title=f'doc {i}', content='', matched_passages=[f'passage {i} ' + 'word ' * 40] * 2)
+            for i in range(5)
+        ]
+        context = build_context(documents, 150, estimate_tokens)
+        
+        self.assertLessEqual(context.tokens, 150)
+        self.assertEqual(context.duplicates, context.passages)
+        self.assertGreater(context.dropped, 0)
+        self.assertIn('=== سند: doc 0 ===', context.text)
+
+
+class DocumentListPaginationTests(TestCase):
+    def setUp(self):
+        from django.utils import timezone
+        
+        now = timezone.now()
+        # چند سند با created_at یکسان تا ترتیب فقط با id مشخص شود
+        Document.objects.bulk_create(
+            [Document(title=f'same time {i}', content='x', created_at=now) for i in range(5)]
+            + [Document(title=f'older {i}', content='x', created_at=now - timedelta(days=1)) for i in range(2)]
+        )
+        self.expected = list(Document.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+    
+    def _pages(self, url):
+        pages = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json())
+            url = pages[-1]['next']
+        return pages
+    
+    def test_pages_break_created_at_ties_by_id(self):
+        pages = self._pages('/api/documents/?page_size=2&include_content=false')
+        
+        ids = [document['id'] for page in pages for document in page['results']]
+        self.assertEqual(ids, self.expected)
+        self.assertEqual([len(page['results']) for page in pages], [2, 2, 2, 1])
+        self.assertNotIn('count', pages[0])
+        self.assertIsNone(pages[0]['previous'])
+    
+    def test_previous_link_returns_previous_page(self):
+        pages = self._pages('/api/documents/?page_size=2')
+        
+        for page, previous in zip(pages[1:], pages):
+            response = self.client.get(page['previous'])
+            self.assertEqual(response.json()['results'], previous['results'])
+    
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/documents/?cursor=invalid')
+        self.assertEqual(response.status_code, 404)
+
+
+class EncoderTests(SimpleTestCase):
+    def test_missing_onnx_model_is_a_configuration_error(self):
+        """سرور نباید مدل را روی مسیر درخواست با PyTorch export کند"""
+        from django.core.exceptions import ImproperlyConfigured
+        from documents.encoders import BACKEND_ONNX_INT8, load_encoder
+        
+        onnx_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, onnx_dir, ignore_errors=True)
+        with mock.patch('documents.encoders.export_onnx') as export_onnx:
+            with self.assertRaisesMessage(ImproperlyConfigured, 'export_onnx'):
+                load_encoder('some/model', BACKEND_ONNX_INT8, onnx_dir=onnx_dir)
+        export_onnx.assert_not_called()
+
+
+@unittest.skipUnless(importlib.util.find_spec('faiss'), 'faiss not installed')
+class SnapshotTests(SimpleTestCase):
+    def setUp(self):
+        import numpy as np
+        from documents.vector_index import build_index
+        
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        self.index = build_index(8, 'Flat')
+        self.index.add(np.random.default_rng(0).random((10, 8), dtype='float32'), np.arange(10))
+    
+    def _corrupt(self, version):
+        path = os.path.join(self.index_dir, 'snapshots', version, snapshots.INDEX_FILE)
+        with open(path, 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            last = f.read(1)
+            f.seek(-1, os.SEEK_END)
+            f.write(bytes([last[0] ^ 0xFF]))
+    
+    def test_corrupt_snapshot_is_not_loaded(self):
+        version = snapshots.write_snapshot(self.index_dir, self.index, {})
+        index, _ = snapshots.load_snapshot(self.index_dir, version)
+        self.assertEqual(index.ntotal, 10)
+        
+        self._corrupt(version)
+        with self.assertRaises(ValueError):
+            snapshots.load_snapshot(self.index_dir, version)
+
+
+class HashingEncoder:
+    """encoder قطعی سبک به جای مدل embedding (هر واژه یک مؤلفه بردار)"""
+    dimension = 32
+    
+    def get_sentence_embedding_dimension(self):
+        return self.dimension
+    
+    def encode(self, texts, **kwargs):
+        import numpy as np
+        
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dimension] += 1
+        return vectors
+
+
+@unittest.skipUnless(importlib.util.find_spec('faiss'), 'faiss not installed')
+class IndexUpdateTests(TestCase):
+    def setUp(self):
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.index_dir, ignore_errors=True)
+        overrides = override_settings(SEARCH_INDEX_DIR=self.index_dir, SEARCH_BATCH_MAX_SIZE=1, SEARCH_RERANK=False)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        encoder = mock.patch('documents.services.load_encoder', return_value=HashingEncoder())
+        encoder.start()
+        self.addCleanup(encoder.stop)
+        
+        from documents.services import DocumentSearchService
+        
+        Document.objects.bulk_create([
+            Document(title=f'doc {i}', content=f'alpha{i} beta gamma{i % 7}') for i in range(40)
+        ])
+        self.service = DocumentSearchService()
+    
+    def test_update_keeps_hnsw_index_type_and_metric(self):
+        self.service.rebuild_index(factory='HNSW32', metric='l2')
+        expected = self.service.index.describe()
+        self.assertEqual(expected, 'IndexHNSWFlat (l2)')
+        
+        document = Document.objects.order_by('id').first()
+        document.content = 'completely different words'
+        document.save()
+        self.service.apply_changes([Document.objects.get(id=document.id)], [])
+        
+        self.assertEqual(self.service.index.describe(), expected)
+        self.assertEqual(self.service.index.factory, 'HNSW32')
+        results = self.service.search_similar('completely different words', 40)
+        self.assertEqual(sum(result.id == document.id for result in results), 1)
+    
+    def test_deleted_vectors_are_not_returned(self):
+        self.service.rebuild_index(factory='HNSW32')
+        deleted = list(Document.objects.order_by('id').values_list('id', flat=True)[:3])
+        self.service.apply_changes([], deleted)
+        
+        self.assertEqual(self.service.index.deleted_count, 3)
+        self.assertEqual(self.service.index.ntotal, 37)
+        results = self.service.search_similar('alpha1 beta', 40)
+        self.assertEqual(len(results), 37)
+        self.assertFalse({result.id for result in results} & set(deleted))
+    
+    def test_failing_document_does_not_block_queue(self):
+        from documents.indexing import process_queue
+        from documents.models import IndexingTask
+        
+        IndexingTask.objects.all().delete()
+        documents = list(Document.objects.order_by('id')[:3])
+        for document in documents:
+            document.content += ' edited'
+            document.save()
+        poison = documents[1]
+        encode = self.service._encode_texts
+        
+        def failing_encode(texts):
+            if any(text.startswith(f'{poison.title}\n') for text in texts):
+                raise RuntimeError('encode failed')
+            return encode(texts)
+        
+        with mock.patch.object(self.service, '_encode_texts', side_effect=failing_encode):
+            for attempt in range(3):
+                result = process_queue(self.service)
+                self.assertEqual(len(result.failed_task_ids), 1)
+            self.assertEqual(process_queue(self.service).tasks, 0)
+        
+        task = IndexingTask.objects.get()
+        self.assertEqual((task.document_id, task.attempts), (poison.id, 3))
+        self.assertIn('encode failed', task.last_error)
+        for document in documents[::2]:
+            self.assertTrue(Document.objects.get(id=document.id).is_index_current(settings.EMBEDDING_MODEL))
+    
+    def test_filtered_search_follows_tag_changes(self):
+        from documents.filtering import SearchFilters
+        from documents.models import Tag
+        
+        self.service.filter_masks.check_interval = 0
+        tag = Tag.objects.create(name='filtered')
+        documents = list(Document.objects.order_by('id')[:5])
+        for document in documents[:3]:
+            document.tags.add(tag)
+        filters = SearchFilters(tag_ids=(tag.id,))
+        
+        results = self.service.search_similar('alpha1 beta', 10, filters=filters)
+        self.assertEqual({result.id for result in results}, {document.id for document in documents[:3]})
+        
+        documents[3].tags.add(tag)
+        results = self.service.search_similar('alpha1 beta', 10, filters=filters)
+        self.assertEqual({result.id for result in results}, {document.id for document in documents[:4]})
+    
+    def test_update_then_search_on_wrapped_ivf_index(self):
+        """حذف در IVF پشت تبدیل PCA نباید ID ردیف‌های بعدی را جابجا کند"""
+        self.service.rebuild_index(factory='PCA16,IVF{nlist},Flat')
+        self.assertTrue(self.service.index.stores_ids)
+        documents = list(Document.objects.order_by('id'))
+        self.service.apply_changes([], [document.id for document in documents[:5]])
+        
+        document = documents[20]
+        document.content = 'completely different words'
+        document.save()
+        self.service.apply_changes([Document.objects.get(id=document.id)], [])
+        
+        self.assertEqual(self.service.index.ntotal, 35)
+        for expected in documents[10:15] + [document]:
+            results = self.service.search_similar(f'{expected.title}\n{expected.content}', 1)
+            self.assertEqual([result.id for result in results], [expected.id])
+    
+    def test_query_embeddings_and_results_are_cached_per_index_version(self):
+        encode = mock.patch.object(
+            self.service.embedding_model, 'encode', wraps=self.service.embedding_model.encode
+        )
+        with encode as encode_mock:
+            first = self.service.search_similar('alpha1 beta', 5)
+            second = self.service.search_similar('  alpha1   beta ', 5)
+        self.assertEqual(encode_mock.call_count, 1)
+        self.assertEqual([doc.id for doc in second], [doc.id for doc in first])
+        self.assertEqual(self.service.result_cache.info()['hits'], 1)
+        
+        document = Document.objects.order_by('-id').first()
+        self.assertNotIn(document.id, [doc.id for doc in first])
+        document.content = 'alpha1 beta alpha1 beta'
+        document.save()
+        self.service.apply_changes([Document.objects.get(id=document.id)], [])
+        
+        # نسخه جدید index نتایج cache شده را باطل می‌کند، ولی embedding query دوباره ساخته نمی‌شود
+        with encode as encode_mock:
+            results = self.service.search_similar('alpha1 beta', 5)
+        encode_mock.assert_not_called()
+        self.assertEqual(results[0].id, document.id)
+    
+    def test_batch_search_endpoint_matches_single_queries(self):
+        queries = [{'query': 'alpha1 beta', 'limit': 3}, {'query': 'gamma2', 'limit': 5}, {'query': 'alpha1 beta'}]
+        expected = [
+            [doc.id for doc in self.service.search_similar(item['query'], item.get('limit', 5))]
+            for item in queries
+        ]
+        self.service.query_embedding_cache.clear()
+        self.service.result_cache.clear()
+        
+        with mock.patch('documents.views.get_search_service', return_value=self.service), \
+                mock.patch.object(self.service.embedding_model, 'encode',
+                                  wraps=self.service.embedding_model.encode) as encode:
+            response = self.client.post(
+                '/api/documents/search/batch/', {'queries': queries, 'view': 'summary', 'fields': ['id']},
+                content_type='application/json',
+            )
+        
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual([item['query'] for item in body['results']], [item['query'] for item in queries])
+        self.assertEqual([[doc['id'] for doc in item['results']] for item in body['results']], expected)
+        self.assertEqual([item['count'] for item in body['results']], [3, 5, 5])
+        # یک فراخوانی encode برای تمام query های متفاوت
+        self.assertEqual(encode.call_count, 1)
+        self.assertEqual(len(encode.call_args.args[0]), 2)
+    
+    def test_int8_stored_embeddings_rebuild_without_encoding(self):
+        from documents.models import DocumentChunk
+        
+        self.assertEqual(self.service.convert_stored_embeddings('int8'), 40)
+        self.assertEqual(self.service.convert_stored_embeddings('int8'), 0)
+        sizes = set(len(embedding) for embedding in DocumentChunk.objects.values_list('embedding', flat=True))
+        self.assertEqual(sizes, {HashingEncoder.dimension + 4})
+        
+        with mock.patch.object(self.service.embedding_model, 'encode') as encode:
+            self.service.rebuild_index(factory='SQ8')
+        encode.assert_not_called()
+        self.assertEqual(self.service.index.metric, 'cosine')
+        for document in Document.objects.order_by('id')[:5]:
+            results = self.service.search_similar(f'{document.title}\n{document.content}', 1)
+            self.assertEqual([result.id for result in results], [document.id])
+            self.assertAlmostEqual(results[0].score, 1.0, places=1)
+    
+    @override_settings(SEARCH_RERANK_CANDIDATES=5)
+    def test_rerank_reorders_only_the_candidate_pool(self):
+        class TitleNumberReranker:
+            """امتیاز هر قطعه شماره عنوان سند آن است"""
+            
+            def __init__(self):
+                self.texts = []
+            
+            def score(self, query, texts, deadline=None):
+                self.texts += texts
+                return [float(text.split('\n')[0].split()[-1]) for text in texts]
+        
+        query = 'alpha1 beta gamma1'
+        semantic = self.service.search_similar(query, 10, rerank=False)
+        self.service.reranker = TitleNumberReranker()
+        timings = {}
+        reranked = self.service.search_similar(query, 10, rerank=True, timings=timings)
+        
+        head = sorted(semantic[:5], key=lambda doc: int(doc.title.split()[-1]), reverse=True)
+        self.assertEqual([doc.id for doc in reranked], [doc.id for doc in head + semantic[5:]])
+        self.assertEqual([doc.score for doc in reranked[:5]], [float(doc.title.split()[-1]) for doc in head])
+        self.assertTrue(timings['reranked'])
+        self.assertEqual({text.split('\n')[0] for text in self.service.reranker.texts}, {doc.title for doc in head})
+        
+        # صفحه‌های داخل مجموعه نامزد از همان رتبه‌بندی cache شده ساخته می‌شوند
+        self.service.reranker.texts = []
+        pages = self.service.search_similar(query, 3, rerank=True) + self.service.search_similar(
+            query, 2, offset=3, rerank=True
+        )
+        self.assertEqual([doc.id for doc in pages], [doc.id for doc in reranked[:5]])
+        self.assertEqual(len(self.service.reranker.texts), 5)
+    
+    def test_rerank_over_budget_keeps_semantic_order(self):
+        query = 'alpha1 beta gamma1'
+        semantic = self.service.search_similar(query, 10, rerank=False)
+        self.service.reranker = mock.Mock()
+        self.service.reranker.score.return_value = None
+        timings = {}
+        
+        results = self.service.search_similar(query, 10, rerank=True, timings=timings)
+        self.assertEqual([doc.id for doc in results], [doc.id for doc in semantic])
+        self.assertFalse(timings['reranked'])
+        self.assertIsNotNone(self.service.reranker.score.call_args.kwargs['deadline'])
+    
+    def _search(self, **data):
+        with mock.patch('documents.views.get_search_service', return_value=self.service):
+            return self.client.post('/api/documents/search/', data, content_type='application/json')
+    
+    def test_search_pages_follow_cursor_with_scores(self):
+        query = {'query': 'alpha1 beta gamma1', 'search_type': 'semantic'}
+        full = self._search(limit=12, **query).json()
+        scores = [result['score'] for result in full['results']]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+        
+        ids = []
+        page = self._search(limit=4, **query).json()
+        for _ in range(3):
+            self.assertEqual(page['offset'], len(ids))
+            ids += [result['id'] for result in page['results']]
+            page = self._search(limit=4, cursor=page['next_cursor'], **query).json()
+        self.assertEqual(ids, [result['id'] for result in full['results']])
+        
+        response = self._search(limit=4, cursor=page['next_cursor'], query='other query', search_type='semantic')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.json())
+    
+    def test_min_score_drops_weaker_results(self):
+        full = self._search(query='alpha1 beta gamma1', limit=20).json()['results']
+        threshold = full[2]['score']
+        
+        results = self._search(query='alpha1 beta gamma1', limit=20, min_score=threshold).json()['results']
+        self.assertEqual(results, [result for result in full if result['score'] >= threshold])
+        self.assertLess(len(results), len(full))
+    
+    @override_settings(SEARCH_HYBRID_CANDIDATES=3, SEARCH_RRF_K=60)
+    def test_hybrid_search_fuses_semantic_and_lexical_rankings(self):
+        from documents import lexical
+        
+        if not lexical.is_available():
+            self.skipTest('FTS5 table not available')
+        both = Document.objects.create(title='hybrid', content='zebra crossing')
+        lexical_only = Document.objects.create(title='lexical', content='zebra')
+        self.service.apply_changes([both, lexical_only], [])
+        # سندی که فقط در BM25 پیدا می‌شود قطعه‌های خود را از embedding های ذخیره شده می‌گیرد
+        self.service.apply_changes([], [lexical_only.id])
+        
+        results = self.service.search_hybrid('zebra crossing', 3)
+        self.assertEqual(results[0].id, both.id)
+        self.assertAlmostEqual(results[0].score, 2 / 61)
+        self.assertEqual(results[2].id, lexical_only.id)
+        self.assertAlmostEqual(results[2].score, 1 / 62)
+        self.assertTrue(results[2].matched_passages)
+    
+    @override_settings(SEARCH_BATCH_MAX_QUERIES=2)
+    def test_batch_search_rejects_too_many_queries(self):
+        response = self.client.post(
+            '/api/documents/search/batch/', {'queries': [{'query': f'q{i}'} for i in range(3)]},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('queries', response.json())
+    
+    def test_rebuild_keeps_changes_committed_during_rebuild(self):
+        """تغییرات ثبت شده توسط worker صف در حین rebuild نباید با snapshot جدید از بین بروند"""
+        from documents.indexing import process_queue
+        from documents.services import DocumentSearchService
+        
+        worker = DocumentSearchService()
+        documents = list(Document.objects.order_by('id')[:2])
+        edited, deleted = documents
+        iter_batches = self.service._iter_document_batches
+        
+        def batches_with_concurrent_changes(*args):
+            for number, batch in enumerate(iter_batches(*args)):
+                yield batch
+                if number == 0:
+                    edited.content = 'completely different words'
+                    edited.save()
+                    deleted.delete()
+                    process_queue(worker)
+        
+        with mock.patch.object(self.service, '_iter_document_batches', side_effect=batches_with_concurrent_changes):
+            self.service.rebuild_index(batch_size=10)
+        
+        for service in (self.service, DocumentSearchService()):
+            self.assertEqual(service.index.ntotal, 39)
+            self.assertNotIn(deleted.id, service.document_ids)
+            results = service.search_similar(f'{edited.title}\ncompletely different words', 1)
+            self.assertEqual([result.id for result in results], [edited.id])
+    
+    def test_filter_columns_are_refreshed_incrementally(self):
+        """پس از تغییر index فقط اسناد تغییر یافته برای ستون‌های فیلتر خوانده می‌شوند"""
+        from django.contrib.auth.models import User
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from documents.filtering import SearchFilters
+        
+        user = User.objects.create(username='author')
+        filters = SearchFilters(created_by=user.id)
+        self.assertEqual(self.service.search_similar('alpha1 beta', 10, filters=filters), [])
+        
+        document = Document.objects.order_by('id').first()
+        document.created_by = user
+        document.content += ' edited'
+        document.save()
+        self.service.apply_changes([document], [])
+        
+        with CaptureQueriesContext(connection) as queries:
+            results = self.service.search_similar('alpha1 beta', 10, filters=filters)
+        self.assertEqual([result.id for result in results], [document.id])
+        column_queries = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT "documents_document"."id", "documents_document"."created_at"')
+        ]
+        self.assertEqual(len(column_queries), 1)
+        self.assertIn('"updated_at" >=', column_queries[0])
+    
+    @override_settings(SEARCH_INDEX_MAX_DELETED_RATIO=0.1)
+    def test_index_is_rebuilt_when_too_many_vectors_are_deleted(self):
+        self.service.rebuild_index(factory='HNSW32')
+        deleted = list(Document.objects.order_by('id').values_list('id', flat=True)[:5])
+        self.service.apply_changes([], deleted)
+        
+        self.assertEqual(self.service.index.deleted_count, 0)
+        self.assertEqual(self.service.index.ntotal, 35)
+        self.assertEqual(self.service.index.describe(), 'IndexHNSWFlat (cosine)')
+
+
+class AsyncViewTests(SimpleTestCase):
+    def setUp(self):
+        search = mock.patch('documents.async_views.search_response', return_value={'results': [], 'count': 0})
+        self.search_response = search.start()
+        self.addCleanup(search.stop)
+    
+    async def test_async_search_runs_in_executor(self):
+        response = await self.async_client.post(
+            '/api/documents/search/async/', {'query': 'alpha'}, content_type='application/json'
+        )
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'results': [], 'count': 0})
+        self.assertEqual(self.search_response.call_args.args[0]['query'], 'alpha')
+    
+    async def test_async_views_apply_drf_permissions(self):
+        from rest_framework.permissions import IsAuthenticated
+        from rest_framework.views import APIView
+        
+        # کلاس‌های پیش‌فرض DRF هنگام import روی APIView ثبت می‌شوند، نه در زمان درخواست
+        with mock.patch.object(APIView, 'permission_classes', [IsAuthenticated]):
+            for url in ('/api/documents/search/async/', '/api/documents/ask/async/'):
+                response = await self.async_client.post(url, {'query': 'alpha'}, content_type='application/json')
+                self.assertEqual(response.status_code, 403)
+        self.search_response.assert_not_called()
+    
+    async def test_async_views_apply_drf_throttling(self):
+        from django.core.cache import cache
+        from rest_framework.throttling import AnonRateThrottle
+        from rest_framework.views import APIView
+        
+        class OncePerMinute(AnonRateThrottle):
+            rate = '1/min'
+        
+        await cache.aclear()
+        url = '/api/documents/search/async/'
+        with mock.patch.object(APIView, 'throttle_classes', [OncePerMinute]):
+            first = await self.async_client.post(url, {'query': 'alpha'}, content_type='application/json')
+            second = await self.async_client.post(url, {'query': 'alpha'}, content_type='application/json')
+        
+        self.assertEqual((first.status_code, second.status_code), (200, 429))
+    
+    def test_executor_closes_database_connections(self):
+        from documents.async_views import DatabaseThreadPoolExecutor
+        
+        with mock.patch('documents.async_views.close_old_connections') as close_old_connections:
+            with DatabaseThreadPoolExecutor(max_workers=1) as executor:
+                self.assertEqual(executor.submit(sum, [1, 2]).result(), 3)
+        self.assertEqual(close_old_connections.call_count, 2)
+
+
+class AskStreamTests(SimpleTestCase):
+    def setUp(self):
+        from documents.llms import StubLLM
+        from documents.services import QAService
+        
+        qa_service = QAService.__new__(QAService)
+        qa_service.llm = StubLLM(answer='first second third')
+        prepared = (None, [], 'answer-key', 'prompt', {'prompt_tokens': 1})
+        for target, kwargs in (
+            ('documents.views.get_qa_service', {'return_value': qa_service}),
+            ('documents.services.set_cached_answer', {}),
+        ):
+            patcher = mock.patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(QAService, '_prepare', return_value=prepared)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def _events(self, body):
+        events = []
+        for block in body.decode().strip().split('\n\n'):
+            event, data = block.split('\n')
+            events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+    
+    def _assert_answer_events(self, events):
+        self.assertEqual([event for event, _ in events], ['documents', 'token', 'token', 'token', 'done'])
+        self.assertEqual(''.join(payload for event, payload in events if event == 'token'), 'first second third')
+        self.assertEqual(events[-1][1]['usage'], {'prompt_tokens': 1})
+    
+    def test_stream_under_wsgi(self):
+        response = self.client.post('/api/documents/ask/stream/', {'question': 'q'}, content_type='application/json')
+        
+        self.assertFalse(response.is_async)
+        self._assert_answer_events(self._events(b''.join(response.streaming_content)))
+    
+    async def test_stream_under_asgi_uses_async_generator(self):
+        response = await self.async_client.post(
+            '/api/documents/ask/stream/', {'question': 'q'}, content_type='application/json'
+        )
+        
+        # Django روی ASGI فقط iterator های async را بدون buffer کردن ارسال می‌کند
+        self.assertTrue(response.is_async)
+        body = b''.join([part async for part in response.streaming_content])
+        self._assert_answer_events(self._events(body))
+
+
+@override_settings(QA_ANSWER_CACHE_ALIAS='default', QA_CONTEXT_WINDOW=0)
+class AnswerCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import caches
+        from documents.context import token_counter
+        from documents.llms import StubLLM
+        from documents.services import QAService
+        
+        caches['default'].clear()
+        self.document = Document.objects.create(title='doc', content='alpha beta gamma')
+        self.qa_service = QAService.__new__(QAService)
+        self.qa_service.llm = StubLLM(answer='cached answer')
+        self.qa_service.count_tokens = token_counter(self.qa_service.llm)
+        self.qa_service.search_service = mock.Mock()
+        self.qa_service.search_service.search_similar.side_effect = lambda *args, **kwargs: list(
+            Document.objects.all()
+        )
+    
+    def _ask(self, question):
+        with mock.patch.object(self.qa_service.llm, 'invoke', wraps=self.qa_service.llm.invoke) as invoke:
+            result = self.qa_service.ask(question)
+        return result, invoke.call_count
+    
+    def test_answer_is_reused_for_same_question_and_documents(self):
+        result, calls = self._ask('what is alpha?')
+        self.assertEqual((result.answer, result.cached, calls), ('cached answer', False, 1))
+        
+        result, calls = self._ask('  what is   alpha? ')
+        self.assertEqual((result.answer, result.cached, calls), ('cached answer', True, 0))
+        self.assertEqual(result.documents, [self.document])
+    
+    def test_editing_document_or_changing_llm_invalidates_answer(self):
+        self._ask('what is alpha?')
+        
+        self.document.content += ' edited'
+        self.document.save()
+        result, calls = self._ask('what is alpha?')
+        self.assertEqual((result.cached, calls), (False, 1))
+        
+        self.qa_service.llm.model = 'other'
+        result, calls = self._ask('what is alpha?')
+        self.assertEqual((result.cached, calls), (False, 1))
+        
+        result = self.qa_service.ask('what is alpha?', use_cache=False)
+        self.assertFalse(result.cached)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    def test_lone_item_does_not_wait_for_batch(self):
+        from documents.batching import MicroBatcher
+        
+        batcher = MicroBatcher(lambda items: [item * 2 for item in items], max_wait_ms=60000)
+        self.assertEqual(batcher.run(21, timeout=5), 42)
+        self.assertEqual(batcher.info()['batches'], 1)
+    
+    def test_items_queued_during_a_batch_are_processed_together(self):
+        import threading
+        from documents.batching import MicroBatcher
+        
+        started, release = threading.Event(), threading.Event()
+        batches = []
+        
+        def process_batch(items):
+            batches.append(items)
+            started.set()
+            release.wait(5)
+            return [item * 2 for item in items]
+        
+        batcher = MicroBatcher(process_batch, max_batch_size=4, max_wait_ms=1000)
+        first = batcher.submit(0)
+        self.assertTrue(started.wait(5))
+        futures = [batcher.submit(item) for item in range(1, 6)]
+        release.set()
+        
+        self.assertEqual(first.result(5), 0)
+        self.assertEqual([future.result(5) for future in futures], [2, 4, 6, 8, 10])
+        self.assertEqual(batches, [[0], [1, 2, 3, 4], [5]])
+    
+    def test_error_is_returned_to_every_item_of_the_batch(self):
+        import threading
+        from documents.batching import MicroBatcher
+        
+        release = threading.Event()
+        
+        def process_batch(items):
+            release.wait(5)
+            raise RuntimeError('encode failed')
+        
+        batcher = MicroBatcher(process_batch, max_wait_ms=50)
+        futures = [batcher.submit(item) for item in range(3)]
+        release.set()
+        for future in futures:
+            with self.assertRaisesMessage(RuntimeError, 'encode failed'):
+                future.result(5)
+
+
+class LexicalSearchTests(TestCase):
+    def setUp(self):
+        from documents import lexical
+        
+        if not lexical.is_available():
+            self.skipTest('FTS5 table not available')
+    
+    def test_bm25_matches_normalized_persian_text(self):
+        from documents import lexical
+        
+        arabic = Document.objects.create(title='مقاله', content='كتاب‌های علمي')
+        Document.objects.create(title='دیگر', content='متن بی‌ربط')
+        
+        results = lexical.search_documents('کتاب علمی', 10)
+        self.assertEqual([doc.id for doc in results], [arabic.id])
+        self.assertGreater(results[0].score, 0)
+    
+    def test_title_match_and_term_frequency_rank_higher(self):
+        from documents import lexical
+        
+        in_content = Document.objects.create(title='other', content='alpha beta gamma')
+        in_title = Document.objects.create(title='alpha', content='other beta gamma')
+        repeated = Document.objects.create(title='other', content='alpha alpha alpha')
+        
+        hits = lexical.search('alpha', 10)
+        self.assertEqual([doc_id for doc_id, _ in hits], [repeated.id, in_title.id, in_content.id])
+        self.assertEqual(lexical.search('alpha', 10, offset=1), hits[1:])
+        self.assertEqual(lexical.search_documents('alpha', 10, min_score=hits[1][1]), [repeated, in_title])
+    
+    def test_deleted_document_is_removed_from_index(self):
+        from documents import lexical
+        
+        document = Document.objects.create(title='alpha', content='beta')
+        document.delete()
+        self.assertEqual(lexical.search('alpha', 10), [])
+    
+    def test_filters_apply_before_the_bm25_limit(self):
+        from django.utils import timezone
+        from documents import lexical
+        from documents.filtering import SearchFilters
+        from documents.models import Tag
+        
+        tag = Tag.objects.create(name='filtered')
+        strong = [Document.objects.create(title='alpha', content='alpha alpha') for _ in range(3)]
+        weak = [Document.objects.create(title='other', content=f'alpha {i}') for i in range(3)]
+        for document in weak:
+            document.tags.add(tag)
+        Document.objects.filter(id=weak[0].id).update(created_at=timezone.now() - timedelta(days=10))
+        
+        filters = SearchFilters(tag_ids=(tag.id,))
+        results = lexical.search_documents('alpha', 2, queryset=filters.queryset())
+        self.assertEqual(len(results), 2)
+        self.assertTrue({doc.id for doc in results} <= {doc.id for doc in weak})
+        
+        filters = SearchFilters(tag_ids=(tag.id,), created_after=timezone.now() - timedelta(days=1))
+        results = lexical.search_documents('alpha', 5, queryset=filters.queryset())
+        self.assertEqual({doc.id for doc in results}, {doc.id for doc in weak[1:]})
+        self.assertNotIn(strong[0], results)
+    
+    def test_reciprocal_rank_fusion(self):
+        from documents.lexical import reciprocal_rank_fusion
+        
+        fused = reciprocal_rank_fusion([[1, 2, 3], [3, 1]], k=60)
+        self.assertEqual([item for item, _ in fused], [1, 3, 2])
+        self.assertAlmostEqual(fused[0][1], 1 / 61 + 1 / 62)
+        self.assertAlmostEqual(fused[2][1], 1 / 62)
+
+
+@override_settings(SEARCH_SNIPPET_LENGTH=40)
+class ResultSerializationTests(TestCase):
+    def setUp(self):
+        self.document = Document.objects.create(title='doc', content='<b>intro</b> ' + 'filler ' * 20 + 'alpha end')
+        self.document.score = 0.5
+    
+    def test_summary_view_returns_highlighted_snippet(self):
+        from documents.serializers import serialize_results
+        
+        self.document.matched_passages = ['a <i>matched</i> passage: Alpha']
+        result, = serialize_results([self.document], 'alpha', 'summary')
+        self.assertEqual(set(result), {'id', 'title', 'score', 'snippet'})
+        self.assertEqual(result['snippet'], 'a &lt;i&gt;matched&lt;/i&gt; passage: <mark>Alpha</mark>')
+    
+    def test_summary_snippet_without_passages_starts_near_match(self):
+        from documents.serializers import serialize_results
+        
+        result, = serialize_results([self.document], 'alpha', 'summary')
+        self.assertTrue(result['snippet'].startswith('…'))
+        self.assertIn('<mark>alpha</mark> end', result['snippet'])
+        self.assertNotIn('intro', result['snippet'])
+    
+    def test_fields_limit_full_and_summary_results(self):
+        from documents.serializers import serialize_results
+        
+        full, = serialize_results([self.document], 'alpha')
+        self.assertEqual((full['content'], full['score']), (self.document.content, 0.5))
+        self.assertEqual(
+            serialize_results([self.document], 'alpha', 'full', ['id', 'score']),
+            [{'id': self.document.id, 'score': 0.5}],
+        )
+        self.assertEqual(serialize_results([self.document], 'alpha', 'summary', ['title']), [{'title': 'doc'}])
+    
+    def test_unknown_or_write_only_fields_are_rejected(self):
+        for view, fields in (('summary', ['content']), ('full', ['tag_ids']), ('full', ['missing'])):
+            response = self.client.post(
+                '/api/documents/search/', {'query': 'alpha', 'view': view, 'fields': fields},
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('fields', response.json())
+
+
+class BulkImportTests(TestCase):
+    def test_bulk_endpoint_creates_tagged_documents_and_queues_them(self):
+        from documents import lexical
+        from documents.models import IndexingTask, Tag
+        
+        existing = Tag.objects.create(name='existing')
+        documents = [
+            {'title': 'first', 'content': 'alpha text', 'tags': ['new', 'existing']},
+            {'title': 'second', 'content': 'beta text', 'tag_ids': [existing.id]},
+            {'title': 'third', 'content': 'gamma text'},
+        ]
+        response = self.client.post('/api/documents/bulk/', {'documents': documents}, content_type='application/json')
+        
+        self.assertEqual(response.status_code, 201)
+        ids = response.json()['ids']
+        self.assertEqual(response.json()['created'], 3)
+        created = Document.objects.in_bulk(ids)
+        self.assertEqual([created[doc_id].title for doc_id in ids], ['first', 'second', 'third'])
+        self.assertEqual(sorted(created[ids[0]].tags.values_list('name', flat=True)), ['existing', 'new'])
+        self.assertEqual(list(created[ids[1]].tags.all()), [existing])
+        self.assertEqual(sorted(IndexingTask.objects.values_list('document_id', flat=True)), sorted(ids))
+        if lexical.is_available():
+            self.assertEqual([doc_id for doc_id, _ in lexical.search('beta', 10)], [ids[1]])
+    
+    @override_settings(DOCUMENT_BULK_MAX_DOCUMENTS=2)
+    def test_bulk_endpoint_validates_size_and_tags(self):
+        for documents in (
+            [{'title': f'doc {i}', 'content': 'text'} for i in range(3)],
+            [{'title': 'doc', 'content': 'text', 'tag_ids': [999]}],
+        ):
+            response = self.client.post(
+                '/api/documents/bulk/', {'documents': documents}, content_type='application/json'
+            )
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Document.objects.exists())
+    
+    def test_import_records_in_batches_skips_incomplete_records(self):
+        from documents.importing import import_records
+        
+        records = [{'title': f'doc {i}', 'content': 'text' if i != 2 else ' '} for i in range(5)]
+        progress = mock.Mock()
+        result = import_records(records, batch_size=2, progress=progress)
+        
+        self.assertEqual((result.created, result.skipped), (4, 1))
+        self.assertEqual([call.args for call in progress.call_args_list], [(2, 0), (3, 1), (4, 1)])
+        self.assertEqual(Document.objects.count(), 4)
+    
+    def test_import_documents_command_reads_jsonl_csv_and_directories(self):
+        from io import StringIO
+        
+        from django.core.management import call_command
+        from documents.models import IndexingTask
+        
+        source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source, ignore_errors=True)
+        with open(os.path.join(source, 'docs.jsonl'), 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'title': 'json doc', 'content': 'from jsonl', 'tags': ['a']}) + '\n')
+        with open(os.path.join(source, 'docs.csv'), 'w', encoding='utf-8') as f:
+            f.write('title,content,tags\ncsv doc,from csv,"a, b"\n')
+        os.mkdir(os.path.join(source, 'texts'))
+        with open(os.path.join(source, 'texts', 'note.md'), 'w', encoding='utf-8') as f:
+            f.write('from a text file')
+        
+        call_command(
+            'import_documents',
+            os.path.join(source, 'docs.jsonl'), os.path.join(source, 'docs.csv'), os.path.join(source, 'texts'),
+            '--defer-indexing', stdout=StringIO(),
+        )
+        
+        documents = {doc.title: doc for doc in Document.objects.all()}
+        self.assertEqual(set(documents), {'json doc', 'csv doc', 'note'})
+        self.assertEqual(sorted(documents['csv doc'].tags.values_list('name', flat=True)), ['a', 'b'])
+        self.assertEqual(documents['note'].content, 'from a text file')
+        self.assertEqual(IndexingTask.objects.count(), 3)
+
+
+class EmbeddingStorageTests(SimpleTestCase):
+    def test_packed_embeddings_round_trip(self):
+        import numpy as np
+        from documents.vector_index import pack_embedding, packed_size, unpack_embedding
+        
+        vector = np.random.default_rng(0).standard_normal(32).astype('float32')
+        for dtype, tolerance in (('float32', 0), ('float16', 1e-2), ('int8', np.abs(vector).max() / 127)):
+            data = pack_embedding(vector, dtype)
+            self.assertEqual(len(data), packed_size(32, dtype))
+            unpacked = unpack_embedding(data, 32)
+            self.assertEqual(unpacked.dtype, np.float32)
+            self.assertLessEqual(np.abs(unpacked - vector).max(), tolerance)
+    
+    def test_unknown_dtype_or_size_is_rejected(self):
+        from documents.vector_index import pack_embedding, unpack_embedding
+        
+        with self.assertRaises(ValueError):
+            pack_embedding([1.0, 2.0], 'int4')
+        with self.assertRaises(ValueError):
+            unpack_embedding(b'\x00' * 10, 32)
+    
+    @unittest.skipUnless(importlib.util.find_spec('faiss'), 'faiss not installed')
+    def test_cosine_index_scores_do_not_depend_on_vector_length(self):
+        import numpy as np
+        from documents.vector_index import build_index
+        
+        index = build_index(2, 'Flat')
+        index.add(np.array([[1, 0], [10, 10]], dtype='float32'), np.array([7, 8]))
+        
+        scores, ids = index.search(np.array([[100, 1]], dtype='float32'), 2)
+        self.assertEqual(ids[0].tolist(), [7, 8])
+        self.assertAlmostEqual(float(scores[0][0]), 100 / np.hypot(100, 1), places=5)
+        self.assertAlmostEqual(float(scores[0][1]), 101 / np.hypot(100, 1) / np.sqrt(2), places=5)
+
+
+class RerankerTests(SimpleTestCase):
+    def _reranker(self, predict, batch_size=2):
+        from documents.reranking import CrossEncoderReranker
+        
+        reranker = CrossEncoderReranker.__new__(CrossEncoderReranker)
+        reranker.batch_size = batch_size
+        reranker.model = mock.Mock()
+        reranker.model.predict.side_effect = predict
+        return reranker
+    
+    def test_scores_are_computed_in_batches(self):
+        reranker = self._reranker(lambda pairs, **kwargs: [len(text) for _, text in pairs])
+        
+        scores = reranker.score('query', ['a', 'bb', 'ccc', 'dddd', 'eeeee'])
+        self.assertEqual(scores.tolist(), [1, 2, 3, 4, 5])
+        self.assertEqual(reranker.model.predict.call_count, 3)
+    
+    def test_scoring_stops_when_next_batch_would_miss_deadline(self):
+        import time
+        
+        def slow_predict(pairs, **kwargs):
+            time.sleep(0.05)
+            return [0.0] * len(pairs)
+        
+        reranker = self._reranker(slow_predict)
+        self.assertIsNone(reranker.score('query', ['text'] * 6, deadline=time.perf_counter() + 0.07))
+        self.assertEqual(reranker.model.predict.call_count, 1)
@@ -1,13 +1,20 @@
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'documents'
 
 urlpatterns = [
     path('documents/', views.DocumentListCreateView.as_view(), name='document-list'),
+    path('documents/bulk/', views.BulkDocumentCreateView.as_view(), name='document-bulk-create'),
     path('documents/<int:pk>/', views.DocumentDetailView.as_view(), name='document-detail'),
     path('documents/search/', views.DocumentSearchView.as_view(), name='document-search'),
+    path('documents/search/batch/', views.BatchDocumentSearchView.as_view(), name='document-search-batch'),
+    path('documents/search/cache/', views.SearchCacheStatsView.as_view(), name='search-cache-stats'),
     path('documents/ask/', views.AskQuestionView.as_view(), name='ask-question'),
+    path('documents/ask/stream/', views.AskQuestionStreamView.as_view(), name='ask-question-stream'),
+    # نسخه‌های async برای اجرا روی ASGI
+    path('documents/search/async/', async_views.AsyncDocumentSearchView.as_view(), name='document-search-async'),
+    path('documents/ask/async/', async_views.AsyncAskQuestionView.as_view(), name='ask-question-async'),
     path('tags/', views.TagListView.as_view(), name='tag-list'),
 ]
 
@@ -0,0 +1,481 @@
+"""
+ساخت، ذخیره و بارگذاری index های FAISS
+
+نوع index با تنظیم SEARCH_INDEX_FACTORY (رشته index_factory در FAISS) انتخاب
+می‌شود، مثلاً:
+    Flat              جستجوی کامل و دقیق (پیش‌فرض)
+    HNSW32            گراف HNSW، سریع و بدون نیاز به آموزش
+    IVF{nlist},Flat   inverted file؛ nlist در صورت استفاده از {nlist} خودکار تعیین می‌شود
+    IVF{nlist},PQ32   inverted file با فشرده‌سازی product quantization
+    SQ8 / SQfp16      scalar quantization هر مؤلفه به 8 یا 16 بیت (حافظه 4 یا 2 برابر کمتر)؛
+                      قابل ترکیب با بقیه، مثلاً HNSW32,SQ8 یا IVF{nlist},SQ8
+
+معیار شباهت با تنظیم SEARCH_INDEX_METRIC انتخاب می‌شود: cosine (پیش‌فرض؛ بردارها
+پیش از افزودن و جستجو نرمال می‌شوند و index از inner product استفاده می‌کند) یا
+l2 (فاصله اقلیدسی روی بردارهای خام). معیار هر index از خود آن خوانده می‌شود،
+بنابراین index های L2 قدیمی تا تبدیل با دستور convert_index درست کار می‌کنند.
+
+factory می‌تواند پیش از index اصلی تبدیل‌هایی مانند PCA یا OPQ داشته باشد
+(مثلاً PCA64,IVF{nlist},Flat)؛ نوع index از index داخل IndexPreTransform تشخیص داده می‌شود.
+
+index های HNSW حذف بردار را پشتیبانی نمی‌کنند؛ ردیف بردارهای حذف شده در آرایه ID ها
+با DELETED_ID علامت می‌خورد و جستجو با IDSelector از آن‌ها صرف‌نظر می‌کند، تا
+index دوباره ساخته شود (SEARCH_INDEX_MAX_DELETED_RATIO).
+
+index روی دیسک به صورت دو فایل ذخیره می‌شود: خود index (بدون IndexIDMap) و یک
+آرایه numpy از ID بردارها. هر دو فایل را می‌توان با memory mapping باز کرد تا
+چند پروسه worker از page cache مشترک استفاده کنند.
+"""
+import math
+import numpy as np
+
+METRIC_COSINE = 'cosine'
+METRIC_L2 = 'l2'
+METRICS = (METRIC_COSINE, METRIC_L2)
+
+# ID ردیف بردارهای حذف شده در index هایی که حذف را پشتیبانی نمی‌کنند
+DELETED_ID = -1
+
+# قالب‌های ذخیره embedding قطعه‌ها در دیتابیس و اندازه هر بردار (بایت) بر حسب بعد
+EMBEDDING_DTYPES = ('float32', 'float16', 'int8')
+
+
+def packed_size(dimension: int, dtype: str) -> int:
+    """اندازه داده ذخیره شده یک بردار با قالب داده شده"""
+    if dtype == 'float32':
+        return dimension * 4
+    if dtype == 'float16':
+        return dimension * 2
+    if dtype == 'int8':
+        # ضریب float32 به همراه یک بایت برای هر مؤلفه
+        return dimension + 4
+    raise ValueError(f"Unknown embedding dtype: {dtype} (expected one of {', '.join(EMBEDDING_DTYPES)})")
+
+
+def pack_embedding(vector, dtype: str = 'float32') -> bytes:
+    """
+    تبدیل یک بردار به bytes برای ذخیره در دیتابیس
+    
+    در قالب int8 هر بردار با ضریب خودش (حداکثر قدر مطلق مؤلفه‌ها / 127) کوانتیزه
+    می‌شود، بنابراین بردارهای نرمال نشده هم قابل ذخیره هستند.
+    """
+    vector = np.asarray(vector, dtype='float32')
+    if dtype == 'float32':
+        return vector.tobytes()
+    if dtype == 'float16':
+        return vector.astype('float16').tobytes()
+    if dtype == 'int8':
+        scale = np.float32(max(float(np.abs(vector).max(initial=0.0)), 1e-12) / 127.0)
+        codes = np.clip(np.rint(vector / scale), -127, 127).astype('int8')
+        return scale.tobytes() + codes.tobytes()
+    raise ValueError(f"Unknown embedding dtype: {dtype} (expected one of {', '.join(EMBEDDING_DTYPES)})")
+
+
+def unpack_embedding(data: bytes, dimension: int):
+    """
+    خواندن بردار float32 از داده ذخیره شده
+    
+    قالب از اندازه داده تشخیص داده می‌شود، بنابراین قطعه‌های ذخیره شده با
+    قالب‌های مختلف (مثلاً پیش و پس از تغییر SEARCH_EMBEDDING_DTYPE) کنار هم خوانده می‌شوند.
+    """
+    size = len(data)
+    if size == dimension * 4:
+        return np.frombuffer(data, dtype='float32')
+    if size == dimension * 2:
+        return np.frombuffer(data, dtype='float16').astype('float32')
+    if size == dimension + 4:
+        scale = np.frombuffer(data, dtype='float32', count=1)[0]
+        return np.frombuffer(data, dtype='int8', offset=4).astype('float32') * scale
+    raise ValueError(f"Stored embedding of {size} bytes does not match dimension {dimension}")
+
+
+def normalize_vectors(vectors):
+    """کپی float32 بردارها با طول واحد (بردارهای صفر تغییر نمی‌کنند)"""
+    vectors = np.asarray(vectors, dtype='float32')
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def faiss_metric(metric: str):
+    """ثابت معیار FAISS متناظر با SEARCH_INDEX_METRIC"""
+    import faiss
+    
+    if metric == METRIC_COSINE:
+        return faiss.METRIC_INNER_PRODUCT
+    if metric == METRIC_L2:
+        return faiss.METRIC_L2
+    raise ValueError(f"Unknown index metric: {metric} (expected one of {', '.join(METRICS)})")
+
+
+def resolve_factory_string(factory: str, num_vectors: int) -> str:
+    """جایگزینی {nlist} با تعداد خوشه متناسب با تعداد بردارها"""
+    if '{nlist}' not in factory:
+        return factory
+    # قاعده رایج: حدود 4*sqrt(N) خوشه، با حداقل 39 نقطه آموزشی برای هر خوشه
+    nlist = int(4 * math.sqrt(max(num_vectors, 1)))
+    nlist = max(1, min(nlist, num_vectors // 39))
+    return factory.replace('{nlist}', str(nlist))
+
+
+def requires_training(dimension: int, factory: str) -> bool:
+    """آیا index ساخته شده با این رشته factory پیش از افزودن بردار نیاز به آموزش دارد"""
+    import faiss
+    
+    # تعداد خوشه فقط روی ساختار index اثر دارد، نه روی نیاز به آموزش
+    return not faiss.index_factory(dimension, resolve_factory_string(factory, 1 << 20)).is_trained
+
+
+def base_index(index):
+    """index اصلی داخل IndexPreTransform (بدون تبدیل‌های PCA/OPQ پیش از آن)"""
+    import faiss
+    
+    while isinstance(index, faiss.IndexPreTransform):
+        index = faiss.downcast_index(index.index)
+    return index
+
+
+def ivf_index(index):
+    """index IVF داخل index (مستقیم یا پشت تبدیل‌ها)، یا None اگر index از نوع IVF نباشد"""
+    import faiss
+    
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def wrap_parameters(index, params):
+    """
+    قرار دادن پارامترهای جستجوی index اصلی داخل SearchParametersPreTransform
+    
+    IndexPreTransform پارامترهای دیگر (از جمله selector) را به index داخلی نمی‌رساند.
+    """
+    import faiss
+    
+    if params is None or not isinstance(index, faiss.IndexPreTransform):
+        return params
+    return faiss.SearchParametersPreTransform(index_params=params)
+
+
+class TrainingSample:
+    """
+    نمونه تصادفی یکنواخت (reservoir sampling) از جریان بردارها برای آموزش index
+    
+    حافظه مصرفی به اندازه نمونه محدود است، نه به تعداد کل بردارها.
+    """
+    
+    def __init__(self, size: int, dimension: int, seed: int = 0):
+        self.size = size
+        self.seen = 0
+        self._data = np.empty((size, dimension), dtype='float32')
+        self._rng = np.random.default_rng(seed)
+    
+    def add(self, vectors):
+        vectors = np.asarray(vectors, dtype='float32')
+        fill = min(len(vectors), self.size - self.seen) if self.seen < self.size else 0
+        if fill:
+            self._data[self.seen:self.seen + fill] = vectors[:fill]
+        rest = vectors[fill:]
+        if len(rest):
+            # بردار شماره n با احتمال size/(n+1) جایگزین یکی از نمونه‌ها می‌شود
+            positions = self._rng.integers(0, np.arange(self.seen + fill, self.seen + len(vectors)) + 1)
+            keep = positions < self.size
+            self._data[positions[keep]] = rest[keep]
+        self.seen += len(vectors)
+    
+    @property
+    def vectors(self):
+        return self._data[:min(self.seen, self.size)]
+
+
+class VectorIndex:
+    """
+    index FAISS به همراه آرایه ID بردارها
+    
+    index های IVF (حتی پشت تبدیل‌هایی مانند PCA) خودشان ID ها را نگه می‌دارند
+    (add_with_ids)؛ حذف در آن‌ها شماره ردیف‌ها را جابجا نمی‌کند. در بقیه انواع،
+    label های FAISS شماره ردیف بردار هستند و با آرایه ids به ID تبدیل می‌شوند.
+    factory رشته factory درخواست شده هنگام ساخت است تا index با همان نوع
+    دوباره ساخته شود. نمونه‌های این کلاس پس از ساخت تغییر نمی‌کنند مگر از طریق copy().
+    """
+    
+    def __init__(self, index, ids=None, path: str = None, mmapped: bool = False, factory: str = None):
+        self.index = index
+        self.ids = np.empty(0, dtype='int64') if ids is None else ids
+        self.path = path
+        self.mmapped = mmapped
+        self.factory = factory
+        self.deleted_count = int(np.count_nonzero(self.ids == DELETED_ID))
+        self._live_selector = None
+    
+    @property
+    def ntotal(self) -> int:
+        """تعداد بردارهای قابل جستجو (بدون بردارهای حذف شده)"""
+        return self.index.ntotal - self.deleted_count
+    
+    @property
+    def live_ids(self):
+        """ID بردارهای قابل جستجو"""
+        if not self.deleted_count:
+            return self.ids
+        return self.ids[self.ids != DELETED_ID]
+    
+    @property
+    def deleted_ratio(self) -> float:
+        """سهم بردارهای حذف شده از کل ردیف‌های index"""
+        return self.deleted_count / self.index.ntotal if self.index.ntotal else 0.0
+    
+    @property
+    def d(self) -> int:
+        return self.index.d
+    
+    @property
+    def stores_ids(self) -> bool:
+        """آیا خود index (مانند IVF) ID بردارها را نگه می‌دارد"""
+        return ivf_index(self.index) is not None
+    
+    @property
+    def supports_removal(self) -> bool:
+        """آیا index از حذف بردار پشتیبانی می‌کند (گراف HNSW پشتیبانی نمی‌کند)"""
+        import faiss
+        
+        return not isinstance(base_index(self.index), faiss.IndexHNSW)
+    
+    def describe(self) -> str:
+        """نام کوتاه نوع index برای گزارش"""
+        return f"{type(self.index).__name__} ({self.metric})"
+    
+    @property
+    def metric(self) -> str:
+        """معیار شباهت index؛ index های inner product روی بردارهای نرمال شده (cosine) کار می‌کنند"""
+        import faiss
+        
+        return METRIC_COSINE if self.index.metric_type == faiss.METRIC_INNER_PRODUCT else METRIC_L2
+    
+    def prepare(self, vectors):
+        """تبدیل بردارها به ورودی index: float32 پیوسته و در index های cosine نرمال شده"""
+        if self.metric == METRIC_COSINE:
+            return normalize_vectors(vectors)
+        return np.ascontiguousarray(vectors, dtype='float32')
+    
+    def scores(self, distances):
+        """
+        تبدیل خروجی search به امتیاز شباهت (بیشتر یعنی شبیه‌تر)
+        
+        در index های cosine خود شباهت کسینوسی (بین -1 و 1) امتیاز است و در
+        index های L2 امتیاز 1/(1 + فاصله) است.
+        """
+        distances = np.asarray(distances, dtype='float32')
+        if self.metric == METRIC_COSINE:
+            return distances
+        return 1.0 / (1.0 + np.maximum(distances, 0.0))
+    
+    def score_vectors(self, vectors, query):
+        """امتیاز شباهت بردارهای داده شده با یک query، با همان معیار فاصله index"""
+        vectors = self.prepare(vectors)
+        query = self.prepare(np.asarray(query)[None, :])[0]
+        if self.metric == METRIC_COSINE:
+            return self.scores(vectors @ query)
+        return self.scores(((vectors - query) ** 2).sum(axis=1))
+    
+    def search(self, queries, k: int, params=None):
+        """
+        جستجوی k نزدیک‌ترین بردار
+        
+        Returns:
+            Tuple شامل فاصله‌ها و ID بردارها (-1 برای خانه‌های خالی)
+        """
+        if self.deleted_count and getattr(getattr(params, 'index_params', params), 'sel', None) is None:
+            ef_search = getattr(getattr(params, 'index_params', params), 'efSearch', None)
+            params = search_parameters(self, ef_search=ef_search, selector=self.live_selector())
+        distances, labels = self.index.search(self.prepare(queries), k, params=params)
+        if self.stores_ids:
+            return distances, labels
+        ids = np.full(labels.shape, -1, dtype='int64')
+        found = labels != -1
+        ids[found] = self.ids[labels[found]]
+        return distances, ids
+    
+    def search_exhaustive(self, queries, k: int, selector=None):
+        """
+        جستجوی k نزدیک‌ترین بردار بین تمام بردارهای انتخاب شده با selector
+        
+        برای فیلترهای محدود که جستجوی تقریبی صفحه کامل برنمی‌گرداند: در IVF همه
+        خوشه‌ها بررسی می‌شوند و در HNSW جستجو روی storage (Flat) گراف انجام می‌شود.
+        """
+        import faiss
+        
+        if selector is None and self.deleted_count:
+            selector = self.live_selector()
+        extra = {'sel': selector} if selector is not None else {}
+        ivf = ivf_index(self.index)
+        if ivf is not None:
+            params = faiss.SearchParametersIVF(nprobe=ivf.nlist, **extra)
+            return self.search(queries, k, wrap_parameters(self.index, params))
+        params = faiss.SearchParameters(**extra) if extra else None
+        inner = base_index(self.index)
+        if isinstance(inner, faiss.IndexHNSW):
+            # ردیف‌های storage همان شماره ردیف‌های گراف هستند؛ تبدیل‌های index روی storage هم اعمال می‌شوند
+            index = storage = faiss.downcast_index(inner.storage)
+            if isinstance(self.index, faiss.IndexPreTransform):
+                index = faiss.IndexPreTransform(storage)
+                for i in reversed(range(self.index.chain.size())):
+                    index.prepend_transform(self.index.chain.at(i))
+                index.referenced_objects = [self.index]
+            return VectorIndex(index, self.ids).search(queries, k, wrap_parameters(index, params))
+        return self.search(queries, k, wrap_parameters(self.index, params))
+    
+    def selector(self, mask):
+        """
+        IDSelector برای محدود کردن جستجو به بردارهای مشخص شده با mask (هم‌ترتیب با ids)
+        
+        index های IVF با ID بردارها (IDSelectorBatch) و بقیه با bitmap شماره ردیف‌ها
+        (IDSelectorBitmap) فیلتر می‌شوند.
+        """
+        import faiss
+        
+        mask = np.asarray(mask, dtype=bool)
+        if self.stores_ids:
+            return faiss.IDSelectorBatch(np.ascontiguousarray(self.ids[mask], dtype='int64'))
+        bitmap = np.packbits(mask, bitorder='little')
+        selector = faiss.IDSelectorBitmap(len(mask), faiss.swig_ptr(bitmap))
+        # selector فقط اشاره‌گر bitmap را نگه می‌دارد
+        selector.referenced_objects = [bitmap]
+        return selector
+    
+    def live_selector(self):
+        """IDSelector تمام بردارهای حذف نشده"""
+        if self._live_selector is None:
+            self._live_selector = self.selector(self.ids != DELETED_ID)
+        return self._live_selector
+    
+    def copy(self) -> 'VectorIndex':
+        """کپی قابل تغییر از index (index های memory-mapped از فایل بازخوانی می‌شوند)"""
+        import faiss
+        
+        if self.mmapped:
+            index = faiss.read_index(self.path)
+        else:
+            index = faiss.clone_index(self.index)
+        return VectorIndex(index, np.array(self.ids, dtype='int64'), factory=self.factory)
+    
+    def add(self, vectors, ids):
+        """افزودن بردارها با ID داده شده"""
+        ids = np.asarray(ids, dtype='int64')
+        vectors = self.prepare(vectors)
+        if self.stores_ids:
+            self.index.add_with_ids(vectors, ids)
+        else:
+            self.index.add(vectors)
+        self.ids = np.concatenate([self.ids, ids])
+        self._live_selector = None
+    
+    def remove(self, ids):
+        """
+        حذف بردارهای با ID داده شده
+        
+        در index هایی که حذف را پشتیبانی نمی‌کنند (HNSW) بردارها فقط با
+        DELETED_ID علامت می‌خورند و در گراف باقی می‌مانند.
+        """
+        import faiss
+        
+        mask = np.isin(self.ids, ids)
+        if not mask.any():
+            return
+        self._live_selector = None
+        if not self.supports_removal:
+            self.ids[mask] = DELETED_ID
+            self.deleted_count += int(mask.sum())
+            return
+        if self.stores_ids:
+            self.index.remove_ids(faiss.IDSelectorBatch(self.ids[mask]))
+        else:
+            # index های Flat پس از حذف ترتیب بقیه ردیف‌ها را حفظ می‌کنند
+            self.index.remove_ids(faiss.IDSelectorBatch(np.nonzero(mask)[0].astype('int64')))
+        self.ids = self.ids[~mask]
+    
+    def save(self, index_path: str, ids_path: str):
+        """ذخیره index و آرایه ID ها"""
+        import faiss
+        
+        faiss.write_index(self.index, index_path)
+        # np.save پسوند .npy را در صورت نبود اضافه می‌کند؛ از فایل باز استفاده می‌شود
+        with open(ids_path, 'wb') as f:
+            np.save(f, np.ascontiguousarray(self.ids, dtype='int64'))
+    
+    @classmethod
+    def load(cls, index_path: str, ids_path: str, mmap: bool = False) -> 'VectorIndex':
+        """
+        بارگذاری index و آرایه ID ها
+        
+        با mmap=True داده بردارها و ID ها فقط خواندنی و memory-mapped بارگذاری
+        می‌شوند و بین پروسه‌ها از طریق page cache به اشتراک گذاشته می‌شوند.
+        """
+        import faiss
+        
+        if not mmap:
+            return cls(faiss.read_index(index_path), np.load(ids_path), path=index_path)
+        
+        # inverted list های IVF و کدهای index های Flat با flag های متفاوتی map می‌شوند
+        with open(index_path, 'rb') as f:
+            fourcc = f.read(4)
+        if fourcc.startswith(b'Iw'):
+            flags = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+        else:
+            flags = faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+        index = faiss.read_index(index_path, flags)
+        return cls(index, np.load(ids_path, mmap_mode='r'), path=index_path, mmapped=True)
+
+
+def build_index(dimension: int, factory: str, training_vectors=None, metric: str = METRIC_COSINE) -> VectorIndex:
+    """
+    ساخت index خالی بر اساس رشته factory و معیار شباهت
+    
+    index هایی که نیاز به آموزش دارند با training_vectors آموزش داده می‌شوند.
+    اگر داده کافی برای آموزش وجود نداشته باشد، index دقیق Flat ساخته می‌شود؛
+    factory درخواست شده در هر صورت روی VectorIndex ثبت می‌شود.
+    """
+    import faiss
+    
+    metric_type = faiss_metric(metric)
+    num_vectors = 0 if training_vectors is None else len(training_vectors)
+    requested = factory
+    factory = resolve_factory_string(factory, num_vectors)
+    
+    try:
+        index = faiss.index_factory(dimension, factory, metric_type)
+        if not index.is_trained:
+            if not num_vectors:
+                raise ValueError("no training vectors available")
+            index.train(VectorIndex(index).prepare(training_vectors))
+    except Exception as e:
+        if num_vectors:
+            print(f"Warning: Could not build '{factory}' index ({e}). Falling back to Flat index.")
+        index = faiss.IndexFlat(dimension, metric_type)
+    
+    return VectorIndex(index, factory=requested)
+
+
+def search_parameters(index: VectorIndex, nprobe: int = None, ef_search: int = None, selector=None):
+    """
+    ساخت پارامترهای جستجو متناسب با نوع index
+    
+    nprobe برای index های IVF و ef_search برای HNSW استفاده می‌شوند و selector
+    (از VectorIndex.selector) جستجو را به بخشی از بردارها محدود می‌کند؛
+    اگر پارامتری لازم نباشد None برمی‌گردد.
+    """
+    import faiss
+    
+    inner = base_index(index.index)
+    ivf = ivf_index(index.index)
+    extra = {'sel': selector} if selector is not None else {}
+    # پارامترهای ساخته شده مقادیر پیش‌فرض خود را دارند، نه مقادیر تنظیم شده روی index
+    if ivf is not None and (nprobe or extra):
+        params = faiss.SearchParametersIVF(nprobe=min(nprobe or ivf.nprobe, ivf.nlist), **extra)
+    elif isinstance(inner, faiss.IndexHNSW) and (ef_search or extra):
+        params = faiss.SearchParametersHNSW(efSearch=ef_search or inner.hnsw.efSearch, **extra)
+    elif extra:
+        params = faiss.SearchParameters(**extra)
+    else:
+        return None
+    return wrap_parameters(index.index, params)
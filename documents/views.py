@@ -1,51 +1,93 @@
+import asyncio
+import json
+import time
+
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from django.db.models import Q
 from django.conf import settings
+from . import lexical
+from .filtering import SearchFilters
+from .importing import import_records
+from .indexing import enqueue_documents
 from .models import Document, Tag
+from .pagination import DocumentCursorPagination
 from .serializers import (
     DocumentSerializer,
     TagSerializer,
     DocumentSearchSerializer,
-    QuestionSerializer
+    BatchSearchSerializer,
+    BulkDocumentSerializer,
+    QuestionSerializer,
+    serialize_results,
+    encode_search_cursor
 )
-from .services import DocumentSearchService, QAService
-
+# سرویس‌ها از registry مشترک پروسه دریافت می‌شوند
+from .registry import get_search_service, get_qa_service
 
-# ایجاد instance های singleton برای سرویس‌ها
-_search_service = None
-_qa_service = None
 
+class DocumentListCreateView(generics.ListCreateAPIView):
+    """
+    نمایش لیست و ایجاد سند جدید
+    
+    لیست با cursor روی (created_at، id) صفحه‌بندی می‌شود و پاسخ فیلد count ندارد
+    (DocumentCursorPagination)؛ با include_content=false متن کامل اسناد از دیتابیس
+    خوانده و برگردانده نمی‌شود.
+    """
+    queryset = Document.objects.with_related()
+    serializer_class = DocumentSerializer
+    pagination_class = DocumentCursorPagination
 
-def get_search_service():
-    """دریافت instance سرویس جستجو (singleton)"""
-    global _search_service
-    if _search_service is None:
-        _search_service = DocumentSearchService()
-    return _search_service
-
+    def include_content(self) -> bool:
+        return self.request.query_params.get('include_content', 'true').lower() not in ('false', '0')
 
-def get_qa_service():
-    """دریافت instance سرویس Q&A (singleton)"""
-    global _qa_service
-    if _qa_service is None:
-        _qa_service = QAService()
-    return _qa_service
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method == 'GET' and not self.include_content():
+            queryset = queryset.defer('content')
+        return queryset
 
-
-class DocumentListCreateView(generics.ListCreateAPIView):
-    """نمایش لیست و ایجاد سند جدید"""
-    queryset = Document.objects.all()
-    serializer_class = DocumentSerializer
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == 'GET' and not self.include_content():
+            kwargs['fields'] = [name for name in DocumentSerializer.Meta.fields if name != 'content']
+        return super().get_serializer(*args, **kwargs)
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user if self.request.user.is_authenticated else None)
 
 
+class BulkDocumentCreateView(APIView):
+    """
+    ایجاد دسته‌ای اسناد
+    
+    اسناد با bulk_create در دسته‌ها ذخیره می‌شوند و به جای index شدن تک‌تک با
+    signal ها، با یک insert دسته‌ای در صف index قرار می‌گیرند.
+    """
+    
+    def post(self, request):
+        serializer = BulkDocumentSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        result = import_records(
+            serializer.validated_data['documents'],
+            created_by=request.user if request.user.is_authenticated else None,
+        )
+        enqueue_documents(result.document_ids)
+        
+        return Response({
+            'created': result.created,
+            'ids': result.document_ids,
+            'elapsed_ms': result.elapsed * 1000,
+            'indexing': 'queued',
+        }, status=status.HTTP_201_CREATED)
+
+
 class DocumentDetailView(generics.RetrieveUpdateDestroyAPIView):
     """نمایش، ویرایش و حذف یک سند"""
-    queryset = Document.objects.all()
+    queryset = Document.objects.with_related()
     serializer_class = DocumentSerializer
 
 
@@ -55,45 +97,130 @@ class TagListView(generics.ListAPIView):
     serializer_class = TagSerializer
 
 
+def search_response(validated_data) -> dict:
+    """
+    اجرای جستجو و ساخت بدنه پاسخ (مشترک بین view های همزمان و async)
+    
+    یک نتیجه بیشتر از limit درخواست می‌شود تا وجود صفحه بعد مشخص شود. زمان
+    مراحل جستجو (میلی‌ثانیه) در timings پاسخ برگردانده می‌شود.
+    """
+    query = validated_data['query']
+    limit = validated_data['limit']
+    offset = validated_data['offset']
+    search_type = validated_data['search_type']
+    filters = SearchFilters.from_data(validated_data)
+    warning = None
+    started = time.perf_counter()
+    timings = {}
+    
+    try:
+        search_service = get_search_service()
+        documents = search_service.search(
+            query,
+            limit=limit + 1,
+            search_type=search_type,
+            nprobe=validated_data.get('nprobe'),
+            ef_search=validated_data.get('ef_search'),
+            offset=offset,
+            min_score=validated_data.get('min_score'),
+            filters=filters,
+            rerank=validated_data.get('rerank'),
+            timings=timings,
+        )
+        used_search_type = search_service.effective_search_type(search_type)
+    except Exception as e:
+        # Fallback به جستجوی واژگانی در صورت خطا
+        documents = lexical.search_documents(
+            query, limit + 1, offset=offset, queryset=filters.queryset() if filters else None
+        )
+        used_search_type = 'lexical' if lexical.is_available() else 'simple'
+        warning = f'Semantic search failed: {str(e)}'
+    
+    has_more = len(documents) > limit
+    documents = documents[:limit]
+    next_offset = offset + limit if has_more and offset + limit <= settings.SEARCH_MAX_OFFSET else None
+    
+    data = {
+        'query': query,
+        'results': serialize_results(documents, query, validated_data['view'], validated_data.get('fields')),
+        'count': len(documents),
+        'search_type': used_search_type,
+        'offset': offset,
+        'next_offset': next_offset,
+        'next_cursor': encode_search_cursor(query, search_type, next_offset) if next_offset is not None else None,
+    }
+    timings['total_ms'] = (time.perf_counter() - started) * 1000
+    data['timings'] = timings
+    if warning:
+        data['warning'] = warning
+    return data
+
+
 class DocumentSearchView(APIView):
-    """جستجوی معنایی و ساده در اسناد"""
+    """جستجوی معنایی، واژگانی (BM25) یا ترکیبی در اسناد، با امتیاز و صفحه‌بندی"""
     
     def post(self, request):
         serializer = DocumentSearchSerializer(data=request.data)
         if serializer.is_valid():
-            query = serializer.validated_data['query']
-            limit = serializer.validated_data['limit']
-            
-            try:
-                # استفاده از جستجوی معنایی
-                search_service = get_search_service()
-                documents = search_service.search_similar(query, limit=limit)
-                
-                doc_serializer = DocumentSerializer(documents, many=True)
-                return Response({
-                    'query': query,
-                    'results': doc_serializer.data,
-                    'count': len(documents),
-                    'search_type': 'semantic' if search_service.embedding_model else 'simple'
-                })
-            except Exception as e:
-                # Fallback به جستجوی ساده در صورت خطا
-                documents = Document.objects.filter(
-                    Q(title__icontains=query) | Q(content__icontains=query)
-                )[:limit]
-                
-                doc_serializer = DocumentSerializer(documents, many=True)
-                return Response({
-                    'query': query,
-                    'results': doc_serializer.data,
-                    'count': documents.count(),
-                    'search_type': 'simple',
-                    'warning': f'Semantic search failed: {str(e)}'
-                })
+            return Response(search_response(serializer.validated_data))
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class BatchDocumentSearchView(APIView):
+    """
+    جستجوی معنایی چند query در یک درخواست
+    
+    تمام query ها با یک فراخوانی encode و یک جستجوی FAISS پردازش می‌شوند و
+    اسناد نتایج با یک پرس‌وجو از دیتابیس خوانده می‌شوند.
+    """
+    
+    def post(self, request):
+        serializer = BatchSearchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        started = time.perf_counter()
+        queries = [(item['query'], item['limit']) for item in serializer.validated_data['queries']]
+        search_service = get_search_service()
+        timings = {}
+        results = search_service.search_similar_batch(
+            queries,
+            nprobe=serializer.validated_data.get('nprobe'),
+            ef_search=serializer.validated_data.get('ef_search'),
+            timings=timings,
+        )
+        
+        serialize_started = time.perf_counter()
+        response_results = [
+            {
+                'query': query,
+                'results': serialize_results(
+                    documents, query,
+                    serializer.validated_data['view'], serializer.validated_data.get('fields'),
+                ),
+                'count': len(documents),
+            }
+            for (query, _), documents in zip(queries, results)
+        ]
+        timings['serialize_ms'] = (time.perf_counter() - serialize_started) * 1000
+        timings['total_ms'] = (time.perf_counter() - started) * 1000
+        
+        return Response({
+            'results': response_results,
+            'count': len(response_results),
+            'search_type': search_service.effective_search_type(),
+            'timings': timings,
+        })
+
+
+class SearchCacheStatsView(APIView):
+    """آمار cache های جستجو (hit/miss و نسخه index)"""
+    
+    def get(self, request):
+        return Response(get_search_service().cache_info())
+
+
 class AskQuestionView(APIView):
     """پرسش و پاسخ با استفاده از LLM"""
     
@@ -102,18 +229,27 @@ class AskQuestionView(APIView):
         if serializer.is_valid():
             question = serializer.validated_data['question']
             document_ids = serializer.validated_data.get('document_ids', [])
+            use_cache = serializer.validated_data['use_cache']
             
             try:
                 # استفاده از سرویس Q&A
                 qa_service = get_qa_service()
-                answer, relevant_docs = qa_service.answer_question(question, document_ids)
+                result = qa_service.ask(
+                    question, document_ids, use_cache=use_cache,
+                    filters=SearchFilters.from_data(serializer.validated_data),
+                )
                 
                 return Response({
                     'question': question,
-                    'answer': answer,
-                    'relevant_documents': DocumentSerializer(relevant_docs, many=True).data,
-                    'documents_count': len(relevant_docs),
-                    'llm_used': qa_service.llm is not None
+                    'answer': result.answer,
+                    'relevant_documents': serialize_results(
+                        result.documents, question,
+                        serializer.validated_data['view'], serializer.validated_data.get('fields'),
+                    ),
+                    'documents_count': len(result.documents),
+                    'llm_used': result.llm_used,
+                    'cached': result.cached,
+                    'usage': result.usage,
                 })
             except Exception as e:
                 import traceback
@@ -126,3 +262,80 @@ class AskQuestionView(APIView):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+
+
+def _sse_event(event: str, data) -> str:
+    """قالب‌بندی یک رویداد server-sent events"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class AskQuestionStreamView(APIView):
+    """
+    پرسش و پاسخ به صورت جریانی (server-sent events)
+    
+    ابتدا رویداد documents با اسناد مرتبط، سپس رویدادهای token با تکه‌های پاسخ
+    و در پایان رویداد done ارسال می‌شوند.
+    
+    روی ASGI، Django پاسخ‌های جریانی با iterator همزمان را پیش از ارسال کامل
+    مصرف می‌کند؛ بنابراین در این حالت رویدادها با یک async generator روی
+    QAService.astream (و astream مدل) تولید می‌شوند.
+    """
+    
+    def post(self, request):
+        serializer = QuestionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        question = serializer.validated_data['question']
+        document_ids = serializer.validated_data.get('document_ids', [])
+        use_cache = serializer.validated_data['use_cache']
+        filters = SearchFilters.from_data(serializer.validated_data)
+        view, fields = serializer.validated_data['view'], serializer.validated_data.get('fields')
+        qa_service = get_qa_service()
+        
+        if isinstance(request._request, ASGIRequest):
+            # import محلی: async_views خودش از این ماژول import می‌کند
+            from .async_views import get_executor
+            
+            async def async_events():
+                executor = get_executor()
+                loop = asyncio.get_running_loop()
+                try:
+                    async for event, payload in qa_service.astream(
+                        question, document_ids, use_cache=use_cache, executor=executor, filters=filters,
+                    ):
+                        if event == 'documents':
+                            payload = {
+                                'relevant_documents': await loop.run_in_executor(
+                                    executor, serialize_results, payload, question, view, fields,
+                                ),
+                                'documents_count': len(payload),
+                            }
+                        yield _sse_event(event, payload)
+                except Exception as e:
+                    print(f"Error in AskQuestionStreamView: {e}")
+                    yield _sse_event('error', str(e))
+            
+            return self._event_stream_response(async_events())
+        
+        def events():
+            try:
+                for event, payload in qa_service.stream(question, document_ids, use_cache=use_cache, filters=filters):
+                    if event == 'documents':
+                        payload = {
+                            'relevant_documents': serialize_results(payload, question, view, fields),
+                            'documents_count': len(payload),
+                        }
+                    yield _sse_event(event, payload)
+            except Exception as e:
+                print(f"Error in AskQuestionStreamView: {e}")
+                yield _sse_event('error', str(e))
+        
+        return self._event_stream_response(events())
+    
+    def _event_stream_response(self, events):
+        response = StreamingHttpResponse(events, content_type='text/event-stream; charset=utf-8')
+        response['Cache-Control'] = 'no-cache'
+        # جلوگیری از buffer شدن پاسخ در nginx
+        response['X-Accel-Buffering'] = 'no'
+        return response